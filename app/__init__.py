@@ -8,6 +8,9 @@ from flask_pagedown import PageDown
 import flask_admin as admin
 from flask_admin.contrib import sqla
 from config import config
+from .cache import Cache
+from .sqlstats import QueryStats
+from .timeline import Timeline
 
 
 bootstrap = Bootstrap()
@@ -15,6 +18,11 @@ mail = Mail()
 moment = Moment()
 db = SQLAlchemy()
 pagedown = PageDown()
+timeline = Timeline()
+principals = Cache('principals', 'FLASKY_PRINCIPAL_CACHE_TTL')
+statistics_cache = Cache('statistics', 'FLASKY_STATISTICS_CACHE_TTL')
+memberships = Cache('memberships', 'FLASKY_MEMBERSHIP_CACHE_TTL')
+query_stats = QueryStats()
 
 # management
 
@@ -34,6 +42,26 @@ def create_app(config_name):
     db.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    timeline.init_app(app)
+    principals.init_app(app)
+    statistics_cache.init_app(app)
+    memberships.init_app(app)
+    query_stats.init_app(app)
+
+    from .markup import renderer
+    renderer.init_app(app)
+
+    from .email import outbox
+    outbox.init_app(app)
+
+    from .writebehind import checkins, last_seen
+    last_seen.init_app(app)
+    checkins.init_app(app)
+
+    from . import search
+
+    from .pagecache import page_cache
+    page_cache.init_app(app)
 
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
@@ -44,5 +72,9 @@ def create_app(config_name):
     from .club import club as club_blueprint
     app.register_blueprint(club_blueprint, url_prefix='/club')
 
+    if app.config['FLASKY_METRICS']:
+        from .metrics import metrics as metrics_blueprint
+        app.register_blueprint(metrics_blueprint, url_prefix='/metrics')
+
 
     return app
@@ -5,6 +5,7 @@ from . import auth
 from .. import db
 from ..models import User
 from ..email import send_email
+from ..writebehind import last_seen
 from .forms import LoginForm, RegistrationForm, ChangePasswordForm,\
     PasswordResetRequestForm, PasswordResetForm, ChangeEmailForm
 
@@ -12,7 +13,7 @@ from .forms import LoginForm, RegistrationForm, ChangePasswordForm,\
 @auth.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.ping()
+        last_seen.touch(current_user)
         if not current_user.confirmed \
                 and request.endpoint \
                 and request.blueprint != 'auth' \
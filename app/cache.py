@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class TTLCache(object):
+    """Thread-safe in-process mapping whose entries expire.
+
+    Entries older than ``timeout`` seconds are treated as missing and the
+    oldest entries are evicted once ``max_size`` is reached.  A timeout of
+    ``0`` disables the cache.  Hit and miss counts are kept for reporting.
+    """
+
+    def __init__(self, timeout, max_size=10000):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.time():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        if not self.timeout:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.timeout, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class Cache(object):
+    """Flask extension exposing a named :class:`TTLCache` per application.
+
+    The timeout is read from the ``timeout_config`` key of the app config
+    and every cache is registered in ``app.extensions['caches']`` so they
+    can be inspected together.
+    """
+
+    def __init__(self, name, timeout_config, app=None):
+        self.name = name
+        self.timeout_config = timeout_config
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        caches = app.extensions.setdefault('caches', {})
+        caches[self.name] = TTLCache(app.config[self.timeout_config])
+
+    @property
+    def cache(self):
+        return current_app.extensions['caches'][self.name]
+
+    @property
+    def enabled(self):
+        return bool(self.cache.timeout)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class LRUCache(object):
+    """Thread-safe mapping holding the ``max_size`` most recently used
+    entries, with hit and miss counts kept for reporting."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -1,44 +1,65 @@
 from flask import render_template, redirect, url_for, abort, flash, request, \
-    current_app, make_response
+    current_app, make_response, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy import or_, and_
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
 
+from app.conditional import Conditional
 from app.decorators import club_manager_required
 from app.main.forms import PostForm
+from app.pagination import paginate
 from . import club
 from .forms import ApplyForm, ClubCreateForm, AttendForm, ClubEditForm, ActivityForm, FinishActivityForm
 
-from .. import db
+from .. import db, rollup, statistics
+from ..pagecache import page_cache
+from ..writebehind import checkins
 from ..models import User, Club, Activity, ApplicationStatus, JoinApplication, \
     CreateApplication, Attend, AttendStatus, ActivityStatus, Post, Permission
 
 
+def render_clubs(query, page):
+    pagination = query.paginate(
+        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
+        error_out=False)
+    return render_template('club/_club_list.html', clubs=pagination.items,
+                           pagination=pagination)
+
+
 @club.route('/clubs')
+@page_cache.cached('FLASKY_CLUBS_CACHE_TTL', lambda: ['clubs'])
 def clubs():
     page = request.args.get('page', 1, type=int)
-    show_all_clubs = False
+    show_all_clubs = True
     if current_user.is_authenticated:
         show_all_clubs = bool(request.cookies.get('show_all_clubs', ''))
     if show_all_clubs:
-        query = Club.query
+        listing = page_cache.fragment(
+            'clubs:%d' % page, 'FLASKY_CLUBS_CACHE_TTL', ['clubs'],
+            lambda: render_clubs(Club.query, page))
     else:
-        query = current_user.clubs
-    pagination = query.paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
-    clubs = pagination.items
+        listing = render_clubs(current_user.clubs, page)
     return render_template('club/clubs.html',
                            show_all_clubs=show_all_clubs,
-                           clubs=clubs,
-                           pagination=pagination)
+                           listing=listing)
 
 
 @club.route('/club/<int:club_id>/<string:category>', methods=['POST', 'GET'])
+@page_cache.cached('FLASKY_CLUB_CACHE_TTL',
+                   lambda club_id, category: ['club:%d' % club_id])
 def club_detail(club_id, category):
     choices = ['ongoing', 'finished', 'reviewing', 'rejected']
     if category not in choices:
         abort(404)
-    club = Club.query.get_or_404(club_id)
+    # activities carry the viewer's attendance, which does not touch clubs
+    stamps = Club.query.outerjoin(Activity, Activity.club_id == Club.id) \
+        .with_entities(Club.updated_at, func.max(Activity.updated_at)) \
+        .filter(Club.id == club_id).group_by(Club.id).first_or_404()
+    conditional = Conditional(max([stamp for stamp in stamps if stamp] or
+                                  [None]), *stamps)
+    if conditional.not_modified():
+        return conditional.response()
+    club = Club.query.get(club_id)
     form = PostForm()
     if current_user.can(Permission.WRITE) and form.validate_on_submit():
         post = Post(body=form.body.data,
@@ -61,33 +82,35 @@ def club_detail(club_id, category):
         elif category == 'rejected':
             activities = Activity.query.filter_by(club_id=club_id). \
                 filter_by(status=ActivityStatus.rejected)
+    elif category in ('reviewing', 'rejected'):
+        abort(404)
     if category == 'ongoing':
         activities = Activity.query.filter_by(club_id=club_id). \
-            filter(or_(Activity.status == ActivityStatus.accepted, ActivityStatus == ActivityStatus.rollcall))
+            filter(or_(Activity.status == ActivityStatus.accepted,
+                       Activity.status == ActivityStatus.rollcall))
     elif category == 'finished':
         activities = Activity.query.filter_by(club_id=club_id). \
             filter_by(status=ActivityStatus.finished)
-    page = request.args.get('page', 1, type=int)
-    query = club.posts
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
-    return render_template('club/club_detail.html',
-                           club=club,
-                           management=management,
-                           activities=activities,
-                           category=category,
-                           posts=posts,
-                           pagination=pagination,
-                           form=form
-                           )
+    activities = activities.all()
+    attend_statuses = current_user.attend_statuses(
+        activity.id for activity in activities)
+    pagination = paginate(club.posts, Post,
+                          current_app.config['FLASKY_POSTS_PER_PAGE'])
+    posts = Post.load_listing(pagination.items)
+    return conditional.response(render_template('club/club_detail.html',
+                                                club=club,
+                                                management=management,
+                                                activities=activities,
+                                                attend_statuses=attend_statuses,
+                                                category=category,
+                                                posts=posts,
+                                                pagination=pagination,
+                                                form=form))
 
 
 @club.route('/club_edit/<int:club_id>', methods=['POST', 'GET'])
 @club_manager_required
-def club_edit(club_id):
-    club = Club.query.get_or_404(club_id)
+def club_edit(club_id, club):
     form = ClubEditForm(name=club.name, description=club.description)
     if form.validate_on_submit():
         name = form.name.data
@@ -142,7 +165,7 @@ def apply(club_id):
 @club.route('/join_management/<int:club_id>/<string:category>')
 @login_required
 @club_manager_required
-def join_management(club_id, category):
+def join_management(club_id, category, club):
     choices = ['reviewing', 'reviewed']
     if category not in choices:
         abort(404)
@@ -170,12 +193,11 @@ def join_management(club_id, category):
 @club.route('/handle_application/<string:category>/<int:club_id>/<int:application_id>')
 @login_required
 @club_manager_required
-def handle_application(category, club_id, application_id):
+def handle_application(category, club_id, application_id, club):
     choices = ['accept', 'reject']
     if category not in choices:
         abort(404)
     application = JoinApplication.query.filter_by(id=application_id).first()
-    club = Club.query.filter_by(id=club_id).first()
     if category == choices[0]:
         application.status = ApplicationStatus.accepted
         application.user.clubs.append(club)
@@ -216,15 +238,26 @@ def apply_to_create():
 @login_required
 def apply_to_attend(activity_id):
     activity = Activity.query.get_or_404(activity_id)
-    attend = current_user.activities.filter_by(activity=activity).first()
-    if attend:
-        flash('您已经申请过这个活动！(状态:{})'.format(attend.get_status_text()))
+    status = current_user.attend_statuses([activity.id]).get(activity.id)
+    if status:
+        flash('您已经申请过这个活动！(状态:{})'.format(status.text))
         return redirect(url_for('.activity_detail', activity_id=activity.id))
     form = AttendForm()
     if form.validate_on_submit():
         attend = Attend(user=current_user, activity=activity)
         db.session.add(attend)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            # only a concurrent application for the same activity is
+            # expected here; anything else is a real error
+            if activity_id not in current_user.attend_statuses(
+                    [activity_id]):
+                raise
+            flash('您已经申请过这个活动！')
+            return redirect(url_for('.activity_detail',
+                                    activity_id=activity_id))
         flash('您的申请已经提交成功,清等待审核!')
         return redirect(url_for('.activity_detail', activity_id=activity.id))
 
@@ -256,8 +289,8 @@ def activities(category):
     if category not in choices:
         abort(404)
     if category == 'ongoing':
-        club_ids = [club.id for club in current_user.clubs]
-        query = Activity.query.filter(Activity.club_id.in_(club_ids)). \
+        query = Activity.query.filter(
+            Activity.club_id.in_(current_user.joined_club_ids)). \
             filter_by(status=ActivityStatus.accepted)
     elif category == 'attended':
         query = Activity.query.join(Attend).filter(Attend.user == current_user). \
@@ -274,28 +307,42 @@ def activities(category):
             filter(Activity.id == Attend.activity_id). \
             filter(Attend.status == AttendStatus.rejected)
     elif category == 'all':
-        club_ids = [club.id for club in current_user.clubs]
-        query = Activity.query.filter(Activity.club_id.in_(club_ids))
+        query = Activity.query.filter(
+            Activity.club_id.in_(current_user.joined_club_ids))
+    conditional = Conditional(*query.with_entities(
+        func.max(Activity.updated_at), func.count(Activity.id)).one())
+    if conditional.not_modified():
+        return conditional.response()
     pagination = query.paginate(
         page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
         error_out=False
     )
     activities = pagination.items
-    return render_template('club/activities.html',
-                           category=category,
-                           activities=activities,
-                           pagination=pagination)
+    attend_statuses = current_user.attend_statuses(
+        activity.id for activity in activities)
+    return conditional.response(render_template('club/activities.html',
+                                                category=category,
+                                                activities=activities,
+                                                attend_statuses=attend_statuses,
+                                                pagination=pagination))
 
 
 @club.route('/activity/<int:activity_id>')
 def activity_detail(activity_id):
-    activity = Activity.query.get_or_404(activity_id)
-    attend = Attend.query.filter_by(activity_id=activity.id,
-                                    user_id=current_user.id).first()
+    stamps = Activity.query.outerjoin(Activity.club) \
+        .with_entities(Activity.updated_at, Club.updated_at) \
+        .filter(Activity.id == activity_id).first_or_404()
+    conditional = Conditional(max([stamp for stamp in stamps if stamp] or
+                                  [None]), *stamps)
+    if conditional.not_modified():
+        return conditional.response()
+    activity = Activity.query.get(activity_id)
+    attend_status = current_user.attend_statuses([activity.id]) \
+        .get(activity.id)
     rollcall = None
     if activity.status == ActivityStatus.rollcall:
-        if attend:
-            if attend.status == AttendStatus.attended:
+        if attend_status:
+            if attend_status == AttendStatus.attended:
                 rollcall = 'attended'
             else:
                 rollcall = 'notattended'
@@ -311,12 +358,12 @@ def activity_detail(activity_id):
     management = False
     if current_user == activity.club.chief:
         management = True
-    return render_template('club/activity_detail.html',
-                           activity=activity,
-                           attend=attend,
-                           status=status,
-                           management=management,
-                           rollcall=rollcall)
+    return conditional.response(render_template('club/activity_detail.html',
+                                                activity=activity,
+                                                attend_status=attend_status,
+                                                status=status,
+                                                management=management,
+                                                rollcall=rollcall))
 
 
 @club.route('/activity_management/<int:activity_id>/<string:category>')
@@ -368,11 +415,14 @@ def finish_activity(activity_id):
     activity = Activity.query.get_or_404(activity_id)
     if current_user != activity.club.chief:
         abort(403)
-    if activity.status != ActivityStatus.accepted:
+    if activity.status not in (ActivityStatus.accepted,
+                               ActivityStatus.rollcall):
         flash('活动不再进行中！')
         return redirect(url_for('.activity_detail', activity_id=activity_id))
     form = FinishActivityForm()
     if form.validate_on_submit():
+        # buffered check-ins are refused once roll call is over
+        checkins.flush(activity_id)
         activity.status = ActivityStatus.finished
         activity.conclusion = form.description.data
         db.session.add(activity)
@@ -424,6 +474,44 @@ def rollcall(activity_id):
                             activity_id=activity_id))
 
 
+def checkin_refused(activity_id):
+    """The response to a check-in the current user cannot make now, or
+    ``None`` when they are an accepted participant of a roll call."""
+    statuses = db.session.query(Activity.status, Attend.status) \
+        .outerjoin(Attend, and_(Attend.activity_id == Activity.id,
+                                Attend.user_id == current_user.id)) \
+        .filter(Activity.id == activity_id).first()
+    if statuses is None:
+        return jsonify({'error': 'not found'}), 404
+    activity_status, status = statuses
+    if status == AttendStatus.attended:
+        return jsonify({'status': 'attended'})
+    if activity_status != ActivityStatus.rollcall:
+        return jsonify({'error': 'not rollcalling'}), 409
+    if status != AttendStatus.accepted:
+        return jsonify({'error': 'not an accepted participant'}), 403
+
+
+@club.route('/api/checkin/<int:activity_id>', methods=['POST'])
+@login_required
+def checkin(activity_id):
+    if checkins.enabled:
+        refused = checkin_refused(activity_id)
+        if refused:
+            return refused
+        checkins.add(activity_id, current_user.id)
+        return jsonify({'status': 'queued'}), 202
+    changes = Attend.check_in(activity_id, [current_user.id])
+    if changes:
+        rollup.moved(db.session.connection(), activity_id, changes)
+        page_cache.activities_changed([activity_id])
+        db.session.commit()
+        return jsonify({'status': 'attended'})
+    # Nothing was updated: work out why only on this cold path.
+    return checkin_refused(activity_id) or \
+        (jsonify({'error': 'changed concurrently'}), 409)
+
+
 @club.route('/<int:activity_id>/roll_call', methods=['POST', 'GET'])
 @login_required
 def rollcall_chief(activity_id):
@@ -431,23 +519,22 @@ def rollcall_chief(activity_id):
     if current_user != activity.club.chief:
         abort(403)
 
-    attends = Attend.query.filter(
-        or_(Attend.status == AttendStatus.accepted,
-            Attend.status == AttendStatus.attended)
-    )
     if request.method == 'POST':
-        print('post')
-        for attend in attends:
-            if request.form.get(str(attend.id)):
-                attend.status = AttendStatus.attended
-            else:
-                attend.status = AttendStatus.accepted
-            db.session.add(attend)
+        # buffered check-ins must not overwrite the chief's roll call later
+        checkins.flush(activity_id)
+        attended_ids = [int(key) for key in request.form if key.isdigit()]
+        changes = Attend.rollcall(activity.id, attended_ids)
+        rollup.moved(db.session.connection(), activity.id, changes)
+        page_cache.changed(['club:%d' % activity.club_id])
         db.session.commit()
         flash('点名结果已经保存！')
         return redirect(url_for('.rollcall_chief',
                                 activity_id=activity_id))
 
+    attends = Attend.query.filter_by(activity_id=activity.id).filter(
+        or_(Attend.status == AttendStatus.accepted,
+            Attend.status == AttendStatus.attended)
+    ).options(db.joinedload(Attend.user))
     return render_template('club/rollcall_chief.html',
                            attends=attends,
                            AttendStatus=AttendStatus,
@@ -585,6 +672,7 @@ def show_my_clubs():
 
 
 @club.route('/about')
+@page_cache.cached('FLASKY_ABOUT_CACHE_TTL')
 def about():
     return render_template('club/about.html')
 
@@ -600,11 +688,7 @@ def admin():
 @club.route('/statistics/student')
 @login_required
 def student_info():
-    info = {}
-    for club in current_user.clubs:
-        activity_ids = [activity.id for activity in club.activities]
-        info[club.name] = Attend.query. \
-            filter(Attend.user == current_user, Attend.activity_id.in_(activity_ids)).count()
+    info = statistics.student_attendance(current_user.id)
     bar_labels = info.keys()
     bar_values = info.values()
     return render_template('club/student_info.html',
@@ -618,20 +702,13 @@ def student_info():
 @login_required
 def club_info(club_id, category):
     club = Club.query.get_or_404(club_id)
-    activity_ids = [activity.id for activity in club.activities]
     info = {}
     if category == 'members':
         title = '成员统计'
-        for member in club.members:
-            info[member.name] = Attend.query.filter(
-                and_(Attend.activity_id.in_(activity_ids),
-                     Attend.user == member)).count()
+        info = statistics.club_member_attendance(club_id)
     elif category == 'activities':
         title = '活动统计'
-        for activity in club.activities:
-            info[activity.name] = Attend.query.filter(
-                Attend.activity == activity
-            ).count()
+        info = statistics.club_activity_attendance(club_id)
 
     bar_labels = info.keys()
     bar_values = info.values()
@@ -645,16 +722,13 @@ def club_info(club_id, category):
 @club.route('/statistics/admin')
 @login_required
 def admin_info():
-    info = {}
-    for club in Club.query.all():
-        activity_ids = [activity.id for activity in club.activities]
-        info[club.name] = Attend.query.filter(Attend.activity_id.in_(activity_ids)).count()
+    info = statistics.club_attendance()
 
     title = '社团活跃度'
     bar_labels = info.keys()
     bar_values = info.values()
     return render_template('club/admin_info.html',
-                           title=title, max=max(bar_values),
+                           title=title, max=max(bar_values, default=0),
                            labels=bar_labels,
                            values=bar_values,
                            info=info)
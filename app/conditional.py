@@ -0,0 +1,63 @@
+import hashlib
+import time
+
+from flask import current_app, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+
+class Conditional(object):
+    """ETag and Last-Modified validation of a page from version stamps.
+
+    ``last_modified`` is the newest ``updated_at`` the page depends on and
+    ``key`` any other values it is built from, such as row counts.  The
+    ETag also covers the URL, the current user and the session's CSRF
+    token, since pages render buttons and forms for the viewer; it
+    changes every half ``WTF_CSRF_TIME_LIMIT`` so that a revalidated form
+    never carries an expired token.  Views look the stamps up first and
+    skip their queries and rendering when :meth:`not_modified` is true::
+
+        conditional = Conditional(updated_at, count)
+        if conditional.not_modified():
+            return conditional.response()
+        ...
+        return conditional.response(render_template(...))
+    """
+
+    def __init__(self, last_modified, *key):
+        self.last_modified = last_modified.replace(microsecond=0) \
+            if last_modified is not None else None
+        user = csrf = None
+        if current_user.is_authenticated:
+            user = current_user.get_id()
+            generate_csrf()
+            csrf = session.get('csrf_token')
+            limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+            if limit:
+                csrf = (csrf, int(time.time()) // max(limit // 2, 1))
+        parts = (request.full_path, user, csrf, last_modified) + key
+        self.etag = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def not_modified(self):
+        if request.method not in ('GET', 'HEAD') or \
+                session.get('_flashes'):
+            return False
+        if request.if_none_match:
+            return request.if_none_match.contains(self.etag)
+        since = request.if_modified_since
+        return since is not None and self.last_modified is not None and \
+            self.last_modified <= since.replace(tzinfo=None)
+
+    def response(self, rv=None):
+        """The ``304`` response, or ``rv`` with the validators attached."""
+        if rv is None:
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(rv)
+        response.set_etag(self.etag)
+        if self.last_modified is not None:
+            response.last_modified = self.last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
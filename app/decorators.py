@@ -1,6 +1,7 @@
 from functools import wraps
 from flask import abort
 from flask_login import current_user
+from .loader import load_or_404
 from .models import Permission, Club
 
 
@@ -20,10 +21,13 @@ def admin_required(f):
 
 
 def club_manager_required(f):
+    """Only let the chief and vice of the ``club_id`` club in, passing the
+    loaded club to the view as ``club``."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        club = Club.query.get_or_404(kwargs.get('club_id'))
-        if current_user not in [club.chief, club.vice]:
+        club = load_or_404(Club, kwargs.get('club_id'))
+        if not current_user.is_authenticated or \
+                current_user.id not in (club.chief_id, club.vice_id):
             abort(403)
-        return f(*args, **kwargs)
+        return f(*args, club=club, **kwargs)
     return decorated_function
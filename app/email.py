@@ -1,12 +1,145 @@
-from threading import Thread
+import atexit
+import os
+import queue
+import socket
+import smtplib
+import threading
+import time
+import uuid
+import weakref
 from flask import current_app, render_template
 from flask_mail import Message
 from . import mail
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+class MailQueue(object):
+    """Bounded queue of outgoing messages drained by a small worker pool.
+
+    ``FLASKY_MAIL_WORKERS`` daemon threads are started on the first send.
+    Each worker takes up to ``FLASKY_MAIL_BATCH_SIZE`` queued messages and
+    delivers them over a single SMTP session, retrying a failed batch
+    ``FLASKY_MAIL_RETRIES`` times with exponential backoff starting at
+    ``FLASKY_MAIL_RETRY_DELAY`` seconds.  When the queue already holds
+    ``FLASKY_MAIL_QUEUE_SIZE`` messages the message is delivered in the
+    calling request instead of spawning more threads.
+
+    When ``FLASKY_MAIL_SINK`` names a directory messages are written there
+    as ``.eml`` files instead of being sent, which keeps development and
+    tests offline.  Pointing ``MAIL_SERVER`` at ``python -m smtpd -n -c
+    DebuggingServer localhost:1025`` is the SMTP equivalent.
+    """
+
+    def __init__(self, app=None):
+        # joined once per process, only for the apps still alive at exit
+        self._apps = weakref.WeakSet()
+        atexit.register(self._join_apps)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['mail_queue'] = {
+            'queue': queue.Queue(app.config['FLASKY_MAIL_QUEUE_SIZE']),
+            'workers': [],
+            'lock': threading.Lock(),
+        }
+        self._apps.add(app)
+
+    @property
+    def state(self):
+        return current_app.extensions['mail_queue']
+
+    @property
+    def queue(self):
+        return self.state['queue']
+
+    def put(self, msg):
+        app = current_app._get_current_object()
+        self._start_workers(app)
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            self.deliver(app, [msg])
+
+    def join(self):
+        """Block until every queued message has been handled."""
+        self.queue.join()
+
+    def deliver(self, app, messages):
+        """Send ``messages`` over one connection, retrying with backoff."""
+        with app.app_context():
+            sink = app.config['FLASKY_MAIL_SINK']
+            retries = app.config['FLASKY_MAIL_RETRIES']
+            delay = app.config['FLASKY_MAIL_RETRY_DELAY']
+            pending = list(messages)
+            for attempt in range(retries + 1):
+                try:
+                    if sink:
+                        self._write(sink, pending)
+                    else:
+                        with mail.connect() as connection:
+                            while pending:
+                                connection.send(pending[0])
+                                pending.pop(0)
+                    return
+                except (smtplib.SMTPException, socket.error) as e:
+                    if attempt == retries:
+                        app.logger.error('Dropped %d message(s): %s',
+                                         len(pending), e)
+                        return
+                    time.sleep(delay * 2 ** attempt)
+
+    def _write(self, sink, messages):
+        if not os.path.isdir(sink):
+            os.makedirs(sink)
+        while messages:
+            name = '%d-%s.eml' % (time.time() * 1000, uuid.uuid4().hex)
+            with open(os.path.join(sink, name), 'wb') as f:
+                f.write(messages[0].as_bytes())
+            messages.pop(0)
+
+    def _start_workers(self, app):
+        state = app.extensions['mail_queue']
+        if state['workers']:
+            return
+        with state['lock']:
+            while len(state['workers']) < app.config['FLASKY_MAIL_WORKERS']:
+                worker = threading.Thread(target=self._work, args=[app])
+                worker.daemon = True
+                worker.start()
+                state['workers'].append(worker)
+
+    def _work(self, app):
+        q = app.extensions['mail_queue']['queue']
+        batch_size = app.config['FLASKY_MAIL_BATCH_SIZE']
+        while True:
+            batch = [q.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.deliver(app, batch)
+            except Exception:
+                app.logger.exception('Mail delivery failed')
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+    def _join_app(self, app):
+        state = app.extensions['mail_queue']
+        if state['workers']:
+            state['queue'].join()
+        elif not state['queue'].empty():
+            app.logger.error('Dropped %d queued message(s) with no workers',
+                             state['queue'].qsize())
+
+    def _join_apps(self):
+        for app in list(self._apps):
+            self._join_app(app)
+
+
+outbox = MailQueue()
 
 
 def send_email(to, subject, template, **kwargs):
@@ -15,6 +148,5 @@ def send_email(to, subject, template, **kwargs):
                   sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    outbox.put(msg)
+    return msg
@@ -1,152 +1,290 @@
+import hashlib
 import random
-from random import randint
-from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
 from faker import Faker
-from . import db
-from .models import User, Role, Post, Club, Activity, Attend, JoinApplication, ActivityStatus
-
-
-def users(count=20):
-    fake = Faker()
-    i = 0
-    student = User(email='student@test.com',
-                   username='student',
-                   password='student',
-                   confirmed=True,
-                   name='王同学',
-                   location='Zhengzhou',
-                   about_me=fake.text(),
-                   member_since=fake.past_date())
-    chief = User(email='chief@test.com',
-                 username='chief',
-                 password='chief',
-                 confirmed=True,
-                 name='李同学',
-                 location='Zhengzhou',
-                 about_me=fake.text(),
-                 member_since=fake.past_date())
-    chairman = User(email='chairman@test.com',
-                    username='chairman',
-                    password='chairman',
-                    confirmed=True,
-                    name='吴主席',
-                    location='zzz',
-                    about_me=fake.text(),
-                    is_chairman=True,
-                    member_since=fake.past_date())
-
-    db.session.add(student)
-    db.session.add(chief)
-    db.session.add(chairman)
-    db.session.commit()
-    while i < count:
-        u = User(email=fake.email(),
-                 username=fake.user_name(),
-                 password='password',
-                 confirmed=True,
-                 name=fake.name(),
-                 location=fake.city(),
-                 about_me=fake.text(),
-                 member_since=fake.past_date())
-        db.session.add(u)
-        try:
-            db.session.commit()
-            i += 1
-        except IntegrityError:
-            db.session.rollback()
-
-
-def posts(count=100):
-    fake = Faker()
-    user_count = User.query.count()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        p = Post(body=fake.text(),
-                 timestamp=fake.past_date(),
-                 author=u)
-        db.session.add(p)
-    db.session.commit()
-
-
-def clubs(count=100):
-    fake = Faker()
-    chief = User.query.filter_by(username='chief').first()
-    c = Club(name='篮球社',
-             description='打篮球',
-             chief=chief)
-    chief.clubs.append(c)
-    db.session.add(chief)
-    db.session.add(c)
-    db.session.commit()
-
-    for i in range(count):
-        c = Club(name=fake.name(),
-                 description=fake.text())
-        db.session.add(c)
-        try:
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-
-
-def apply_to_joins(count=5):
-    fake = Faker()
-    for u in User.query.all():
-        if u.email == 'chief@test.com':
-            continue
-        c = Club.query.filter_by(name='篮球社').first()
-        apply = JoinApplication(user=u,
-                                club=c,
-                                description=fake.text())
-        db.session.add(apply)
+from werkzeug.security import generate_password_hash
+from . import db, rollup, search
+from .markup import COMMENT_TAGS, POST_TAGS, render
+from .models import User, Role, Follow, Post, Comment, Club, Activity, \
+    Attend, JoinApplication, ActivityStatus, AttendStatus, joins
+
+ACTIVITY_STATUS_WEIGHTS = {
+    ActivityStatus.accepted: 3,
+    ActivityStatus.rejected: 1,
+    ActivityStatus.finished: 4,
+    ActivityStatus.reviewing: 2,
+}
+ATTEND_STATUS_WEIGHTS = {
+    AttendStatus.reviewing: 1,
+    AttendStatus.accepted: 2,
+    AttendStatus.rejected: 1,
+    AttendStatus.attended: 4,
+}
+
+
+class Seeder(object):
+    """Bulk generator of a deterministic, production shaped dataset.
+
+    Rows are written with Core ``insert()`` batches of ``batch_size`` and
+    explicit primary keys, so nothing is read back while seeding.  Text
+    comes from a pool of ``pool_size`` Faker values of ``locale`` rendered
+    once, every generated account shares one password hash, and the same
+    ``seed`` always produces the same rows.
+
+    ``skew`` shapes popularity: authors of posts and comments, followed
+    users and joined clubs are drawn as ``int(n * random() ** skew)``, so
+    ``1`` is uniform and larger values concentrate activity on the oldest
+    users and clubs.  Per-row counts are averages drawn uniformly from
+    ``0`` to twice the given value.
+    """
+
+    def __init__(self, users=20, clubs=100, posts=100, comments=0,
+                 follows_per_user=0, clubs_per_user=3,
+                 activities_per_club=10, attends_per_user=3,
+                 applications=None, skew=1.0, seed=0, batch_size=10000,
+                 pool_size=1000, password='password',
+                 activity_status_weights=None, attend_status_weights=None,
+                 locale=None):
+        self.counts = {'users': users, 'clubs': clubs, 'posts': posts,
+                       'comments': comments}
+        self.follows_per_user = follows_per_user
+        self.clubs_per_user = clubs_per_user
+        self.activities_per_club = activities_per_club
+        self.attends_per_user = attends_per_user
+        self.application_count = users if applications is None \
+            else applications
+        self.skew = skew
+        self.batch_size = batch_size
+        self.activity_status_weights = \
+            activity_status_weights or ACTIVITY_STATUS_WEIGHTS
+        self.attend_status_weights = \
+            attend_status_weights or ATTEND_STATUS_WEIGHTS
+        self.rng = random.Random(seed)
+        self.now = datetime(2019, 1, 1)
+
+        fake = Faker(locale)
+        fake.seed(seed)
+        self.pool = {
+            'name': [fake.name() for _ in range(pool_size)],
+            'city': [fake.city() for _ in range(pool_size)],
+            'text': [fake.text() for _ in range(pool_size)],
+        }
+        self.post_html = [render(text, POST_TAGS)
+                          for text in self.pool['text']]
+        self.comment_html = [render(text, COMMENT_TAGS)
+                             for text in self.pool['text']]
+        self.password_hash = generate_password_hash(password)
+
+    def run(self):
+        Role.insert_roles()
+        self.role_id = Role.query.filter_by(default=True).first().id
+        self.users()
+        self.follows()
+        self.clubs()
+        self.joins()
+        self.applications()
+        self.activities()
+        self.attends()
+        self.posts()
+        self.comments()
+        rollup.rebuild()
+        search.rebuild()
+        User.repair_counters()
+        db.session.commit()
+
+    # helpers
+
+    def insert(self, table, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                db.session.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            db.session.execute(table.insert(), batch)
         db.session.commit()
 
+    def next_id(self, model):
+        return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+    def pick(self, ids):
+        return ids[int(len(ids) * self.rng.random() ** self.skew)]
+
+    def sample(self, ids, average):
+        wanted = min(len(ids), self.rng.randint(0, 2 * average))
+        chosen = set()
+        for _ in range(20 * wanted):
+            if len(chosen) == wanted:
+                break
+            chosen.add(self.pick(ids))
+        return chosen
+
+    def weighted(self, weights):
+        return self.rng.choices(list(weights), list(weights.values()))[0]
+
+    def text(self):
+        return self.rng.randrange(len(self.pool['text']))
+
+    def past(self, days=365):
+        return self.now - timedelta(seconds=self.rng.randrange(days * 86400))
+
+    # tables
+
+    def users(self):
+        start = self.next_id(User)
+        demo = [('student', '王同学', 'Zhengzhou', False),
+                ('chief', '李同学', 'Zhengzhou', False),
+                ('chairman', '吴主席', 'zzz', True)]
+        self.demo = {}
+        count = self.counts['users']
+
+        def rows():
+            for i, (username, name, location, chairman) in enumerate(demo):
+                self.demo[username] = start + i
+                email = '%s@test.com' % username
+                yield self.user_row(start + i, email, username, name,
+                                    location, generate_password_hash(username),
+                                    chairman)
+            for i in range(len(demo), len(demo) + count):
+                email = 'user%d@example.com' % (start + i)
+                yield self.user_row(start + i, email, 'user%d' % (start + i),
+                                    self.rng.choice(self.pool['name']),
+                                    self.rng.choice(self.pool['city']),
+                                    self.password_hash, False)
+        self.insert(User.__table__, rows())
+        self.user_ids = list(range(start, start + len(demo) + count))
+
+    def user_row(self, user_id, email, username, name, location,
+                 password_hash, chairman):
+        return {'id': user_id, 'email': email, 'username': username,
+                'role_id': self.role_id, 'password_hash': password_hash,
+                'confirmed': True, 'name': name, 'location': location,
+                'about_me': self.pool['text'][self.text()],
+                'member_since': self.past(), 'last_seen': self.past(30),
+                'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest(),
+                'is_chairman': chairman}
+
+    def follows(self):
+        def rows():
+            for user_id in self.user_ids:
+                followed = self.sample(self.user_ids, self.follows_per_user)
+                followed.add(user_id)
+                for followed_id in followed:
+                    yield {'follower_id': user_id, 'followed_id': followed_id,
+                           'timestamp': self.past()}
+        self.insert(Follow.__table__, rows())
+
+    def clubs(self):
+        start = self.next_id(Club)
+
+        self.chiefs = {start: self.demo['chief']}
+
+        def rows():
+            yield {'id': start, 'name': '篮球社', 'description': '打篮球',
+                   'chief_id': self.demo['chief']}
+            for club_id in range(start + 1, start + self.counts['clubs'] + 1):
+                self.chiefs[club_id] = self.rng.choice(self.user_ids)
+                yield {'id': club_id,
+                       'name': '%s %d' % (self.rng.choice(self.pool['name']),
+                                          club_id),
+                       'description': self.pool['text'][self.text()],
+                       'chief_id': self.chiefs[club_id]}
+        self.insert(Club.__table__, rows())
+        self.club_ids = list(range(start, start + self.counts['clubs'] + 1))
+
+    def joins(self):
+        self.joined = {}
+        led = {}
+        for club_id, chief_id in self.chiefs.items():
+            led.setdefault(chief_id, set()).add(club_id)
+
+        def rows():
+            for user_id in self.user_ids:
+                clubs = self.sample(self.club_ids, self.clubs_per_user)
+                clubs.update(led.get(user_id, ()))
+                self.joined[user_id] = sorted(clubs)
+                for club_id in self.joined[user_id]:
+                    yield {'user_id': user_id, 'club_id': club_id,
+                           'timestamp': self.past()}
+        self.insert(joins, rows())
+
+    def applications(self):
+        applicants = [user_id for user_id in self.user_ids
+                      if user_id != self.demo['chief']]
+        self.insert(JoinApplication.__table__, (
+            {'user_id': user_id, 'club_id': self.club_ids[0],
+             'description': self.pool['text'][self.text()],
+             'timestamp': self.past(30)}
+            for user_id in applicants[:self.application_count]))
+
+    def activities(self):
+        start = self.next_id(Activity)
+        self.club_activities = {}
+
+        def rows():
+            activity_id = start
+            for club_id in self.club_ids:
+                count = self.rng.randint(0, 2 * self.activities_per_club)
+                self.club_activities[club_id] = \
+                    range(activity_id, activity_id + count)
+                for _ in range(count):
+                    yield {'id': activity_id,
+                           'name': self.rng.choice(self.pool['name']),
+                           'description': self.pool['text'][self.text()],
+                           'status': self.weighted(
+                               self.activity_status_weights),
+                           'club_id': club_id}
+                    activity_id += 1
+        self.insert(Activity.__table__, rows())
+
+    def attends(self):
+        def rows():
+            for user_id in self.user_ids:
+                activity_ids = [activity_id
+                                for club_id in self.joined[user_id]
+                                for activity_id in
+                                self.club_activities[club_id]]
+                wanted = self.rng.randint(0, 2 * self.attends_per_user)
+                for activity_id in self.rng.sample(
+                        activity_ids, min(wanted, len(activity_ids))):
+                    yield {'user_id': user_id, 'activity_id': activity_id,
+                           'timestamp': self.past(),
+                           'status': self.weighted(
+                               self.attend_status_weights)}
+        self.insert(Attend.__table__, rows())
+
+    def posts(self):
+        start = self.next_id(Post)
+
+        def rows():
+            for post_id in range(start, start + self.counts['posts']):
+                author_id = self.pick(self.user_ids)
+                clubs = self.joined[author_id]
+                text = self.text()
+                yield {'id': post_id, 'body': self.pool['text'][text],
+                       'body_html': self.post_html[text],
+                       'timestamp': self.past(), 'author_id': author_id,
+                       'club_id': self.rng.choice(clubs)
+                       if clubs and self.rng.random() < 0.5 else None}
+        self.insert(Post.__table__, rows())
+        self.post_ids = list(range(start, start + self.counts['posts']))
+
+    def comments(self):
+        if not self.post_ids:
+            return
+
+        def rows():
+            for _ in range(self.counts['comments']):
+                text = self.text()
+                yield {'body': self.pool['text'][text],
+                       'body_html': self.comment_html[text],
+                       'timestamp': self.past(), 'disabled': False,
+                       'author_id': self.pick(self.user_ids),
+                       'post_id': self.pick(self.post_ids)}
+        self.insert(Comment.__table__, rows())
+
 
-def joins(count=3):
-    for u in User.query.all():
-        clubs = Club.query.all()
-        sample = random.sample(clubs,
-                               min(len(clubs), count))
-        for c in sample:
-            u.clubs.append(c)
-        db.session.add(u)
-    db.session.commit()
-
-
-def activities(count=10):
-    fake = Faker()
-    for c in Club.query.all():
-        for i in range(count):
-            activity = Activity(name=fake.name(),
-                                description=fake.text(),
-                                club=c,
-                                status=random.choice([
-                                    ActivityStatus.accepted,
-                                    ActivityStatus.rejected,
-                                    ActivityStatus.finished,
-                                    ActivityStatus.reviewing
-                                ]))
-            db.session.add(activity)
-    db.session.commit()
-
-
-def attends(count=3):
-    for u in User.query.all():
-        clubs = u.clubs.all()
-        sample = random.sample(clubs, min(count, len(clubs)))
-        for c in sample:
-            activity = c.activities.first()
-            attend = Attend(activity=activity, user=u)
-        db.session.add(attend)
-    db.session.commit()
-
-
-def init():
-    Role.insert_roles()
-    users()
-    posts()
-    clubs()
-    apply_to_joins()
-    joins()
-    activities()
-    attends()
+def init(**kwargs):
+    """Seed the database; see :class:`Seeder` for the options."""
+    Seeder(**kwargs).run()
@@ -0,0 +1,27 @@
+from flask import abort, g
+
+from . import db
+
+
+def load(model, id):
+    """Return the ``model`` row with primary key ``id``, or ``None``.
+
+    Rows are remembered in ``g`` for the rest of the request, so a
+    decorator and the view it wraps share one instance and one query.
+    """
+    loaded = g.setdefault('loaded', {})
+    key = (model, id)
+    if key not in loaded:
+        loaded[key] = model.query.get(id) if id is not None else None
+    obj = loaded[key]
+    if obj is not None and obj not in db.session:
+        # the session was removed since, load the row again
+        obj = loaded[key] = model.query.get(id)
+    return obj
+
+
+def load_or_404(model, id):
+    obj = load(model, id)
+    if obj is None:
+        abort(404)
+    return obj
@@ -4,9 +4,11 @@ from flask_login import login_required, current_user
 from . import main
 from .forms import EditProfileForm, EditProfileAdminForm, PostForm,\
     CommentForm
-from .. import db
+from .. import db, search as full_text, timeline
 from ..models import Permission, Role, User, Post, Comment
 from ..decorators import admin_required, permission_required
+from ..pagecache import page_cache
+from ..pagination import paginate
 
 
 @main.route('/', methods=['GET', 'POST'])
@@ -18,32 +20,44 @@ def index():
         db.session.add(post)
         db.session.commit()
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
-    if show_followed:
-        query = current_user.followed_posts
+    per_page = current_app.config['FLASKY_POSTS_PER_PAGE']
+    if show_followed and timeline.enabled:
+        pagination = timeline.paginate(
+            current_user, Post, request.args.get('page', 1, type=int),
+            per_page)
     else:
-        query = Post.query
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
+        if show_followed:
+            query = current_user.followed_posts
+        else:
+            query = Post.query
+        pagination = paginate(query, Post, per_page)
+    posts = Post.load_listing(pagination.items)
     return render_template('index.html', form=form, posts=posts,
                            show_followed=show_followed, pagination=pagination)
 
 
+def profile_namespaces(username):
+    user_id = db.session.query(User.id).filter_by(username=username).scalar()
+    return ['user:%s' % user_id]
+
+
 @main.route('/user/<username>')
+@page_cache.cached('FLASKY_PROFILE_CACHE_TTL', profile_namespaces)
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
-    posts = pagination.items
+    pagination = paginate(user.posts, Post,
+                          current_app.config['FLASKY_POSTS_PER_PAGE'],
+                          total=user.post_count)
+    posts = Post.load_listing(pagination.items)
+    following = followed_by = False
+    if current_user.is_authenticated and user != current_user:
+        following, followed_by = current_user.follow_state(user)
     return render_template('user.html', user=user, posts=posts,
-                           pagination=pagination)
+                           pagination=pagination, following=following,
+                           followed_by=followed_by)
 
 
 @main.route('/edit-profile', methods=['GET', 'POST'])
@@ -112,8 +126,9 @@ def post(id):
         page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
         error_out=False)
     comments = pagination.items
-    return render_template('post.html', posts=[post], form=form,
-                           comments=comments, pagination=pagination)
+    return render_template('post.html', posts=Post.load_listing([post]),
+                           form=form, comments=comments,
+                           pagination=pagination)
 
 
 @main.route('/edit/<int:id>', methods=['GET', 'POST'])
@@ -168,6 +183,13 @@ def unfollow(username):
     return redirect(url_for('.user', username=username))
 
 
+def followed_ids(follows):
+    """Ids of the listed users that the current user follows."""
+    if not current_user.is_authenticated:
+        return set()
+    return current_user.following_ids(follow['user'].id for follow in follows)
+
+
 @main.route('/followers/<username>')
 def followers(username):
     user = User.query.filter_by(username=username).first()
@@ -180,9 +202,10 @@ def followers(username):
         error_out=False)
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
+    following = followed_ids(follows)
     return render_template('followers.html', user=user, title="Followers of",
                            endpoint='.followers', pagination=pagination,
-                           follows=follows)
+                           follows=follows, following=following)
 
 
 @main.route('/followed_by/<username>')
@@ -197,9 +220,10 @@ def followed_by(username):
         error_out=False)
     follows = [{'user': item.followed, 'timestamp': item.timestamp}
                for item in pagination.items]
+    following = followed_ids(follows)
     return render_template('followers.html', user=user, title="Followed by",
                            endpoint='.followed_by', pagination=pagination,
-                           follows=follows)
+                           follows=follows, following=following)
 
 
 @main.route('/all')
@@ -253,3 +277,17 @@ def moderate_disable(id):
     db.session.commit()
     return redirect(url_for('.moderate',
                             page=request.args.get('page', 1, type=int)))
+
+
+@main.route('/search')
+def search():
+    q = request.args.get('q', '')
+    kind = request.args.get('kind')
+    if kind not in full_text.SOURCES:
+        kind = None
+    pagination = full_text.search(
+        q, kind, request.args.get('page', 1, type=int),
+        current_app.config['FLASKY_SEARCH_RESULTS_PER_PAGE'])
+    return render_template('search.html', q=q, kind=kind,
+                           kinds=sorted(full_text.SOURCES),
+                           results=pagination.items, pagination=pagination)
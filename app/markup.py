@@ -0,0 +1,231 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from itertools import repeat
+
+import bleach
+from flask import current_app
+from markdown import markdown
+from sqlalchemy import and_, bindparam, func, select
+
+from . import db
+from .cache import LRUCache
+
+POST_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+             'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+             'h1', 'h2', 'h3', 'p']
+COMMENT_TAGS = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
+                'strong']
+
+
+def render(body, tags):
+    """Markdown ``body`` rendered to HTML with only ``tags`` kept."""
+    return bleach.linkify(bleach.clean(
+        markdown(body, output_format='html'),
+        tags=tags, strip=True))
+
+
+def content_key(body, tags):
+    text = ','.join(tags) + '\0' + body
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def render_rows(rows, tags):
+    """Render ``(id, body)`` rows into UPDATE parameters; runs in workers."""
+    return [{'row_id': row_id,
+             'html': render(body, tags) if body is not None else None}
+            for row_id, body in rows]
+
+
+def rerender(table, tags, start_id=0, chunk_size=500, executor=None):
+    """Re-render the ``body_html`` column of every row of ``table``.
+
+    Rows are read in id order, ``chunk_size`` at a time, from ids above
+    ``start_id``.  Each chunk is split across ``executor`` when one is
+    given and written back with a single executemany UPDATE and a commit.
+    The pages showing the rows are touched like any other change, see
+    :func:`touch_rendered`.  Yields ``(last_id, rendered)`` after every
+    chunk so that callers can report progress and resume from
+    ``last_id``.
+    """
+    update = table.update() \
+        .where(table.c.id == bindparam('row_id')) \
+        .values(body_html=bindparam('html'))
+    if 'updated_at' in table.c:
+        update = update.values(updated_at=bindparam('now'))
+    last_id = start_id
+    rendered = 0
+    while True:
+        rows = db.session.execute(
+            select([table.c.id, table.c.body])
+            .where(table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(chunk_size)).fetchall()
+        if not rows:
+            break
+        rows = [tuple(row) for row in rows]
+        if executor is None:
+            params = render_rows(rows, tags)
+        else:
+            slices = [rows[i:i + 50] for i in range(0, len(rows), 50)]
+            params = [param for part in
+                      executor.map(render_rows, slices, repeat(tags))
+                      for param in part]
+        now = datetime.utcnow()
+        for param in params:
+            param['now'] = now
+        db.session.execute(update, params)
+        touch_rendered(table, [row_id for row_id, body in rows], now)
+        db.session.commit()
+        last_id = rows[-1][0]
+        rendered += len(rows)
+        yield last_id, rendered
+
+
+def touch_rendered(table, ids, now):
+    """Bump ``updated_at`` of the posts and clubs showing the re-rendered
+    rows ``ids`` of ``table`` and replace their page cache namespaces once
+    the chunk commits."""
+    from .models import Club, Comment, Post
+    from .pagecache import page_cache
+    posts = Post.__table__
+    names = set()
+    if table is Comment.__table__:
+        post_ids = set()
+        for author_id, post_id in db.session.execute(
+                select([table.c.author_id, table.c.post_id])
+                .where(table.c.id.in_(ids))):
+            names.add('user:%s' % author_id)
+            post_ids.add(post_id)
+        post_ids.discard(None)
+        if post_ids:
+            db.session.execute(posts.update()
+                               .where(posts.c.id.in_(post_ids))
+                               .values(updated_at=now))
+    else:
+        post_ids = ids
+    clubs = set()
+    if post_ids:
+        for author_id, club_id in db.session.execute(
+                select([posts.c.author_id, posts.c.club_id])
+                .where(posts.c.id.in_(post_ids))):
+            names.update(['user:%s' % author_id, 'club:%s' % club_id])
+            clubs.add(club_id)
+    Club.touch(clubs)
+    page_cache.changed(names)
+
+
+def remaining(table, start_id=0):
+    return db.session.execute(
+        select([func.count(table.c.id)])
+        .where(table.c.id > start_id)).scalar()
+
+
+class Renderer(object):
+    """Cached, optionally deferred rendering of ``body_html`` columns.
+
+    Rendered HTML is kept in an LRU cache of ``FLASKY_MARKDOWN_CACHE_SIZE``
+    entries keyed by a hash of the body and the allowed tags.  With
+    ``FLASKY_MARKDOWN_ASYNC`` enabled a cache miss leaves ``body_html``
+    null; once the session commits the body is rendered by a pool of
+    ``FLASKY_MARKDOWN_WORKERS`` threads and written with an UPDATE that
+    only applies if the body has not changed since.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache = LRUCache(app.config['FLASKY_MARKDOWN_CACHE_SIZE'])
+        app.extensions.setdefault('caches', {})['markdown'] = cache
+        app.extensions['markdown'] = {
+            'cache': cache,
+            'executor': None,
+            'futures': set(),
+            'lock': threading.Lock(),
+        }
+
+    @property
+    def state(self):
+        return current_app.extensions['markdown']
+
+    @property
+    def cache(self):
+        return self.state['cache']
+
+    def html(self, body, tags):
+        if body is None:
+            return None
+        key = content_key(body, tags)
+        html = self.cache.get(key)
+        if html is None:
+            html = render(body, tags)
+            self.cache.set(key, html)
+        return html
+
+    def on_changed_body(self, tags):
+        """Return a ``set`` listener for a ``body`` column rendered with
+        ``tags`` into the ``body_html`` column of the same row."""
+        def listener(target, value, oldvalue, initiator):
+            if value == oldvalue and target.body_html is not None:
+                return
+            if value is None or \
+                    not current_app.config['FLASKY_MARKDOWN_ASYNC']:
+                target.body_html = self.html(value, tags)
+                return
+            target.body_html = self.cache.get(content_key(value, tags))
+            if target.body_html is None:
+                target._render_tags = tags
+        return listener
+
+    def collect(self, session, flush_context):
+        pending = session.info.setdefault('markdown', [])
+        for obj in list(session.new) + list(session.dirty):
+            tags = obj.__dict__.pop('_render_tags', None)
+            if tags is not None:
+                pending.append((obj.__table__, obj.id, obj.body, tags))
+
+    def submit(self, session):
+        pending = session.info.pop('markdown', None)
+        if not pending:
+            return
+        app = current_app._get_current_object()
+        state = self.state
+        with state['lock']:
+            if state['executor'] is None:
+                state['executor'] = ThreadPoolExecutor(
+                    app.config['FLASKY_MARKDOWN_WORKERS'])
+            for job in pending:
+                future = state['executor'].submit(self._render_row, app, *job)
+                state['futures'].add(future)
+                future.add_done_callback(state['futures'].discard)
+
+    def discard(self, session):
+        session.info.pop('markdown', None)
+
+    def wait(self):
+        """Block until every submitted render has been written."""
+        wait(list(self.state['futures']))
+
+    def _render_row(self, app, table, row_id, body, tags):
+        with app.app_context():
+            try:
+                html = self.html(body, tags)
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        table.update()
+                        .where(and_(table.c.id == row_id,
+                                    table.c.body == body))
+                        .values(body_html=html))
+            except Exception:
+                app.logger.exception('Rendering %s %d failed',
+                                     table.name, row_id)
+
+
+renderer = Renderer()
+
+db.event.listen(db.session, 'after_flush', renderer.collect)
+db.event.listen(db.session, 'after_commit', renderer.submit)
+db.event.listen(db.session, 'after_rollback', renderer.discard)
@@ -0,0 +1,102 @@
+import time
+
+from flask import Blueprint, before_render_template, current_app, g, \
+    got_request_exception, request, request_finished, request_started, \
+    template_rendered
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+from .registry import Registry
+
+metrics = Blueprint('metrics', __name__)
+
+HELP = {
+    'flasky_request_duration_seconds': (
+        'histogram', 'Request latency by endpoint.'),
+    'flasky_request_errors_total': (
+        'counter', 'Responses with a 4xx or 5xx status by endpoint.'),
+    'flasky_db_queries_total': (
+        'counter', 'SQL statements issued by endpoint.'),
+    'flasky_template_render_seconds': (
+        'histogram', 'Template render time by template.'),
+    'flasky_db_pool_checkouts_total': (
+        'counter', 'Connections checked out of the pool.'),
+    'flasky_db_pool_size': ('gauge', 'Configured pool size.'),
+    'flasky_db_pool_checked_out': ('gauge', 'Connections in use.'),
+    'flasky_db_pool_overflow': ('gauge', 'Connections over the pool size.'),
+    'flasky_cache_hits_total': ('counter', 'In-process cache hits.'),
+    'flasky_cache_misses_total': ('counter', 'In-process cache misses.'),
+    'flasky_cache_entries': ('gauge', 'In-process cache entries.'),
+    'flasky_mail_queue_depth': ('gauge', 'Messages waiting to be sent.'),
+    'flasky_write_behind_pending': (
+        'gauge', 'Rows waiting in a write-behind buffer.'),
+}
+
+
+def registry():
+    return current_app.extensions['metrics']
+
+
+def endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def on_request_started(sender, **extra):
+    g.metrics_start = time.time()
+
+
+def on_request_finished(sender, response, **extra):
+    record(response.status_code)
+
+
+def on_request_failed(sender, exception, **extra):
+    record(500)
+
+
+def record(status):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+    labels = (('endpoint', endpoint()),)
+    metrics_registry = registry()
+    metrics_registry.observe('flasky_request_duration_seconds', labels,
+                             time.time() - start)
+    if status >= 400:
+        metrics_registry.inc('flasky_request_errors_total',
+                             labels + (('status', status),))
+    stats = g.get('query_stats')
+    if stats is not None and stats.count:
+        metrics_registry.inc('flasky_db_queries_total', labels, stats.count)
+
+
+def on_template_started(sender, template, context, **extra):
+    g.setdefault('metrics_templates', []).append(time.time())
+
+
+def on_template_rendered(sender, template, context, **extra):
+    starts = g.get('metrics_templates')
+    if starts:
+        registry().observe('flasky_template_render_seconds',
+                           (('template', template.name),),
+                           time.time() - starts.pop())
+
+
+def on_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    if current_app and 'metrics' in current_app.extensions:
+        registry().inc('flasky_db_pool_checkouts_total')
+
+
+@metrics.record_once
+def setup(state):
+    app = state.app
+    app.extensions['metrics'] = Registry(app.config['FLASKY_METRICS_BUCKETS'])
+    request_started.connect(on_request_started, app)
+    request_finished.connect(on_request_finished, app)
+    got_request_exception.connect(on_request_failed, app)
+    before_render_template.connect(on_template_started, app)
+    template_rendered.connect(on_template_rendered, app)
+    if not event.contains(Pool, 'checkout', on_pool_checkout):
+        event.listen(Pool, 'checkout', on_pool_checkout)
+
+
+from . import views
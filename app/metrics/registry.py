@@ -0,0 +1,118 @@
+import bisect
+import threading
+import weakref
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\')
+                     .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels)
+
+
+class Registry(object):
+    """Counters and histograms updated without taking a lock.
+
+    Every thread writes to its own shard, a plain dict that no other thread
+    modifies, and :meth:`collect` adds the shards up.  When a thread goes
+    away its shard is folded into a base shard, so counters never go
+    backwards and the number of shards stays bounded by the live threads.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._base = {}
+        self._shards = []
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            weakref.finalize(threading.current_thread(), self._fold, shard)
+            return shard
+
+    def _fold(self, shard):
+        with self._lock:
+            self._shards.remove(shard)
+            _merge(self._base, shard)
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        shard = self._shard()
+        key = (name, labels)
+        series = shard.get(key)
+        if series is None:
+            # one slot per bucket, then +Inf, sum
+            series = shard[key] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self):
+        """Return ``{(name, labels): total}``; histograms sum element-wise."""
+        totals = {}
+        with self._lock:
+            _merge(totals, self._base)
+            for shard in self._shards:
+                _merge(totals, shard)
+        return totals
+
+    def exposition(self, help_texts, gauges=()):
+        """Render every series in the Prometheus text format.
+
+        ``help_texts`` maps metric names to ``(type, help)``; ``gauges`` is
+        an iterable of ``(name, labels, value)`` sampled at scrape time.
+        """
+        series = {}
+        for (name, labels), value in self.collect().items():
+            series.setdefault(name, []).append((labels, value))
+        for name, labels, value in gauges:
+            series.setdefault(name, []).append((labels, value))
+        lines = []
+        for name in sorted(series):
+            kind, text = help_texts.get(name, ('untyped', name))
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(series[name], key=lambda s: s[0]):
+                if kind == 'histogram':
+                    lines.extend(self._histogram(name, labels, value))
+                else:
+                    lines.append('%s%s %s' % (name, format_labels(labels),
+                                              _number(value)))
+        return '\n'.join(lines) + '\n'
+
+    def _histogram(self, name, labels, value):
+        cumulative = 0
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for bound, count in zip(bounds, value[:-1]):
+            cumulative += count
+            yield '%s_bucket%s %d' % (
+                name, format_labels(labels + (('le', bound),)), cumulative)
+        yield '%s_sum%s %s' % (name, format_labels(labels), _number(value[-1]))
+        yield '%s_count%s %d' % (name, format_labels(labels), cumulative)
+
+
+def _merge(totals, shard):
+    for key, value in dict(shard).items():
+        if isinstance(value, list):
+            total = totals.setdefault(key, [0] * len(value))
+            for i, part in enumerate(value):
+                total[i] += part
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -0,0 +1,33 @@
+from flask import Response, current_app
+
+from .. import db
+from . import HELP, metrics, registry
+
+
+def gauges():
+    """Values sampled at scrape time rather than counted per request."""
+    extensions = current_app.extensions
+    for name, cache in sorted(extensions.get('caches', {}).items()):
+        labels = (('cache', name),)
+        yield 'flasky_cache_hits_total', labels, cache.hits
+        yield 'flasky_cache_misses_total', labels, cache.misses
+        yield 'flasky_cache_entries', labels, len(cache)
+    if 'mail_queue' in extensions:
+        yield 'flasky_mail_queue_depth', (), \
+            extensions['mail_queue']['queue'].qsize()
+    for name in ('last_seen', 'checkins'):
+        if name in extensions:
+            yield 'flasky_write_behind_pending', (('buffer', name),), \
+                len(extensions[name])
+    pool = db.engine.pool
+    for name, method in (('flasky_db_pool_size', 'size'),
+                         ('flasky_db_pool_checked_out', 'checkedout'),
+                         ('flasky_db_pool_overflow', 'overflow')):
+        if hasattr(pool, method):
+            yield name, (), getattr(pool, method)()
+
+
+@metrics.route('')
+def export():
+    return Response(registry().exposition(HELP, gauges()),
+                    mimetype='text/plain; version=0.0.4')
@@ -2,14 +2,14 @@ from datetime import datetime
 import hashlib
 
 from sqlalchemy import Enum
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
-import bleach
-from flask import current_app, request, url_for
+from flask import current_app, g, request, url_for
 from flask_login import UserMixin, AnonymousUserMixin
-from . import db, login_manager
+from . import db, login_manager, memberships, timeline, principals
+from .markup import COMMENT_TAGS, POST_TAGS, renderer
 import enum
 
 
@@ -100,6 +100,16 @@ class User(UserMixin, db.Model):
     avatar_hash = db.Column(db.String(32))
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     is_chairman = db.Column(db.Boolean, default=False)
+    # maintained by the Post, Comment and Follow mapper events below;
+    # follow counts include the self-follow like the relationships do
+    post_count = db.Column(db.Integer, default=0, server_default='0',
+                           nullable=False)
+    comment_count = db.Column(db.Integer, default=0, server_default='0',
+                              nullable=False)
+    follower_count = db.Column(db.Integer, default=0, server_default='0',
+                               nullable=False)
+    followed_count = db.Column(db.Integer, default=0, server_default='0',
+                               nullable=False)
 
     followed = db.relationship('Follow',
                                foreign_keys=[Follow.follower_id],
@@ -241,6 +251,55 @@ class User(UserMixin, db.Model):
         return self.followers.filter_by(
             follower_id=user.id).first() is not None
 
+    def following_ids(self, user_ids):
+        """Return the subset of ``user_ids`` this user follows, with one
+        query however many ids are given."""
+        user_ids = set(user_ids)
+        if self.id is None or not user_ids:
+            return set()
+        return set(followed_id for followed_id, in
+                   db.session.query(Follow.followed_id).filter(
+                       Follow.follower_id == self.id,
+                       Follow.followed_id.in_(user_ids)))
+
+    def follow_state(self, user):
+        """Return ``(self.is_following(user), self.is_followed_by(user))``
+        with one query."""
+        if user.id is None:
+            return False, False
+        pairs = set(db.session.query(Follow.follower_id, Follow.followed_id)
+                    .filter(db.or_(
+                        db.and_(Follow.follower_id == self.id,
+                                Follow.followed_id == user.id),
+                        db.and_(Follow.follower_id == user.id,
+                                Follow.followed_id == self.id))))
+        return (self.id, user.id) in pairs, (user.id, self.id) in pairs
+
+    @staticmethod
+    def repair_counters():
+        """Recompute every counter column with one set-based UPDATE and
+        return the number of users whose counters were wrong."""
+        users = User.__table__
+        actual = {
+            'post_count': db.select([db.func.count(Post.id)])
+            .where(Post.author_id == users.c.id),
+            'comment_count': db.select([db.func.count(Comment.id)])
+            .where(Comment.author_id == users.c.id),
+            'follower_count': db.select([db.func.count()])
+            .where(Follow.followed_id == users.c.id),
+            'followed_count': db.select([db.func.count()])
+            .where(Follow.follower_id == users.c.id),
+        }
+        wrong = db.session.execute(
+            db.select([db.func.count()]).select_from(users).where(db.or_(
+                *[users.c[name] != query.as_scalar()
+                  for name, query in actual.items()]))).scalar()
+        if wrong:
+            db.session.execute(users.update().values(
+                **{name: query.as_scalar()
+                   for name, query in actual.items()}))
+        return wrong
+
     @property
     def followed_posts(self):
         return Post.query.join(Follow, Follow.followed_id == Post.author_id) \
@@ -251,23 +310,63 @@ class User(UserMixin, db.Model):
             self.clubs.append(club)
             db.session.add(self)
 
+    @property
+    def joined_club_ids(self):
+        """Ids of the clubs this user is a member of.
+
+        Loaded with one query at most once per request.  With
+        ``FLASKY_MEMBERSHIP_CACHE_TTL`` set they are also kept across
+        requests in the ``memberships`` cache until a membership of the
+        user is committed, in this process only: other processes see the
+        change up to the TTL late.
+        """
+        if self.id is None:
+            return frozenset()
+        loaded = g.setdefault('joined_club_ids', {})
+        club_ids = loaded.get(self.id)
+        if club_ids is None:
+            club_ids = memberships.get(self.id)
+        if club_ids is None:
+            club_ids = frozenset(
+                club_id for club_id, in db.session.query(joins.c.club_id)
+                .filter(joins.c.user_id == self.id))
+            memberships.set(self.id, club_ids)
+        loaded[self.id] = club_ids
+        return club_ids
+
     def has_joined(self, club):
-        if club.id is None:
-            return False
-        return self.clubs.filter_by(id=club.id).first() is not None
+        return club.id is not None and club.id in self.joined_club_ids
+
+    def attend_statuses(self, activity_ids):
+        """Map each of ``activity_ids`` this user applied to onto the
+        ``AttendStatus`` of the application, with one query."""
+        activity_ids = set(activity_ids)
+        if self.id is None or not activity_ids:
+            return {}
+        return dict(db.session.query(Attend.activity_id, Attend.status)
+                    .filter(Attend.user_id == self.id,
+                            Attend.activity_id.in_(activity_ids)))
 
     def has_attended(self, activity):
-        attend = self.activities.filter_by(activity_id=activity.id)
-        return attend is not None
+        return self.attend_statuses([activity.id]).get(activity.id) == \
+            AttendStatus.attended
 
     def __repr__(self):
         return '<User %r>' % self.username
 
 
 class AnonymousUser(AnonymousUserMixin):
+    joined_club_ids = frozenset()
+
     def can(self, permissions):
         return False
 
+    def attend_statuses(self, activity_ids):
+        return {}
+
+    def has_joined(self, club):
+        return False
+
     def is_administrator(self):
         return False
 
@@ -275,37 +374,205 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+def attach_instance(model, values):
+    """Return a persistent ``model`` instance built from ``values``.
+
+    The instance is added to the session without a SELECT; columns missing
+    from ``values`` are loaded together on first access.  An instance
+    already present in the identity map is returned unchanged.
+    """
+    mapper = model.__mapper__
+    key = mapper.identity_key_from_primary_key([values['id']])
+    instance = db.session.identity_map.get(key)
+    if instance is not None:
+        return instance
+    instance = mapper.class_manager.new_instance()
+    for name, value in values.items():
+        set_committed_value(instance, name, value)
+    make_transient_to_detached(instance)
+    db.session.add(instance)
+    return instance
+
+
+class UserPrincipal(object):
+    """Identity and permission snapshot of a user, cached by ``load_user``.
+
+    Rebuilding ``current_user`` from a principal attaches a ``User`` and its
+    ``Role`` to the session without querying the database, so per-request
+    identity checks and ``can()`` calls stay in memory.  Principals are
+    only dropped by the process that commits a change to the user or a
+    role, so other processes keep granting the old permissions for up to
+    ``FLASKY_PRINCIPAL_CACHE_TTL`` seconds; the cache is off by default.
+    """
+    columns = ('id', 'username', 'role_id', 'confirmed', 'is_chairman',
+               'avatar_hash', 'last_seen')
+
+    def __init__(self, user):
+        for name in self.columns:
+            setattr(self, name, getattr(user, name))
+        self.permissions = user.role.permissions if user.role else None
+        self.role_name = user.role.name if user.role else None
+
+    def to_user(self):
+        key = User.__mapper__.identity_key_from_primary_key([self.id])
+        user = db.session.identity_map.get(key)
+        if user is not None:
+            return user
+        user = attach_instance(User, dict((name, getattr(self, name))
+                                          for name in self.columns))
+        role = None
+        if self.role_id is not None:
+            role = attach_instance(Role, {'id': self.role_id,
+                                          'name': self.role_name,
+                                          'permissions': self.permissions})
+        set_committed_value(user, 'role', role)
+        return user
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    principal = principals.get(user_id)
+    if principal is not None:
+        return principal.to_user()
+    user = User.query.get(user_id)
+    if user is not None and principals.enabled:
+        principals.set(user_id, UserPrincipal(user))
+    return user
+
+
+def forget_principals(user_ids):
+    for user_id in user_ids:
+        if user_id is None:
+            principals.clear()
+        else:
+            principals.delete(user_id)
+
+
+def principal_changed(user_id):
+    # forgotten again once the change is committed or rolled back, in case
+    # a load_user cached the flushed row in between
+    forget_principals([user_id])
+    db.session.info.setdefault('principals', set()).add(user_id)
+
+
+def invalidate_principal(mapper, connection, target):
+    principal_changed(target.id)
+
+
+def invalidate_principals(mapper, connection, target):
+    principal_changed(None)
+
+
+def apply_principal_changes(session):
+    forget_principals(session.info.pop('principals', ()))
+
+
+db.event.listen(User, 'after_update', invalidate_principal)
+db.event.listen(User, 'after_delete', invalidate_principal)
+db.event.listen(Role, 'after_update', invalidate_principals)
+db.event.listen(Role, 'after_delete', invalidate_principals)
+db.event.listen(db.session, 'after_commit', apply_principal_changes)
+db.event.listen(db.session, 'after_rollback', apply_principal_changes)
 
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_club_id_timestamp', 'club_id', 'timestamp'),
+        db.Index('ix_posts_author_id_timestamp', 'author_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
     club_id = db.Column(db.Integer, db.ForeignKey('clubs.id'), nullable=True)
     club = db.relationship('Club', backref=backref('posts', lazy='dynamic'), lazy='select')
 
+    _comment_count = None
+
     @staticmethod
-    def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+    def load_listing(posts):
+        """Batch-load authors and comment counts for a page of posts.
+
+        Issues one query for the authors and one grouped query for the
+        comment counts, so rendering ``_posts.html`` needs no further
+        round trips per post.
+        """
+        posts = list(posts)
+        if not posts:
+            return posts
+        author_ids = set(post.author_id for post in posts
+                         if post.author_id is not None)
+        authors = {}
+        if author_ids:
+            authors = dict((user.id, user) for user in
+                           User.query.filter(User.id.in_(author_ids)))
+        counts = dict(db.session.query(Comment.post_id,
+                                       db.func.count(Comment.id))
+                      .filter(Comment.post_id.in_([post.id for post in posts]))
+                      .group_by(Comment.post_id))
+        for post in posts:
+            set_committed_value(post, 'author', authors.get(post.author_id))
+            post._comment_count = counts.get(post.id, 0)
+        return posts
+
+    @property
+    def comment_count(self):
+        if self._comment_count is None:
+            return self.comments.count()
+        return self._comment_count
 
 
-db.event.listen(Post.body, 'set', Post.on_changed_body)
+db.event.listen(Post.body, 'set', renderer.on_changed_body(POST_TAGS))
+
+
+def collect_timeline_changes(session, flush_context):
+    """Record new posts and follow changes for fan-out after commit."""
+    if not timeline.enabled:
+        return
+    changes = session.info.setdefault('timeline',
+                                      {'posts': [], 'followers': set()})
+    for obj in session.new:
+        if isinstance(obj, Post):
+            follower_ids = [follower_id for follower_id, in
+                            session.query(Follow.follower_id).filter(
+                                Follow.followed_id == obj.author_id)]
+            changes['posts'].append((follower_ids, obj.id, obj.timestamp))
+        elif isinstance(obj, Follow):
+            changes['followers'].add(obj.follower_id)
+    for obj in session.deleted:
+        if isinstance(obj, Follow):
+            changes['followers'].add(obj.follower_id)
+
+
+def apply_timeline_changes(session):
+    changes = session.info.pop('timeline', None)
+    if not changes:
+        return
+    timeline.invalidate(changes['followers'])
+    for follower_ids, post_id, timestamp in changes['posts']:
+        timeline.push(follower_ids, post_id, timestamp)
+
+
+def discard_timeline_changes(session):
+    session.info.pop('timeline', None)
+
+
+db.event.listen(db.session, 'after_flush', collect_timeline_changes)
+db.event.listen(db.session, 'after_commit', apply_timeline_changes)
+db.event.listen(db.session, 'after_rollback', discard_timeline_changes)
 
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_post_id_timestamp', 'post_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
@@ -314,16 +581,8 @@ class Comment(db.Model):
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
 
-    @staticmethod
-    def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
-                        'strong']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
-
 
-db.event.listen(Comment.body, 'set', Comment.on_changed_body)
+db.event.listen(Comment.body, 'set', renderer.on_changed_body(COMMENT_TAGS))
 
 
 joins = db.Table(
@@ -339,6 +598,8 @@ class Club(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(64), unique=True, index=True)
     description = db.Column(db.Text())
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
 
     chief_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     vice_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -352,6 +613,16 @@ class Club(db.Model):
     def get_absolute_url(self):
         return url_for('club.club_detail', club_id=self.id, category='ongoing')
 
+    @staticmethod
+    def touch(ids):
+        """Set ``updated_at`` of the given rows to now with one UPDATE."""
+        ids = [id for id in ids if id is not None]
+        if ids:
+            db.session.execute(
+                Club.__table__.update()
+                .where(Club.__table__.c.id.in_(ids))
+                .values(updated_at=datetime.utcnow()))
+
 
 class ApplicationStatus(enum.Enum):
     reviewing = 1
@@ -361,6 +632,9 @@ class ApplicationStatus(enum.Enum):
 
 class JoinApplication(db.Model):
     __tablename__ = 'join_applications'
+    __table_args__ = (
+        db.Index('ix_join_applications_club_id_status', 'club_id', 'status'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     club_id = db.Column(db.Integer, db.ForeignKey('clubs.id'))
@@ -383,6 +657,9 @@ class JoinApplication(db.Model):
 
 class CreateApplication(db.Model):
     __tablename__ = 'create_applications'
+    __table_args__ = (
+        db.Index('ix_create_applications_status', 'status'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     club_name = db.Column(db.String(64))
@@ -407,28 +684,130 @@ class AttendStatus(enum.Enum):
     rejected = 3
     attended = 4
 
+    @property
+    def text(self):
+        return ATTEND_STATUS_TEXT.get(self)
+
+
+ATTEND_STATUS_TEXT = {
+    AttendStatus.reviewing: '审核中',
+    AttendStatus.accepted: '已接受',
+    AttendStatus.rejected: '已拒绝',
+    AttendStatus.attended: '已经答到',
+}
+
 
 class Attend(db.Model):
     __tablename__ = 'attends'
+    __table_args__ = (
+        db.Index('ix_attends_activity_id_user_id_status',
+                 'activity_id', 'user_id', 'status'),
+        db.Index('uq_attends_user_id_activity_id',
+                 'user_id', 'activity_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     activity_id = db.Column(db.Integer, db.ForeignKey('activities.id'))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
-    status = db.Column(Enum(AttendStatus),
-                       default=AttendStatus.reviewing)
+    status = db.column_property(
+        db.Column(Enum(AttendStatus), default=AttendStatus.reviewing),
+        active_history=True)
 
     user = db.relationship('User', backref=backref('activities', lazy='dynamic'))
     activity = db.relationship('Activity', backref=backref('participants', lazy='dynamic'))
 
+    @staticmethod
+    def rollcall(activity_id, attended_ids):
+        """Save a roll call of ``activity_id``.
+
+        Accepted participants listed in ``attended_ids`` become attended and
+        attended participants missing from it go back to accepted.  The
+        participants' statuses are read, locked where the database supports
+        it, and only the rows that change are updated, by id.
+
+        Returns the ``(user_id, old_status, new_status)`` changes for the
+        attend rollup, or ``None`` when a concurrent writer changed some of
+        the rows first and the changes are not known.
+        """
+        attended_ids = set(attended_ids)
+        participants = db.session.query(
+            Attend.id, Attend.user_id, Attend.status).filter(
+            Attend.activity_id == activity_id,
+            Attend.status.in_([AttendStatus.accepted,
+                               AttendStatus.attended])) \
+            .with_for_update().all()
+        moves = {AttendStatus.accepted: [], AttendStatus.attended: []}
+        for id, user_id, status in participants:
+            if (status == AttendStatus.accepted) == (id in attended_ids):
+                moves[status].append((id, user_id))
+        changes = []
+        updated = 0
+        for old, new in ((AttendStatus.accepted, AttendStatus.attended),
+                         (AttendStatus.attended, AttendStatus.accepted)):
+            if not moves[old]:
+                continue
+            updated += Attend.query.filter(
+                Attend.id.in_([id for id, user_id in moves[old]]),
+                Attend.status == old) \
+                .update({'status': new}, synchronize_session=False)
+            changes.extend((user_id, old, new)
+                           for id, user_id in moves[old])
+        Activity.touch([activity_id])
+        return changes if updated == len(changes) else None
+
+    @staticmethod
+    def check_in(activity_id, user_ids):
+        """Mark accepted participants as attended while roll call is open.
+
+        One conditional UPDATE, so repeating a check-in is harmless.  For
+        several users the accepted participants among them are selected
+        first, locked where the database supports it, so the users that
+        were checked in are known.  Returns the ``(user_id, old_status,
+        new_status)`` changes like :meth:`rollcall`, or ``None`` when a
+        concurrent writer changed some of the rows first.
+        """
+        user_ids = list(user_ids)
+        rollcalling = db.session.query(Activity.id).filter(
+            Activity.id == activity_id,
+            Activity.status == ActivityStatus.rollcall).exists()
+        accepted = Attend.query.filter(
+            Attend.activity_id == activity_id,
+            Attend.status == AttendStatus.accepted,
+            rollcalling)
+        if len(user_ids) > 1:
+            user_ids = [user_id for user_id, in
+                        accepted.filter(Attend.user_id.in_(user_ids))
+                        .with_entities(Attend.user_id).with_for_update()]
+        if not user_ids:
+            return []
+        checked_in = accepted.filter(Attend.user_id.in_(user_ids)) \
+            .update({'status': AttendStatus.attended},
+                    synchronize_session=False)
+        if checked_in:
+            Activity.touch([activity_id])
+        if checked_in != len(user_ids):
+            return [] if len(user_ids) == 1 else None
+        return [(user_id, AttendStatus.accepted, AttendStatus.attended)
+                for user_id in user_ids]
+
     def get_status_text(self):
-        status_text = {
-            AttendStatus.reviewing: '审核中',
-            AttendStatus.accepted: '已接受',
-            AttendStatus.rejected: '已拒绝',
-            AttendStatus.attended: '已经答到',
-        }
-        return status_text.get(self.status)
+        return ATTEND_STATUS_TEXT.get(self.status)
+
+
+class AttendRollup(db.Model):
+    """Attend counters by status, maintained from ``Attend`` changes.
+
+    Each club has three kinds of rows: the club total (``activity_id`` and
+    ``user_id`` are 0), one row per activity (``user_id`` is 0) and one row
+    per member (``activity_id`` is 0).
+    """
+    __tablename__ = 'attend_rollups'
+    club_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    activity_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(Enum(AttendStatus), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
 
 
 class ActivityStatus(enum.Enum):
@@ -441,6 +820,9 @@ class ActivityStatus(enum.Enum):
 
 class Activity(db.Model):
     __tablename__ = 'activities'
+    __table_args__ = (
+        db.Index('ix_activities_club_id_status', 'club_id', 'status'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(64), index=True)
     description = db.Column(db.Text())
@@ -448,12 +830,24 @@ class Activity(db.Model):
 
     status = db.Column(db.Enum(ActivityStatus),
                        default=ActivityStatus.reviewing)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
 
     club_id = db.Column(db.Integer, db.ForeignKey('clubs.id'))
     club = db.relationship('Club', backref=db.backref('activities', lazy='dynamic'))
 
     def get_absolute_url(self):
         return url_for('.activity_detail', activity_id=self.id)
+
+    @staticmethod
+    def touch(ids):
+        """Set ``updated_at`` of the given rows to now with one UPDATE."""
+        ids = [id for id in ids if id is not None]
+        if ids:
+            db.session.execute(
+                Activity.__table__.update()
+                .where(Activity.__table__.c.id.in_(ids))
+                .values(updated_at=datetime.utcnow()))
     
     def get_status_text(self):
         status_text = {
@@ -465,5 +859,100 @@ class Activity(db.Model):
         return status_text.get(self.status)
 
 
-
-
+def touch_parents(session, flush_context):
+    """Bump ``updated_at`` of the clubs, activities and posts whose pages
+    show rows changed by this flush without updating the parent row."""
+    clubs, activities, posts = set(), set(), set()
+    for obj in list(session.new) + list(session.dirty) + \
+            list(session.deleted):
+        if isinstance(obj, (Activity, Post)):
+            clubs.add(obj.club_id)
+        elif isinstance(obj, Comment):
+            posts.add(obj.post_id)
+        elif isinstance(obj, Attend):
+            activities.add(obj.activity_id)
+        elif isinstance(obj, User):
+            history = db.inspect(obj).attrs.clubs.history
+            clubs.update(club.id for club in
+                         list(history.added or ()) +
+                         list(history.deleted or ()))
+    for obj in session.dirty:
+        if isinstance(obj, Club):
+            # membership changes leave the clubs row untouched
+            clubs.add(obj.id)
+    posts.discard(None)
+    if posts:
+        now = datetime.utcnow()
+        session.execute(Post.__table__.update()
+                        .where(Post.__table__.c.id.in_(posts))
+                        .values(updated_at=now))
+        clubs.update(club_id for club_id, in session.execute(
+            db.select([Post.__table__.c.club_id])
+            .where(Post.__table__.c.id.in_(posts))))
+    Club.touch(clubs)
+    Activity.touch(activities)
+
+
+db.event.listen(db.session, 'after_flush', touch_parents)
+
+
+def counter_listeners(model, column, owner):
+    """Keep ``User.<column>`` equal to the number of ``model`` rows whose
+    ``owner`` foreign key points at the user, on the flush connection."""
+    users = User.__table__
+    counter = users.c[column]
+
+    def add(connection, user_id, amount):
+        if user_id is not None:
+            connection.execute(users.update()
+                               .where(users.c.id == user_id)
+                               .values({counter: counter + amount}))
+
+    def inserted(mapper, connection, target):
+        add(connection, getattr(target, owner), 1)
+
+    def deleted(mapper, connection, target):
+        add(connection, getattr(target, owner), -1)
+
+    def updated(mapper, connection, target):
+        history = db.inspect(target).attrs[owner].history
+        if history.has_changes():
+            for user_id in history.deleted or ():
+                add(connection, user_id, -1)
+            for user_id in history.added or ():
+                add(connection, user_id, 1)
+
+    db.event.listen(model, 'after_insert', inserted)
+    db.event.listen(model, 'after_delete', deleted)
+    db.event.listen(model, 'after_update', updated)
+
+
+counter_listeners(Post, 'post_count', 'author_id')
+counter_listeners(Comment, 'comment_count', 'author_id')
+counter_listeners(Follow, 'follower_count', 'followed_id')
+counter_listeners(Follow, 'followed_count', 'follower_id')
+
+
+def forget_memberships(user_ids):
+    loaded = g.get('joined_club_ids')
+    for user_id in user_ids:
+        if loaded:
+            loaded.pop(user_id, None)
+        memberships.delete(user_id)
+
+
+def membership_changed(club, user, initiator):
+    if user.id is not None:
+        forget_memberships([user.id])
+        db.session.info.setdefault('memberships', set()).add(user.id)
+
+
+def apply_membership_changes(session):
+    forget_memberships(session.info.pop('memberships', ()))
+
+
+# the User.clubs backref fires these too
+db.event.listen(Club.members, 'append', membership_changed)
+db.event.listen(Club.members, 'remove', membership_changed)
+db.event.listen(db.session, 'after_commit', apply_membership_changes)
+db.event.listen(db.session, 'after_rollback', apply_membership_changes)
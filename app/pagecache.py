@@ -0,0 +1,312 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, session
+from flask_login import current_user
+from jinja2 import Markup
+
+from . import db
+from .models import Activity, Attend, Club, Comment, Follow, Post, User
+
+
+class MemoryStore(object):
+    """In-process LRU mapping whose entries carry their own timeout.
+
+    A timeout of ``None`` keeps the entry until it is evicted.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or \
+                    (entry[0] is not None and entry[0] <= time.time()):
+                self.misses += 1
+                return None
+            self._data[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        expires = None if timeout is None else time.time() + timeout
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileSystemStore(object):
+    """The :class:`MemoryStore` interface over one pickle file per key.
+
+    Every process serving the application can share the directory.  Files
+    are written to a temporary name and renamed into place, and once more
+    than ``max_size`` files exist the least recently written are removed.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._files())
+
+    def _files(self):
+        return [name for name in os.listdir(self.directory)
+                if not name.startswith('.')]
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.PickleError):
+            self.misses += 1
+            return None
+        if expires is not None and expires <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value, timeout=None):
+        expires = None if timeout is None else time.time() + timeout
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        self._prune()
+
+    def _prune(self):
+        files = self._files()
+        if len(files) <= self.max_size:
+            return
+        paths = [os.path.join(self.directory, name) for name in files]
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                pass
+        for path in sorted(mtimes, key=mtimes.get)[:-self.max_size]:
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def clear(self):
+        for name in self._files():
+            self._remove(os.path.join(self.directory, name))
+
+
+def namespaces(obj):
+    """Cache namespaces whose pages show ``obj``."""
+    if isinstance(obj, Club):
+        return ['clubs', 'club:%s' % obj.id]
+    if isinstance(obj, Activity):
+        return ['club:%s' % obj.club_id]
+    if isinstance(obj, Attend):
+        return namespaces(obj.activity) if obj.activity is not None else []
+    if isinstance(obj, Post):
+        return ['club:%s' % obj.club_id, 'user:%s' % obj.author_id]
+    if isinstance(obj, Comment):
+        # listings of the commented post show its comment count
+        return ['user:%s' % obj.author_id] + \
+            (namespaces(obj.post) if obj.post is not None else [])
+    if isinstance(obj, Follow):
+        return ['user:%s' % obj.follower_id, 'user:%s' % obj.followed_id]
+    if isinstance(obj, User):
+        return ['user:%s' % obj.id]
+    return []
+
+
+class PageCache(object):
+    """Response and template fragment cache with versioned namespaces.
+
+    ``FLASKY_PAGE_CACHE`` selects the ``memory`` or ``filesystem`` store,
+    which holds up to ``FLASKY_PAGE_CACHE_SIZE`` entries; when unset
+    nothing is cached.  Every entry is keyed by the current version of
+    the namespaces it depends on, and committing a change to a club,
+    activity, post, comment, follow or user replaces the versions of its
+    namespaces, so stale entries are never read again and age out.
+    Writes that bypass the unit of work name their namespaces with
+    :meth:`changed` or :meth:`activities_changed`, or call
+    :meth:`invalidate` after their own commit; the user counters kept on
+    the flush connection change together with the post, comment or follow
+    that replaces the user's namespace anyway.
+
+    Whole responses are only cached for anonymous visitors without
+    pending flashed messages, because the navigation bar and buttons are
+    rendered for the current user.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config['FLASKY_PAGE_CACHE']
+        if backend == 'filesystem':
+            store = FileSystemStore(app.config['FLASKY_PAGE_CACHE_DIR'],
+                                    app.config['FLASKY_PAGE_CACHE_SIZE'])
+        elif backend == 'memory':
+            store = MemoryStore(app.config['FLASKY_PAGE_CACHE_SIZE'])
+        elif backend:
+            raise ValueError('Unknown page cache backend %r' % backend)
+        else:
+            return
+        app.extensions['page_cache'] = store
+        app.extensions.setdefault('caches', {})['pages'] = store
+
+    @property
+    def store(self):
+        return current_app.extensions.get('page_cache')
+
+    @property
+    def enabled(self):
+        return self.store is not None
+
+    def version(self, namespace):
+        key = 'version:' + namespace
+        version = self.store.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            self.store.set(key, version)
+        return version
+
+    def invalidate(self, names):
+        if not self.enabled:
+            return
+        for namespace in names:
+            self.store.delete('version:' + namespace)
+
+    def changed(self, names):
+        """Replace the versions of ``names`` when the session commits."""
+        if self.enabled:
+            db.session.info.setdefault('page_cache', set()).update(names)
+
+    def activities_changed(self, activity_ids):
+        """:meth:`changed` for the clubs of ``activity_ids``."""
+        if self.enabled and activity_ids:
+            self.changed('club:%s' % club_id for club_id, in
+                         db.session.query(Activity.club_id)
+                         .filter(Activity.id.in_(activity_ids)).distinct())
+
+    def clear(self):
+        if self.enabled:
+            self.store.clear()
+
+    def key(self, parts, names):
+        return '|'.join([str(part) for part in parts] +
+                        ['%s=%s' % (namespace, self.version(namespace))
+                         for namespace in names])
+
+    def fragment(self, name, timeout_config, names, render):
+        """Return the markup ``render()`` produces, cached under ``name``."""
+        if not self.enabled:
+            return Markup(render())
+        key = self.key(['fragment', name], names)
+        html = self.store.get(key)
+        if html is None:
+            html = render()
+            self.store.set(key, html,
+                           current_app.config[timeout_config])
+        return Markup(html)
+
+    def cached(self, timeout_config, names=None):
+        """Cache a view's anonymous ``GET`` responses.
+
+        ``names`` is called with the view arguments and returns the
+        namespaces the page depends on.  The key includes the view
+        arguments and the query string, so every page number and category
+        is cached separately.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.cacheable():
+                    return f(*args, **kwargs)
+                parts = [request.endpoint] + \
+                    sorted('%s=%s' % item for item in kwargs.items()) + \
+                    sorted('%s=%s' % item
+                           for item in request.args.items(multi=True))
+                key = self.key(['page'] + parts,
+                               names(**kwargs) if names else [])
+                entry = self.store.get(key)
+                if entry is not None:
+                    response = current_app.response_class(
+                        entry[1], mimetype=entry[0])
+                    response.headers['X-Page-Cache'] = 'HIT'
+                    return response
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200 and \
+                        not response.direct_passthrough:
+                    self.store.set(key, (response.mimetype,
+                                         response.get_data()),
+                                   current_app.config[timeout_config])
+                    response.headers['X-Page-Cache'] = 'MISS'
+                return response
+            return decorated_function
+        return decorator
+
+    def cacheable(self):
+        return self.enabled and request.method == 'GET' and \
+            not current_user.is_authenticated and \
+            not session.get('_flashes')
+
+    def collect(self, session, flush_context):
+        if not self.enabled:
+            return
+        changed = session.info.setdefault('page_cache', set())
+        for obj in list(session.new) + list(session.dirty) + \
+                list(session.deleted):
+            changed.update(namespaces(obj))
+
+    def apply(self, session):
+        self.invalidate(session.info.pop('page_cache', ()))
+
+    def discard(self, session):
+        session.info.pop('page_cache', None)
+
+
+page_cache = PageCache()
+
+db.event.listen(db.session, 'after_flush', page_cache.collect)
+db.event.listen(db.session, 'after_commit', page_cache.apply)
+db.event.listen(db.session, 'after_rollback', page_cache.discard)
@@ -0,0 +1,112 @@
+from datetime import datetime
+
+from flask import current_app, request
+from flask_sqlalchemy import Pagination
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import and_, or_
+
+
+CURSOR_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class KeysetPagination(object):
+    """Seek-based replacement for Flask-SQLAlchemy's ``Pagination``.
+
+    Rows are ordered newest first on ``(timestamp, id)`` and each page is
+    located with a ``WHERE`` on the last key seen instead of an ``OFFSET``,
+    so deep pages cost the same as the first one and no ``COUNT(*)`` is
+    issued.  Page positions are exposed as opaque, signed cursor tokens.
+    """
+
+    keyset = True
+
+    def __init__(self, query, sort_column, id_column, cursor=None,
+                 per_page=20):
+        self.sort_column = sort_column
+        self.id_column = id_column
+        self.per_page = per_page
+        direction, key = self.decode_cursor(cursor)
+        query = query.order_by(None)
+        if key is None:
+            direction = 'next'
+            query = query.order_by(sort_column.desc(), id_column.desc())
+        elif direction == 'next':
+            query = query.filter(or_(
+                sort_column < key[0],
+                and_(sort_column == key[0], id_column < key[1]))) \
+                .order_by(sort_column.desc(), id_column.desc())
+        else:
+            query = query.filter(or_(
+                sort_column > key[0],
+                and_(sort_column == key[0], id_column > key[1]))) \
+                .order_by(sort_column.asc(), id_column.asc())
+        rows = query.limit(per_page + 1).all()
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if direction == 'next':
+            self.has_prev = key is not None
+            self.has_next = more
+        else:
+            rows.reverse()
+            self.has_prev = more
+            self.has_next = True
+        self.items = rows
+
+    @staticmethod
+    def _serializer():
+        return URLSafeSerializer(current_app.config['SECRET_KEY'],
+                                 salt='keyset-cursor')
+
+    def _key(self, item):
+        return (getattr(item, self.sort_column.key),
+                getattr(item, self.id_column.key))
+
+    def encode_cursor(self, direction, item):
+        timestamp, id = self._key(item)
+        return self._serializer().dumps(
+            [direction, timestamp.strftime(CURSOR_TIMESTAMP_FORMAT), id])
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, None
+        try:
+            direction, timestamp, id = self._serializer().loads(cursor)
+            timestamp = datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT)
+        except (BadSignature, TypeError, ValueError):
+            return None, None
+        if direction not in ('next', 'prev'):
+            return None, None
+        return direction, (timestamp, id)
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return self.encode_cursor('next', self.items[-1])
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return self.encode_cursor('prev', self.items[0])
+
+
+def paginate(query, model, per_page, total=None):
+    """Paginate ``query`` newest first, honouring the configured mode.
+
+    Keyset pagination is used when ``FLASKY_KEYSET_PAGINATION`` is enabled
+    or the request already carries a ``cursor``; otherwise the classic
+    page-number pagination is returned.  A known ``total``, such as a
+    counter column, saves page-number pagination its ``COUNT`` query.
+    """
+    cursor = request.args.get('cursor')
+    if current_app.config['FLASKY_KEYSET_PAGINATION'] or cursor:
+        return KeysetPagination(query, model.timestamp, model.id,
+                                cursor=cursor, per_page=per_page)
+    page = request.args.get('page', 1, type=int)
+    query = query.order_by(model.timestamp.desc())
+    if total is None:
+        return query.paginate(page, per_page=per_page, error_out=False)
+    page = max(page, 1)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    return Pagination(query, page, per_page, total, items)
@@ -0,0 +1,230 @@
+from sqlalchemy import and_, func, literal_column, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Insert
+
+from . import db
+from .models import Activity, Attend, AttendRollup
+
+rollups = AttendRollup.__table__
+attends = Attend.__table__
+activities = Activity.__table__
+
+
+def club_rows(club_id):
+    """Join condition selecting the club total rows of ``club_id``."""
+    return and_(AttendRollup.club_id == club_id,
+                AttendRollup.activity_id == 0,
+                AttendRollup.user_id == 0)
+
+
+def activity_rows(activity_id):
+    return and_(AttendRollup.activity_id == activity_id,
+                AttendRollup.user_id == 0)
+
+
+def member_rows(club_id, user_id):
+    return and_(AttendRollup.club_id == club_id,
+                AttendRollup.activity_id == 0,
+                AttendRollup.user_id == user_id)
+
+
+def total():
+    """Sum of the joined rollup rows over every status."""
+    return func.coalesce(func.sum(AttendRollup.count), 0)
+
+
+class Upsert(Insert):
+    """``INSERT`` into the rollup adding ``count`` to an existing row."""
+
+
+@compiles(Upsert, 'sqlite')
+@compiles(Upsert, 'postgresql')
+def upsert_on_conflict(insert, compiler, **kw):
+    # SQLite 3.24 or later
+    return compiler.visit_insert(insert, **kw) + \
+        ' ON CONFLICT (club_id, activity_id, user_id, status) ' \
+        'DO UPDATE SET count = attend_rollups.count + excluded.count'
+
+
+@compiles(Upsert, 'mysql')
+def upsert_on_duplicate_key(insert, compiler, **kw):
+    return compiler.visit_insert(insert, **kw) + \
+        ' ON DUPLICATE KEY UPDATE count = count + VALUES(count)'
+
+
+UPSERT_DIALECTS = ('sqlite', 'postgresql', 'mysql')
+
+
+def add_delta(deltas, club_id, activity_id, user_id, status, delta):
+    """Add ``delta`` to the club, activity and member keys of a status."""
+    if club_id is None or status is None:
+        return
+    scopes = [(club_id, 0, 0), (club_id, activity_id, 0)]
+    if user_id is not None:
+        scopes.append((club_id, 0, user_id))
+    for club, activity, user in scopes:
+        key = (club, activity, user, status)
+        deltas[key] = deltas.get(key, 0) + delta
+
+
+def apply_deltas(connection, deltas):
+    """Add ``{(club_id, activity_id, user_id, status): delta}`` to the rollup.
+
+    Missing rows are created by the same statement, so concurrent first
+    changes of a key cannot collide on the primary key.  Rows are written
+    in key order to keep lock order stable between transactions.
+    """
+    rows = [{'club_id': club, 'activity_id': activity, 'user_id': user,
+             'status': status, 'count': delta}
+            for (club, activity, user, status), delta in
+            sorted(deltas.items(),
+                   key=lambda item: item[0][:3] + (item[0][3].value,))
+            if delta]
+    if not rows:
+        return
+    if connection.dialect.name in UPSERT_DIALECTS:
+        connection.execute(Upsert(rollups), rows)
+        return
+    for row in rows:
+        result = connection.execute(
+            rollups.update()
+            .where(and_(rollups.c.club_id == row['club_id'],
+                        rollups.c.activity_id == row['activity_id'],
+                        rollups.c.user_id == row['user_id'],
+                        rollups.c.status == row['status']))
+            .values(count=rollups.c.count + row['count']))
+        if result.rowcount == 0:
+            connection.execute(rollups.insert().values(**row))
+
+
+def apply_delta(connection, club_id, activity_id, user_id, status, delta):
+    """Add ``delta`` to the club, activity and member counters of a status."""
+    deltas = {}
+    add_delta(deltas, club_id, activity_id, user_id, status, delta)
+    apply_deltas(connection, deltas)
+
+
+def moved(connection, activity_id, changes):
+    """Apply ``(user_id, old_status, new_status)`` changes of attends of
+    ``activity_id`` with one statement.
+
+    ``changes`` of ``None`` means the changed rows are not known, and the
+    club is rebuilt instead.
+    """
+    club_id = club_of(connection, activity_id)
+    if changes is None:
+        if club_id is not None:
+            rebuild(club_id)
+        return
+    deltas = {}
+    for user_id, old, new in changes:
+        add_delta(deltas, club_id, activity_id, user_id, old, -1)
+        add_delta(deltas, club_id, activity_id, user_id, new, 1)
+    apply_deltas(connection, deltas)
+
+
+def club_of(connection, activity_id):
+    if activity_id is None:
+        return None
+    return connection.execute(
+        select([activities.c.club_id])
+        .where(activities.c.id == activity_id)).scalar()
+
+
+def grouped_counts(club_id=None):
+    """SELECTs computing every rollup row from ``attends``.
+
+    Yields one statement per kind of row, producing the rollup columns in
+    table order.
+    """
+    source = attends.join(activities, activities.c.id == attends.c.activity_id)
+    club = activities.c.club_id
+    for by_activity, by_user in ((False, False), (True, False),
+                                 (False, True)):
+        activity = attends.c.activity_id if by_activity else \
+            literal_column('0').label('activity_id')
+        user = attends.c.user_id if by_user else \
+            literal_column('0').label('user_id')
+        keys = [club]
+        if by_activity:
+            keys.append(activity)
+        if by_user:
+            keys.append(user)
+        stmt = select([club, activity, user, attends.c.status,
+                       func.count(attends.c.id)]) \
+            .select_from(source) \
+            .where(attends.c.status.isnot(None)) \
+            .group_by(*(keys + [attends.c.status]))
+        if by_user:
+            stmt = stmt.where(attends.c.user_id.isnot(None))
+        if club_id is not None:
+            stmt = stmt.where(club == club_id)
+        yield stmt
+
+
+def rebuild(club_id=None):
+    """Recompute the rollup rows of one club, or of every club.
+
+    Runs a constant number of set-based statements in the current session
+    transaction; the caller commits.
+    """
+    delete = rollups.delete()
+    if club_id is not None:
+        delete = delete.where(rollups.c.club_id == club_id)
+    db.session.execute(delete)
+    for stmt in grouped_counts(club_id):
+        db.session.execute(rollups.insert().from_select(
+            ['club_id', 'activity_id', 'user_id', 'status', 'count'], stmt))
+
+
+def check():
+    """Return ``(key, expected, actual)`` for every rollup row that is off."""
+    expected = {}
+    for stmt in grouped_counts():
+        for club, activity, user, status, count in db.session.execute(stmt):
+            expected[(club, activity, user, status)] = count
+    actual = {}
+    for club, activity, user, status, count in \
+            db.session.execute(select([rollups])):
+        if count:
+            actual[(club, activity, user, status)] = count
+    return [(key, expected.get(key, 0), actual.get(key, 0))
+            for key in set(expected) | set(actual)
+            if expected.get(key, 0) != actual.get(key, 0)]
+
+
+def attend_inserted(mapper, connection, target):
+    apply_delta(connection, club_of(connection, target.activity_id),
+                target.activity_id, target.user_id, target.status, 1)
+
+
+def attend_updated(mapper, connection, target):
+    state = db.inspect(target)
+    old = {}
+    for name in ('activity_id', 'user_id', 'status'):
+        history = state.attrs[name].history
+        if history.deleted:
+            old[name] = history.deleted[0]
+        else:
+            old[name] = getattr(target, name)
+    if old == dict((name, getattr(target, name)) for name in old):
+        return
+    old_club_id = club_of(connection, old['activity_id'])
+    club_id = old_club_id if target.activity_id == old['activity_id'] \
+        else club_of(connection, target.activity_id)
+    deltas = {}
+    add_delta(deltas, old_club_id, old['activity_id'], old['user_id'],
+              old['status'], -1)
+    add_delta(deltas, club_id, target.activity_id, target.user_id,
+              target.status, 1)
+    apply_deltas(connection, deltas)
+
+
+def attend_deleted(mapper, connection, target):
+    apply_delta(connection, club_of(connection, target.activity_id),
+                target.activity_id, target.user_id, target.status, -1)
+
+
+db.event.listen(Attend, 'after_insert', attend_inserted)
+db.event.listen(Attend, 'after_update', attend_updated)
+db.event.listen(Attend, 'after_delete', attend_deleted)
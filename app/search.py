@@ -0,0 +1,417 @@
+import re
+from collections import namedtuple
+
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from jinja2 import Markup, escape
+from sqlalchemy import text
+
+from . import db
+from .models import Activity, ActivityStatus, Club, Post
+
+Result = namedtuple('Result', 'kind id title excerpt')
+
+# kind -> (rowid tag, model, title column, body column); a document's
+# rowid is ``tag << TAG_SHIFT | id`` so it can be replaced without a lookup
+# and every kind is a range of rowids.  Newest first lists clubs, then
+# activities, then posts.
+SOURCES = {
+    'club': (3, Club, 'name', 'description'),
+    'activity': (2, Activity, 'name', 'description'),
+    'post': (1, Post, None, 'body'),
+}
+
+TAG_SHIFT = 40
+
+# kind -> (column, values) of the documents everyone may see; others are
+# left out of the index until the column changes to one of the values
+PUBLISHED = {
+    'activity': ('status', (ActivityStatus.accepted, ActivityStatus.rollcall,
+                            ActivityStatus.finished)),
+}
+
+# Trigrams cannot find words shorter than three characters, so with the
+# trigram tokenizer SQLite also indexes the two character substrings of the
+# text, as space separated tokens, in a second table.
+BIGRAM_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index_bigrams USING fts5("
+    "title, body, kind UNINDEXED, tokenize = 'unicode61', prefix = '1')")
+
+WORD_RUN = re.compile(r'[^\W_]+')
+
+# bm25 weighs a phrase by counting every document it is in, so it is only
+# used when no phrase of the query has more than :candidates matches
+FREQUENT = ("SELECT 1 FROM {table} WHERE {table} MATCH :phrase "
+            "ORDER BY rowid DESC LIMIT 1 OFFSET :candidates")
+
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+DDL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "title, body, kind UNINDEXED, ref_id UNINDEXED, {options})",
+    ],
+    'mysql': [
+        "CREATE TABLE IF NOT EXISTS search_index ("
+        "rowid BIGINT NOT NULL PRIMARY KEY, "
+        "title VARCHAR(255), body TEXT, "
+        "kind VARCHAR(16) NOT NULL, ref_id INTEGER NOT NULL, "
+        "FULLTEXT KEY ft_search_index (title, body) WITH PARSER ngram"
+        ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4",
+    ],
+    'default': [
+        "CREATE TABLE IF NOT EXISTS search_index ("
+        "rowid BIGINT NOT NULL PRIMARY KEY, "
+        "title VARCHAR(255), body TEXT, "
+        "kind VARCHAR(16) NOT NULL, ref_id INTEGER NOT NULL)",
+    ],
+}
+
+SEARCH = {
+    # {rank} is bm25 or, for frequent phrases, a constant that leaves the
+    # newest matches first; the documents of the page are read afterwards
+    'sqlite':
+        "SELECT search_index.kind, search_index.ref_id, search_index.title, "
+        "search_index.body FROM ("
+        "SELECT rowid, {rank} AS score FROM {table} "
+        "WHERE {table} MATCH :query {kind} "
+        "ORDER BY score, rowid DESC LIMIT :limit OFFSET :offset) AS ranked "
+        "JOIN search_index ON search_index.rowid = ranked.rowid "
+        "ORDER BY ranked.score, ranked.rowid DESC",
+    'mysql':
+        "SELECT kind, ref_id, title, body "
+        "FROM search_index "
+        "WHERE MATCH(title, body) AGAINST(:query IN BOOLEAN MODE) {kind} "
+        "ORDER BY MATCH(title, body) AGAINST(:query IN BOOLEAN MODE) DESC "
+        "LIMIT :limit OFFSET :offset",
+    'default':
+        "SELECT kind, ref_id, title, body "
+        "FROM search_index WHERE {terms} {kind} "
+        "ORDER BY rowid DESC LIMIT :limit OFFSET :offset",
+}
+
+
+def dialect(bind):
+    name = bind.dialect.name
+    return name if name in DDL else 'default'
+
+
+def trigram(tokenizer):
+    return tokenizer.split()[0] == 'trigram'
+
+
+def fts_options(tokenizer):
+    """FTS5 table options for ``tokenizer``.
+
+    The trigram tokenizer indexes every three character substring, which
+    is what lets Chinese text, written without spaces, be searched by any
+    part of a word.  Other tokenizers get prefix indexes instead.
+    """
+    options = "tokenize = '%s'" % tokenizer.replace("'", "''")
+    if not trigram(tokenizer):
+        options += ", prefix = '2 3'"
+    return options
+
+
+def bigram_index(bind):
+    """Whether short words are looked up in ``search_index_bigrams``."""
+    return dialect(bind) == 'sqlite' and \
+        trigram(current_app.config['FLASKY_SEARCH_TOKENIZER'])
+
+
+def bigrams(text):
+    """Tokens of ``search_index_bigrams`` for ``text``.
+
+    Every run of letters and digits gives its two character substrings in
+    order, then its last character, so a word is found as the phrase of
+    its bigrams and a single character as a prefix.
+    """
+    tokens = []
+    for run in WORD_RUN.findall(text or ''):
+        tokens.extend(pairs(run))
+        tokens.append(run[-1])
+    return ' '.join(tokens)
+
+
+def pairs(run):
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def create_index(target, connection, **kw):
+    options = fts_options(current_app.config['FLASKY_SEARCH_TOKENIZER'])
+    for statement in DDL[dialect(connection)]:
+        connection.execute(statement.format(options=options))
+    if bigram_index(connection):
+        connection.execute(BIGRAM_DDL)
+
+
+def drop_index(target, connection, **kw):
+    connection.execute('DROP TABLE IF EXISTS search_index')
+    connection.execute('DROP TABLE IF EXISTS search_index_bigrams')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic autogenerate filter leaving out the index tables, which are
+    not models, and the shadow tables FTS5 creates for them."""
+    return not (type_ == 'table' and (name == 'search_index' or
+                                      name.startswith('search_index_')))
+
+
+def terms(query):
+    return [term for term in re.split(r'\s+', query.strip()) if term][:8]
+
+
+def match_query(name, words, tokenizer=None):
+    """Match every word, escaping the backend's query syntax."""
+    if name == 'sqlite':
+        return ' '.join(match_phrases(words, tokenizer))
+    words = re.sub(r'[+\-<>()~*"@]', ' ', ' '.join(words)).split()
+    return ' '.join('+%s*' % word for word in words)
+
+
+def match_phrases(words, tokenizer):
+    """FTS5 phrases of ``words`` in ``search_index``.
+
+    With the trigram tokenizer a quoted word matches it anywhere in the
+    text.  Otherwise words are prefix matched, except single characters,
+    which the SQLite index keeps no prefixes of.
+    """
+    if trigram(tokenizer):
+        return ['"%s"' % word.replace('"', '""') for word in words]
+    return ['"%s"%s' % (word.replace('"', '""'),
+                        '*' if len(word) > 1 else '') for word in words]
+
+
+def bigram_phrases(words):
+    """FTS5 phrases of ``words`` in ``search_index_bigrams``; letters and
+    digits separated by other characters are matched separately."""
+    phrases = []
+    for word in words:
+        for run in WORD_RUN.findall(word):
+            if len(run) == 1:
+                phrases.append('"%s"*' % run)
+            else:
+                phrases.append('"%s"' % ' '.join(pairs(run)))
+    return phrases
+
+
+def frequent(table, phrases, candidates):
+    """Whether a phrase matches more than ``candidates`` documents."""
+    statement = text(FREQUENT.format(table=table))
+    return any(db.session.execute(statement, {'phrase': phrase,
+                                              'candidates': candidates})
+               .first() for phrase in phrases)
+
+
+def like_terms(words, params):
+    """``LIKE`` conditions finding every word in the title or body."""
+    clauses = []
+    for i, word in enumerate(words):
+        params['term%d' % i] = '%%%s%%' % re.sub(r'([\\%_])', r'\\\1',
+                                                word)
+        clauses.append("(title LIKE :term{0} ESCAPE '\\' "
+                       "OR body LIKE :term{0} ESCAPE '\\')".format(i))
+    return clauses
+
+
+def excerpt(body, words, width=120):
+    """Text of ``body`` around the first matching word, with markers."""
+    body = body or ''
+    lower = body.lower()
+    positions = [lower.find(word.lower()) for word in words]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions) - width // 3) if positions else 0
+    part = body[start:start + width]
+    for word in words:
+        part = re.sub('(%s)' % re.escape(word),
+                      HIGHLIGHT_START + r'\1' + HIGHLIGHT_END, part,
+                      flags=re.IGNORECASE)
+    return ('...' if start else '') + part + \
+        ('...' if start + width < len(body) else '')
+
+
+def highlight(snippet):
+    return Markup(str(escape(snippet))
+                  .replace(HIGHLIGHT_START, '<mark>')
+                  .replace(HIGHLIGHT_END, '</mark>'))
+
+
+def search(query, kind=None, page=1, per_page=20):
+    """Rank documents matching every word of ``query``.
+
+    Returns a ``Pagination`` of :class:`Result`.  The total is not counted;
+    it is only known to exceed the current page when another page exists.
+    On SQLite a query with a word found in more than
+    ``FLASKY_SEARCH_CANDIDATES`` documents lists the newest matches first
+    instead of ranking them, so it costs about as much as a rare one.  With
+    the trigram tokenizer a query with a word shorter than three characters
+    is answered from ``search_index_bigrams``.
+    """
+    words = terms(query)
+    if not words:
+        return Pagination(None, 1, per_page, 0, [])
+    if page < 1:
+        page = 1
+    name = dialect(db.engine)
+    params = {'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    kind_filter = ''
+    if kind in SOURCES:
+        kind_filter = 'AND kind = :kind'
+        params['kind'] = kind
+    table = 'search_index'
+    term_filter = ''
+    rank = ''
+    if name == 'default':
+        term_filter = ' AND '.join(like_terms(words, params))
+    elif name == 'sqlite':
+        tokenizer = current_app.config['FLASKY_SEARCH_TOKENIZER']
+        if trigram(tokenizer) and min(len(word) for word in words) < 3:
+            table = 'search_index_bigrams'
+            phrases = bigram_phrases(words)
+            if not phrases:
+                return Pagination(None, 1, per_page, 0, [])
+        else:
+            phrases = match_phrases(words, tokenizer)
+        params['query'] = ' '.join(phrases)
+        if kind in SOURCES:
+            kind_filter = 'AND rowid BETWEEN :low AND :high'
+            params['low'] = SOURCES[kind][0] << TAG_SHIFT
+            params['high'] = params['low'] + (1 << TAG_SHIFT) - 1
+        rank = 'bm25(%s, 4.0, 1.0)' % table
+        if frequent(table, phrases,
+                    current_app.config['FLASKY_SEARCH_CANDIDATES']):
+            rank = '0'
+    else:
+        params['query'] = match_query(name, words)
+    statement = SEARCH[name].format(kind=kind_filter, terms=term_filter,
+                                    table=table, rank=rank)
+    rows = db.session.execute(text(statement), params).fetchall()
+    items = []
+    for kind_, ref_id, title, body in rows[:per_page]:
+        items.append(Result(kind_, ref_id, title,
+                            highlight(excerpt(body, words))))
+    total = (page - 1) * per_page + len(rows)
+    return Pagination(None, page, per_page, total, items)
+
+
+def document(kind, target):
+    tag, model, title, body = SOURCES[kind]
+    return {'rowid': tag << TAG_SHIFT | target.id, 'kind': kind,
+            'ref_id': target.id,
+            'title': getattr(target, title) if title else '',
+            'body': getattr(target, body) or ''}
+
+
+def unindex(connection, rowids):
+    tables = ['search_index']
+    if bigram_index(connection):
+        tables.append('search_index_bigrams')
+    for table in tables:
+        connection.execute(
+            text('DELETE FROM %s WHERE rowid = :rowid' % table),
+            [{'rowid': rowid} for rowid in rowids])
+
+
+def index_documents(connection, documents):
+    if not documents:
+        return
+    unindex(connection, [doc['rowid'] for doc in documents])
+    connection.execute(text(
+        'INSERT INTO search_index (rowid, title, body, kind, ref_id) '
+        'VALUES (:rowid, :title, :body, :kind, :ref_id)'), documents)
+    if bigram_index(connection):
+        connection.execute(text(
+            'INSERT INTO search_index_bigrams (rowid, title, body, kind) '
+            'VALUES (:rowid, :title, :body, :kind)'),
+            [dict(doc, title=bigrams(doc['title']),
+                  body=bigrams(doc['body'])) for doc in documents])
+
+
+def rebuild(recreate=False):
+    """Reindex every club, published activity and post with set-based
+    statements.
+
+    With ``recreate`` the table is dropped and created again first, so a
+    changed ``FLASKY_SEARCH_TOKENIZER`` takes effect.
+    """
+    connection = db.session.connection()
+    if recreate:
+        drop_index(None, connection)
+        create_index(None, connection)
+    else:
+        db.session.execute(text('DELETE FROM search_index'))
+        if bigram_index(connection):
+            db.session.execute(text('DELETE FROM search_index_bigrams'))
+    for kind, (tag, model, title, body) in SOURCES.items():
+        table = model.__tablename__
+        db.session.execute(text(
+            "INSERT INTO search_index (rowid, title, body, kind, ref_id) "
+            "SELECT {base} + id, {title}, COALESCE({body}, ''), "
+            "'{kind}', id FROM {table} {where}".format(
+                base=tag << TAG_SHIFT, title=title or "''", body=body,
+                kind=kind, table=table, where=published_filter(kind))))
+    if bigram_index(connection):
+        fill_bigrams(connection)
+
+
+def published_filter(kind):
+    """``WHERE`` clause of the rows of ``kind`` that are indexed."""
+    if kind not in PUBLISHED:
+        return ''
+    column, values = PUBLISHED[kind]
+    # enums are stored by name
+    return 'WHERE %s IN (%s)' % (column, ', '.join(
+        "'%s'" % value.name for value in values))
+
+
+def published(kind, target):
+    if kind not in PUBLISHED:
+        return True
+    column, values = PUBLISHED[kind]
+    return getattr(target, column) in values
+
+
+def fill_bigrams(connection):
+    """Copy ``search_index`` into ``search_index_bigrams`` in SQLite, with
+    :func:`bigrams` registered as a function of the connection."""
+    connection.connection.create_function('bigrams', 1, bigrams)
+    connection.execute(text(
+        "INSERT INTO search_index_bigrams (rowid, title, body, kind) "
+        "SELECT rowid, bigrams(title), bigrams(body), kind "
+        "FROM search_index"))
+
+
+def listeners(kind):
+    tag, model, title, body = SOURCES[kind]
+    columns = [column for column in (title, body) if column]
+    if kind in PUBLISHED:
+        columns.append(PUBLISHED[kind][0])
+
+    def inserted(mapper, connection, target):
+        if published(kind, target):
+            index_documents(connection, [document(kind, target)])
+
+    def updated(mapper, connection, target):
+        state = db.inspect(target)
+        if not any(state.attrs[column].history.has_changes()
+                   for column in columns):
+            return
+        if published(kind, target):
+            index_documents(connection, [document(kind, target)])
+        else:
+            unindex(connection, [tag << TAG_SHIFT | target.id])
+
+    def deleted(mapper, connection, target):
+        unindex(connection, [tag << TAG_SHIFT | target.id])
+
+    db.event.listen(model, 'after_insert', inserted)
+    db.event.listen(model, 'after_update', updated)
+    db.event.listen(model, 'after_delete', deleted)
+
+
+for kind in SOURCES:
+    listeners(kind)
+
+db.event.listen(db.metadata, 'after_create', create_index)
+db.event.listen(db.metadata, 'after_drop', drop_index)
@@ -0,0 +1,111 @@
+import heapq
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class RequestQueries(object):
+    """Statements issued while handling one request."""
+
+    def __init__(self, keep):
+        self.count = 0
+        self.time = 0.0
+        self.keep = keep
+        self.slowest = []
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.time += duration
+        entry = (duration, statement)
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def top(self):
+        return sorted(self.slowest, reverse=True)
+
+
+class QueryStats(object):
+    """Counts the SQL statements and database time of every request.
+
+    The numbers are sent as ``X-Query-Count`` and ``X-Query-Time`` (in
+    milliseconds) response headers when ``FLASKY_QUERY_HEADERS`` is set,
+    which defaults to debug mode, and otherwise logged as one INFO line
+    per request.  Requests issuing more than ``FLASKY_QUERY_BUDGET``
+    statements and statements slower than ``FLASKY_SLOW_DB_QUERY_TIME``
+    seconds are logged as warnings together with the
+    ``FLASKY_QUERY_SLOWEST`` slowest statements of the request.  Everything
+    goes to the ``app.sqlstats`` logger, which the production
+    configuration sends to stderr at INFO level.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    @property
+    def current(self):
+        if not has_request_context():
+            return None
+        return g.get('query_stats')
+
+    def _start(self):
+        g.query_stats = RequestQueries(
+            current_app.config['FLASKY_QUERY_SLOWEST'])
+
+    def _finish(self, response):
+        stats = self.current
+        if stats is None:
+            return response
+        config = current_app.config
+        headers = config['FLASKY_QUERY_HEADERS']
+        if headers is None:
+            headers = current_app.debug
+        if headers:
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time'] = '%.1f' % (stats.time * 1000)
+        else:
+            logger.info('%s %s %d queries in %.1fms', request.method,
+                        request.path, stats.count, stats.time * 1000)
+        budget = config['FLASKY_QUERY_BUDGET']
+        if budget and stats.count > budget:
+            logger.warning(
+                'Query budget exceeded by %s: %d queries (budget %d), '
+                'slowest:\n%s', request.endpoint, stats.count, budget,
+                '\n'.join('%.1fms %s' % (duration * 1000, statement)
+                          for duration, statement in stats.top()))
+        return response
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    duration = time.time() - conn.info['query_start'].pop()
+    if not has_request_context():
+        return
+    stats = g.get('query_stats')
+    if stats is None:
+        return
+    stats.add(statement, duration)
+    if duration >= current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
+        logger.warning(
+            'Slow query in %s: %.1fms\n%s', request.endpoint,
+            duration * 1000, statement)
+
+
+event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
@@ -0,0 +1,155 @@
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import and_, func
+
+from . import db, rollup, statistics_cache
+from .models import Activity, Attend, AttendRollup, Club, User, joins
+
+
+def cached(key, query):
+    info = statistics_cache.get(key)
+    if info is None:
+        info = OrderedDict((label, count) for label, count in query)
+        statistics_cache.set(key, info)
+    return info
+
+
+def use_rollup():
+    return current_app.config['FLASKY_ATTEND_ROLLUP']
+
+
+def student_attendance(user_id):
+    """Attend rows of a user per joined club, keyed by club name."""
+    if use_rollup():
+        query = db.session.query(Club.name, rollup.total()) \
+            .join(joins, joins.c.club_id == Club.id) \
+            .outerjoin(AttendRollup, rollup.member_rows(Club.id, user_id))
+    else:
+        query = db.session.query(Club.name, func.count(Attend.id)) \
+            .join(joins, joins.c.club_id == Club.id) \
+            .outerjoin(Activity, Activity.club_id == Club.id) \
+            .outerjoin(Attend, and_(Attend.activity_id == Activity.id,
+                                    Attend.user_id == user_id))
+    query = query.filter(joins.c.user_id == user_id) \
+        .group_by(Club.id, Club.name) \
+        .order_by(Club.id)
+    return cached(('student', user_id), query)
+
+
+def club_member_attendance(club_id):
+    """Attend rows in a club's activities per member, keyed by name."""
+    if use_rollup():
+        query = db.session.query(User.name, rollup.total()) \
+            .select_from(joins) \
+            .join(User, User.id == joins.c.user_id) \
+            .outerjoin(AttendRollup, rollup.member_rows(club_id, User.id))
+    else:
+        query = db.session.query(User.name, func.count(Activity.id)) \
+            .select_from(joins) \
+            .join(User, User.id == joins.c.user_id) \
+            .outerjoin(Attend, Attend.user_id == User.id) \
+            .outerjoin(Activity, and_(Activity.id == Attend.activity_id,
+                                      Activity.club_id == club_id))
+    query = query.filter(joins.c.club_id == club_id) \
+        .group_by(User.id, User.name) \
+        .order_by(User.id)
+    return cached(('members', club_id), query)
+
+
+def club_activity_attendance(club_id):
+    """Attend rows per activity of a club, keyed by activity name."""
+    if use_rollup():
+        query = db.session.query(Activity.name, rollup.total()) \
+            .outerjoin(AttendRollup, rollup.activity_rows(Activity.id))
+    else:
+        query = db.session.query(Activity.name, func.count(Attend.id)) \
+            .outerjoin(Attend, Attend.activity_id == Activity.id)
+    query = query.filter(Activity.club_id == club_id) \
+        .group_by(Activity.id, Activity.name) \
+        .order_by(Activity.id)
+    return cached(('activities', club_id), query)
+
+
+def club_attendance():
+    """Attend rows across all activities of every club, keyed by name."""
+    if use_rollup():
+        query = db.session.query(Club.name, rollup.total()) \
+            .outerjoin(AttendRollup, rollup.club_rows(Club.id))
+    else:
+        query = db.session.query(Club.name, func.count(Attend.id)) \
+            .outerjoin(Activity, Activity.club_id == Club.id) \
+            .outerjoin(Attend, Attend.activity_id == Activity.id)
+    query = query.group_by(Club.id, Club.name) \
+        .order_by(Club.id)
+    return cached(('clubs',), query)
+
+
+def forget(keys):
+    for key in keys:
+        statistics_cache.delete(key)
+
+
+def statistics_changed(keys):
+    # forget now for this session and again once the change is committed,
+    # in case another request cached the old counts in between
+    forget(keys)
+    db.session.info.setdefault('statistics', set()).update(keys)
+
+
+def attend_changed(mapper, connection, target):
+    """Forget the statistics of the clubs and users ``target`` counts for."""
+    if not statistics_cache.enabled:
+        return
+    state = db.inspect(target)
+    activity_ids = set(state.attrs.activity_id.history.sum())
+    activity_ids.add(target.activity_id)
+    user_ids = set(state.attrs.user_id.history.sum())
+    user_ids.add(target.user_id)
+    keys = set([('clubs',)])
+    for activity_id in activity_ids:
+        club_id = rollup.club_of(connection, activity_id)
+        keys.update([('members', club_id), ('activities', club_id)])
+    keys.update(('student', user_id) for user_id in user_ids)
+    statistics_changed(keys)
+
+
+def attend_updated(mapper, connection, target):
+    # every status is counted, so only moving an attend to another activity
+    # or user changes the statistics
+    state = db.inspect(target)
+    if state.attrs.activity_id.history.has_changes() or \
+            state.attrs.user_id.history.has_changes():
+        attend_changed(mapper, connection, target)
+
+
+def activity_changed(mapper, connection, target):
+    if statistics_cache.enabled:
+        statistics_changed([('activities', target.club_id)])
+
+
+def club_changed(mapper, connection, target):
+    if statistics_cache.enabled:
+        statistics_changed([('clubs',)])
+
+
+def membership_changed(club, user, initiator):
+    if statistics_cache.enabled:
+        statistics_changed([('members', club.id), ('student', user.id)])
+
+
+def apply_statistics_changes(session):
+    forget(session.info.pop('statistics', ()))
+
+
+db.event.listen(Attend, 'after_insert', attend_changed)
+db.event.listen(Attend, 'after_update', attend_updated)
+db.event.listen(Attend, 'after_delete', attend_changed)
+for event in ('after_insert', 'after_delete'):
+    db.event.listen(Activity, event, activity_changed)
+    db.event.listen(Club, event, club_changed)
+# the User.clubs backref fires these too
+db.event.listen(Club.members, 'append', membership_changed)
+db.event.listen(Club.members, 'remove', membership_changed)
+db.event.listen(db.session, 'after_commit', apply_statistics_changes)
+db.event.listen(db.session, 'after_rollback', apply_statistics_changes)
@@ -0,0 +1,167 @@
+import bisect
+import calendar
+import threading
+
+from flask import current_app
+from flask_sqlalchemy import Pagination
+
+
+def _score(timestamp):
+    return calendar.timegm(timestamp.utctimetuple()) + \
+        timestamp.microsecond / 1e6
+
+
+class LocalTimelineStore(object):
+    """In-process stand-in for :class:`RedisTimelineStore`.
+
+    Each materialized inbox is a list of ``(-score, -post_id)`` keys so that
+    plain ascending order is newest first.
+    """
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self._inboxes = {}
+        self._lock = threading.Lock()
+
+    def has(self, user_id):
+        return user_id in self._inboxes
+
+    def replace(self, user_id, entries):
+        inbox = sorted((-score, -post_id) for post_id, score in entries)
+        with self._lock:
+            self._inboxes[user_id] = inbox[:self.max_length]
+
+    def push(self, user_ids, post_id, score):
+        key = (-score, -post_id)
+        with self._lock:
+            for user_id in user_ids:
+                inbox = self._inboxes.get(user_id)
+                if inbox is None:
+                    continue
+                bisect.insort(inbox, key)
+                del inbox[self.max_length:]
+
+    def delete(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._inboxes.pop(user_id, None)
+
+    def length(self, user_id):
+        return len(self._inboxes.get(user_id, ()))
+
+    def range(self, user_id, start, stop):
+        inbox = self._inboxes.get(user_id, ())
+        return [-post_id for _, post_id in inbox[start:stop]]
+
+
+class RedisTimelineStore(object):
+    """Inboxes kept as Redis sorted sets scored by post timestamp."""
+
+    def __init__(self, url, max_length, prefix='timeline:'):
+        import redis
+        self.redis = redis.StrictRedis.from_url(url)
+        self.max_length = max_length
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return '%s%d' % (self.prefix, user_id)
+
+    def _built_key(self, user_id):
+        return '%sbuilt:%d' % (self.prefix, user_id)
+
+    def has(self, user_id):
+        return bool(self.redis.exists(self._built_key(user_id)))
+
+    def replace(self, user_id, entries):
+        key = self._key(user_id)
+        pipe = self.redis.pipeline()
+        pipe.delete(key)
+        if entries:
+            pipe.zadd(key, dict((post_id, score)
+                                for post_id, score in entries))
+        pipe.set(self._built_key(user_id), 1)
+        pipe.execute()
+
+    def push(self, user_ids, post_id, score):
+        user_ids = [user_id for user_id in user_ids if self.has(user_id)]
+        pipe = self.redis.pipeline()
+        for user_id in user_ids:
+            key = self._key(user_id)
+            pipe.zadd(key, {post_id: score})
+            pipe.zremrangebyrank(key, 0, -self.max_length - 1)
+        pipe.execute()
+
+    def delete(self, user_ids):
+        keys = []
+        for user_id in user_ids:
+            keys.extend([self._key(user_id), self._built_key(user_id)])
+        if keys:
+            self.redis.delete(*keys)
+
+    def length(self, user_id):
+        return self.redis.zcard(self._key(user_id))
+
+    def range(self, user_id, start, stop):
+        return [int(post_id) for post_id in
+                self.redis.zrevrange(self._key(user_id), start, stop - 1)]
+
+
+class Timeline(object):
+    """Fan-out-on-write inboxes for the followed posts timeline.
+
+    When ``FLASKY_TIMELINE_FANOUT`` is enabled every committed post id is
+    pushed to the inboxes of its author's followers, and the home page reads
+    a page of ids straight from the reader's inbox.  Inboxes are dropped
+    when their owner follows or unfollows someone and lazily rebuilt from
+    ``User.followed_posts`` on the next read.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['FLASKY_TIMELINE_REDIS_URL']:
+            store = RedisTimelineStore(app.config['FLASKY_TIMELINE_REDIS_URL'],
+                                       app.config['FLASKY_TIMELINE_LENGTH'])
+        else:
+            store = LocalTimelineStore(app.config['FLASKY_TIMELINE_LENGTH'])
+        app.extensions['timeline'] = store
+
+    @property
+    def enabled(self):
+        return current_app.config['FLASKY_TIMELINE_FANOUT']
+
+    @property
+    def store(self):
+        return current_app.extensions['timeline']
+
+    def push(self, follower_ids, post_id, timestamp):
+        self.store.push(follower_ids, post_id, _score(timestamp))
+
+    def invalidate(self, user_ids):
+        self.store.delete(user_ids)
+
+    def rebuild(self, user, model):
+        rows = user.followed_posts \
+            .with_entities(model.id, model.timestamp) \
+            .order_by(model.timestamp.desc(), model.id.desc()) \
+            .limit(self.store.max_length)
+        self.store.replace(user.id, [(post_id, _score(timestamp))
+                                     for post_id, timestamp in rows])
+
+    def paginate(self, user, model, page, per_page):
+        """Return a page of ``user``'s timeline as a ``Pagination``."""
+        if not self.store.has(user.id):
+            self.rebuild(user, model)
+        if page < 1:
+            page = 1
+        start = (page - 1) * per_page
+        ids = self.store.range(user.id, start, start + per_page)
+        items = []
+        if ids:
+            posts = dict((post.id, post) for post in
+                         model.query.filter(model.id.in_(ids)))
+            items = [posts[post_id] for post_id in ids if post_id in posts]
+        return Pagination(None, page, per_page,
+                          self.store.length(user.id), items)
@@ -0,0 +1,214 @@
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+from . import db, rollup
+from .models import Attend, User
+from .pagecache import page_cache
+
+
+class WriteBehindBuffer(object):
+    """Coalesces per-row writes in memory until they are drained in bulk.
+
+    Later values for the same key replace earlier ones, so a flush writes
+    at most one row per key however many times it was touched.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def get(self, key):
+        return self._pending.get(key)
+
+    def add(self, key, value):
+        with self._lock:
+            self._pending[key] = value
+
+    def due(self):
+        return time.time() - self._last_flush >= self.interval
+
+    def schedule(self, function, *args):
+        """Call ``function(*args)`` on a daemon thread ``interval`` seconds
+        from now, unless a call is already scheduled."""
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self._run,
+                                              (function,) + args)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self, function, *args):
+        with self._lock:
+            self._timer = None
+        function(*args)
+
+    def drain(self, match=None):
+        """Remove and return the pending entries, or those whose key
+        ``match`` accepts."""
+        with self._lock:
+            if match is not None:
+                pending = dict((key, value)
+                               for key, value in self._pending.items()
+                               if match(key))
+                for key in pending:
+                    del self._pending[key]
+                return pending
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return pending
+
+
+class LastSeenTracker(object):
+    """Throttled, write-behind replacement for ``User.ping`` per request.
+
+    A user's new ``last_seen`` is only recorded when the known value is
+    older than ``FLASKY_LAST_SEEN_THRESHOLD`` seconds, and recorded values
+    are written with a single bulk UPDATE every
+    ``FLASKY_LAST_SEEN_FLUSH_INTERVAL`` seconds and at interpreter exit.
+    """
+
+    def __init__(self, app=None):
+        # registered once per process; the apps are only weakly referenced
+        # so the ones that went away are not kept alive until exit
+        self._apps = weakref.WeakSet()
+        atexit.register(self._flush_apps)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['last_seen'] = WriteBehindBuffer(
+            app.config['FLASKY_LAST_SEEN_FLUSH_INTERVAL'])
+        self._apps.add(app)
+
+    @property
+    def buffer(self):
+        return current_app.extensions['last_seen']
+
+    def touch(self, user):
+        now = datetime.utcnow()
+        seen = self.buffer.get(user.id) or user.last_seen
+        threshold = timedelta(
+            seconds=current_app.config['FLASKY_LAST_SEEN_THRESHOLD'])
+        if seen is None or now - seen >= threshold:
+            self.buffer.add(user.id, now)
+        if self.buffer.due():
+            self.flush()
+
+    def flush(self):
+        pending = self.buffer.drain()
+        if not pending:
+            return
+        stmt = User.__table__.update() \
+            .where(User.id == bindparam('user_id')) \
+            .values(last_seen=bindparam('seen'))
+        with db.engine.begin() as connection:
+            connection.execute(stmt, [{'user_id': user_id, 'seen': seen}
+                                      for user_id, seen in pending.items()])
+        # profiles show when the user was last seen
+        page_cache.invalidate('user:%s' % user_id for user_id in pending)
+
+    def _flush_app(self, app):
+        if not len(app.extensions['last_seen']):
+            return
+        with app.app_context():
+            self.flush()
+
+    def _flush_apps(self):
+        for app in list(self._apps):
+            self._flush_app(app)
+
+
+class CheckinBuffer(object):
+    """Optional write-behind queue for self check-ins during roll call.
+
+    With ``FLASKY_CHECKIN_BUFFER`` enabled validated check-ins are recorded
+    in memory, and a timer thread writes them at most
+    ``FLASKY_CHECKIN_FLUSH_INTERVAL`` seconds after the first one arrived,
+    with one conditional UPDATE and one rollup upsert per activity.
+    Check-ins still buffered when the process dies are lost.
+
+    Each process buffers its own check-ins.  A chief's roll call and
+    finishing the activity flush the serving process's check-ins of the
+    activity first; check-ins buffered by other processes are written
+    within the interval and, while roll call is still open, can still
+    mark a participant the chief left absent as attended.
+    """
+
+    def __init__(self, app=None):
+        self._apps = weakref.WeakSet()
+        atexit.register(self._flush_apps)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['checkins'] = WriteBehindBuffer(
+            app.config['FLASKY_CHECKIN_FLUSH_INTERVAL'])
+        self._apps.add(app)
+
+    @property
+    def enabled(self):
+        return current_app.config['FLASKY_CHECKIN_BUFFER']
+
+    @property
+    def buffer(self):
+        return current_app.extensions['checkins']
+
+    def add(self, activity_id, user_id):
+        self.buffer.add((activity_id, user_id), True)
+        self.buffer.schedule(self._flush_app,
+                             current_app._get_current_object())
+
+    def flush(self, activity_id=None):
+        """Write the buffered check-ins, or those of one activity, and
+        return how many participants were checked in."""
+        def match(key):
+            return key[0] == activity_id
+
+        pending = self.buffer.drain(match if activity_id is not None
+                                    else None)
+        if not pending:
+            return 0
+        by_activity = {}
+        for key, user_id in pending:
+            by_activity.setdefault(key, []).append(user_id)
+        checked_in = 0
+        for key, user_ids in sorted(by_activity.items()):
+            changes = Attend.check_in(key, sorted(user_ids))
+            rollup.moved(db.session.connection(), key, changes)
+            checked_in += len(changes or ())
+        page_cache.activities_changed(sorted(by_activity))
+        db.session.commit()
+        return checked_in
+
+    def _flush_app(self, app):
+        if not len(app.extensions['checkins']):
+            return
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Writing buffered check-ins failed')
+
+    def _flush_apps(self):
+        for app in list(self._apps):
+            self._flush_app(app)
+
+
+last_seen = LastSeenTracker()
+checkins = CheckinBuffer()
@@ -0,0 +1,173 @@
+"""Latency and query count benchmark of the hot HTTP endpoints.
+
+Seeds a scratch database with :mod:`app.fake` at ``--scale`` users, logs in
+as the ``chief`` demo account and requests every endpoint below
+``--requests`` times through the Flask test client after ``--warmup``
+untimed requests.  For each endpoint the p50/p90/p99 latencies in
+milliseconds and the SQL statements per request are reported.
+
+    python -m benchmarks.endpoints --scale 2000 --save baseline.json
+    python -m benchmarks.endpoints --scale 2000 --baseline baseline.json
+
+With ``--baseline`` the run fails when the p50 or p90 latency of an
+endpoint exceeds the baseline by more than ``--threshold`` (a fraction)
+or when it issues more queries than the baseline did.  Compare runs made
+with the same scale, seed and database backend.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+import click
+from sqlalchemy import event, func
+
+from app import create_app, db, fake
+from app.models import Club, Comment, Post, User
+from app.writebehind import last_seen
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def endpoints():
+    """Map benchmark names to ``(url, cookies)`` on the seeded data."""
+    chief = User.query.filter_by(username='chief').first()
+    club = Club.query.filter_by(name='篮球社').first()
+    post_id = db.session.query(Comment.post_id) \
+        .group_by(Comment.post_id) \
+        .order_by(func.count(Comment.id).desc()).limit(1).scalar() or \
+        db.session.query(func.min(Post.id)).scalar()
+    urls = OrderedDict([
+        ('main.index', ('/', {})),
+        ('main.index followed', ('/', {'show_followed': '1'})),
+        ('main.user', ('/user/%s' % chief.username, {})),
+        ('main.post', ('/post/%d' % post_id, {})),
+        ('club.clubs', ('/club/clubs', {})),
+        ('club.clubs all', ('/club/clubs', {'show_all_clubs': '1'})),
+        ('club.club_detail', ('/club/club/%d/ongoing' % club.id, {})),
+    ])
+    for category in ('ongoing', 'attended', 'reviewing', 'rejected', 'all'):
+        urls['club.activities %s' % category] = \
+            ('/club/activities/%s' % category, {})
+    urls['club.student_info'] = ('/club/statistics/student', {})
+    for category in ('members', 'activities'):
+        urls['club.club_info %s' % category] = \
+            ('/club/statistics/club/%d/%s' % (club.id, category), {})
+    urls['club.admin_info'] = ('/club/statistics/admin', {})
+    urls['main.search'] = ('/search?q=%s' % quote(club.name), {})
+    return chief.id, urls
+
+
+def measure(app, user_id, url, cookies, warmup, requests):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = str(user_id)
+        session['_fresh'] = True
+    for name, value in cookies.items():
+        client.set_cookie('localhost', name, value)
+    statements = []
+
+    def count(*args):
+        statements[-1] += 1
+
+    latencies = []
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        for i in range(warmup + requests):
+            statements.append(0)
+            start = time.time()
+            response = client.get(url)
+            elapsed = (time.time() - start) * 1000
+            if response.status_code != 200:
+                raise click.ClickException('%s returned %d'
+                                           % (url, response.status_code))
+            if i >= warmup:
+                latencies.append(elapsed)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    return {'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'queries': max(statements[warmup:])}
+
+
+def regressions(results, baseline, threshold):
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ('p50', 'p90'):
+            if result[key] > base[key] * (1 + threshold):
+                yield '%s: %s %.1fms, baseline %.1fms' % (
+                    name, key, result[key], base[key])
+        if result['queries'] > base['queries']:
+            yield '%s: %d queries, baseline %d' % (
+                name, result['queries'], base['queries'])
+
+
+@click.command()
+@click.option('--database-url', help='SQLAlchemy URL of a scratch database.')
+@click.option('--scale', default=1000, help='Generated users.')
+@click.option('--seed', default=0, help='Random seed of the dataset.')
+@click.option('--requests', default=50, help='Timed requests per endpoint.')
+@click.option('--warmup', default=5, help='Untimed requests per endpoint.')
+@click.option('--baseline', type=click.Path(exists=True),
+              help='Results of an earlier run to compare against.')
+@click.option('--threshold', default=0.2,
+              help='Allowed latency growth over the baseline.')
+@click.option('--save', type=click.Path(), help='Write the results here.')
+def main(database_url, scale, seed, requests, warmup, baseline, threshold,
+         save):
+    path = None
+    if not database_url:
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        database_url = 'sqlite:///' + path
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['WTF_CSRF_ENABLED'] = False
+    results = OrderedDict()
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            fake.init(users=scale, clubs=max(1, scale // 10),
+                      posts=scale * 3, comments=scale * 3,
+                      follows_per_user=10, skew=1.5, seed=seed)
+            user_id, urls = endpoints()
+            db.session.remove()
+            for name, (url, cookies) in urls.items():
+                results[name] = measure(app, user_id, url, cookies,
+                                        warmup, requests)
+                click.echo('%-32s p50 %7.1fms  p90 %7.1fms  p99 %7.1fms  '
+                           '%3d queries' % ((name,) + tuple(
+                               results[name][key] for key in
+                               ('p50', 'p90', 'p99', 'queries'))))
+            last_seen.flush()
+            db.session.remove()
+            db.drop_all()
+    finally:
+        if path:
+            os.remove(path)
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            failures = list(regressions(results, json.load(f), threshold))
+        for failure in failures:
+            click.echo(failure)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Latency benchmark of the full-text search.
+
+Runs every ``--query`` through :func:`app.search.search` ``--requests``
+times after ``--warmup`` untimed runs, unfiltered and for every ``--kind``,
+and reports the p50/p90/p99 latencies in milliseconds and the results of
+the first page.  Exits with status 1 when the p90 latency of a query
+exceeds ``--target`` ms.
+
+    flask seed --users 10000 --posts 1000000 --comments 0 --locale zh_CN
+    python -m benchmarks.search --database-url sqlite:///data-dev.sqlite
+
+Without ``--database-url`` a temporary SQLite file is seeded with
+:mod:`app.fake` at ``--posts`` posts of ``--locale`` text first.  The
+default queries are common and rare Chinese words of one to four
+characters, which exercise both the trigram and the bigram index, and
+every kind is measured.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import click
+
+from app import create_app, db, fake, search
+
+QUERIES = ('篮球', '作者', '的', '发布 作者', '中文信息', '篮球社', '有限公司 我们')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def measure(query, kind, warmup, requests):
+    latencies = []
+    for i in range(warmup + requests):
+        start = time.time()
+        results = search.search(query, kind=kind)
+        elapsed = (time.time() - start) * 1000
+        if i >= warmup:
+            latencies.append(elapsed)
+        db.session.remove()
+    return {'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'results': len(results.items)}
+
+
+@click.command()
+@click.option('--database-url',
+              help='SQLAlchemy URL of a database seeded with flask seed.')
+@click.option('--posts', default=1000000,
+              help='Posts to seed when no database is given.')
+@click.option('--locale', default='zh_CN', help='Locale of the seeded text.')
+@click.option('--query', 'queries', multiple=True,
+              help='Query to run, repeatable; defaults to Chinese words.')
+@click.option('--kind', 'kinds', multiple=True,
+              help='Kind to filter by, repeatable; defaults to every kind.')
+@click.option('--requests', default=50, help='Timed runs per query.')
+@click.option('--warmup', default=5, help='Untimed runs per query.')
+@click.option('--target', default=50.0, help='Highest p90 latency in ms.')
+def main(database_url, posts, locale, queries, kinds, requests, warmup,
+         target):
+    path = None
+    if not database_url:
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        database_url = 'sqlite:///' + path
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    failures = []
+    try:
+        with app.app_context():
+            if path:
+                start = time.time()
+                db.create_all()
+                fake.init(users=10000, clubs=1000, posts=posts, comments=0,
+                          follows_per_user=0, locale=locale)
+                db.session.remove()
+                click.echo('Seeded %d posts in %.1fs.'
+                           % (posts, time.time() - start))
+            for query in queries or QUERIES:
+                for kind in (None,) + (kinds or tuple(sorted(search.SOURCES))):
+                    label = '%s [%s]' % (query, kind or 'all')
+                    result = measure(query, kind, warmup, requests)
+                    click.echo('%-24s p50 %7.1fms  p90 %7.1fms  p99 %7.1fms  '
+                               '%3d results' % ((label,) + tuple(
+                                   result[key] for key in
+                                   ('p50', 'p90', 'p99', 'results'))))
+                    if result['p90'] > target:
+                        failures.append('%s: p90 %.1fms, target %.1fms'
+                                        % (label, result['p90'], target))
+    finally:
+        if path:
+            os.remove(path)
+
+    for failure in failures:
+        click.echo(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
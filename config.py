@@ -19,10 +19,62 @@ class Config:
     FLASKY_MAIL_SENDER = os.environ.get('MAIL_SENDER',
                                         'Flasky Admin <example@example.com>')
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
+    FLASKY_MAIL_QUEUE_SIZE = 100
+    FLASKY_MAIL_WORKERS = 2
+    FLASKY_MAIL_BATCH_SIZE = 20
+    FLASKY_MAIL_RETRIES = 3
+    FLASKY_MAIL_RETRY_DELAY = 1
+    FLASKY_MAIL_SINK = os.environ.get('FLASKY_MAIL_SINK')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     FLASKY_POSTS_PER_PAGE = 20
     FLASKY_FOLLOWERS_PER_PAGE = 50
     FLASKY_COMMENTS_PER_PAGE = 30
+    FLASKY_MARKDOWN_CACHE_SIZE = 1024
+    FLASKY_MARKDOWN_ASYNC = os.environ.get(
+        'FLASKY_MARKDOWN_ASYNC', 'false').lower() in ['true', 'on', '1']
+    FLASKY_MARKDOWN_WORKERS = 2
+    FLASKY_KEYSET_PAGINATION = os.environ.get(
+        'FLASKY_KEYSET_PAGINATION', 'false').lower() in ['true', 'on', '1']
+    FLASKY_TIMELINE_FANOUT = os.environ.get(
+        'FLASKY_TIMELINE_FANOUT', 'false').lower() in ['true', 'on', '1']
+    FLASKY_TIMELINE_LENGTH = 800
+    FLASKY_TIMELINE_REDIS_URL = os.environ.get('FLASKY_TIMELINE_REDIS_URL')
+    FLASKY_LAST_SEEN_THRESHOLD = 60
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = 30
+    # per-process caches, only invalidated in the process that commits a
+    # change: other processes see it up to the TTL late, so keep them off
+    # (0) unless the application runs in a single process
+    FLASKY_PRINCIPAL_CACHE_TTL = int(
+        os.environ.get('FLASKY_PRINCIPAL_CACHE_TTL', '0'))
+    FLASKY_STATISTICS_CACHE_TTL = int(
+        os.environ.get('FLASKY_STATISTICS_CACHE_TTL', '0'))
+    FLASKY_MEMBERSHIP_CACHE_TTL = int(
+        os.environ.get('FLASKY_MEMBERSHIP_CACHE_TTL', '0'))
+    FLASKY_ATTEND_ROLLUP = os.environ.get(
+        'FLASKY_ATTEND_ROLLUP', 'false').lower() in ['true', 'on', '1']
+    FLASKY_CHECKIN_BUFFER = os.environ.get(
+        'FLASKY_CHECKIN_BUFFER', 'false').lower() in ['true', 'on', '1']
+    FLASKY_CHECKIN_FLUSH_INTERVAL = 1
+    FLASKY_QUERY_HEADERS = None
+    FLASKY_QUERY_BUDGET = 30
+    FLASKY_QUERY_SLOWEST = 3
+    FLASKY_SLOW_DB_QUERY_TIME = 0.5
+    FLASKY_METRICS = os.environ.get(
+        'FLASKY_METRICS', 'false').lower() in ['true', 'on', '1']
+    FLASKY_METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                              2.5, 5, 10)
+    FLASKY_PAGE_CACHE = os.environ.get('FLASKY_PAGE_CACHE')
+    FLASKY_PAGE_CACHE_SIZE = 1000
+    FLASKY_PAGE_CACHE_DIR = os.environ.get('FLASKY_PAGE_CACHE_DIR') or \
+        os.path.join(basedir, 'page-cache')
+    FLASKY_ABOUT_CACHE_TTL = 3600
+    FLASKY_CLUBS_CACHE_TTL = 300
+    FLASKY_CLUB_CACHE_TTL = 60
+    FLASKY_PROFILE_CACHE_TTL = 60
+    FLASKY_SEARCH_RESULTS_PER_PAGE = 20
+    FLASKY_SEARCH_CANDIDATES = 5000
+    FLASKY_SEARCH_TOKENIZER = os.environ.get('FLASKY_SEARCH_TOKENIZER',
+                                             'trigram')
 
     @staticmethod
     def init_app(app):
@@ -45,6 +97,21 @@ class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
 
+    @classmethod
+    def init_app(cls, app):
+        Config.init_app(app)
+
+        # query statistics and warnings go to stderr unless the server
+        # configured logging itself
+        import logging
+        logger = logging.getLogger('app.sqlstats')
+        logger.setLevel(logging.INFO)
+        if not logger.handlers and not logging.getLogger().handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(
+                '[%(asctime)s] %(levelname)s in %(name)s: %(message)s'))
+            logger.addHandler(handler)
+
 
 config = {
     'development': DevelopmentConfig,
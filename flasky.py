@@ -1,10 +1,15 @@
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import click
 from dotenv import load_dotenv
 from flask_migrate import Migrate
 from app import create_app, db
 from app.models import User, Follow, Role, Permission, Post, Comment,\
     Club, Activity, CreateApplication, JoinApplication
-from app import fake
+from app import fake, markup, rollup, search
+from app.pagecache import page_cache
 import flask_admin
 from flask_admin.contrib import sqla
 from app.models import (User, Post, Comment, Club, JoinApplication,
@@ -40,3 +45,97 @@ def test():
     import unittest
     tests = unittest.TestLoader().discover('tests')
     unittest.TextTestRunner(verbosity=2).run(tests)
+
+
+@app.cli.command('rebuild-rollup')
+def rebuild_rollup():
+    """Rebuild the attendance rollup table from scratch."""
+    rollup.rebuild()
+    db.session.commit()
+    click.echo('Attendance rollup rebuilt.')
+
+
+@app.cli.command('check-rollup')
+def check_rollup():
+    """Compare the attendance rollup table against the attends table."""
+    mismatches = rollup.check()
+    for (club_id, activity_id, user_id, status), expected, actual \
+            in mismatches:
+        click.echo('club=%s activity=%s user=%s status=%s: expected %d, '
+                   'found %d' % (club_id, activity_id, user_id, status.name,
+                                 expected, actual))
+    if mismatches:
+        sys.exit(1)
+    click.echo('Attendance rollup is consistent.')
+
+
+@app.cli.command('repair-counters')
+def repair_counters():
+    """Recompute the post, comment and follow counters of every user."""
+    wrong = User.repair_counters()
+    db.session.commit()
+    if wrong:
+        # profiles show the counters
+        page_cache.clear()
+    click.echo('Repaired the counters of %d users.' % wrong)
+
+
+@app.cli.command()
+@click.option('--recreate', is_flag=True,
+              help='Create the index table again, e.g. after changing '
+                   'FLASKY_SEARCH_TOKENIZER.')
+def reindex(recreate):
+    """Rebuild the full-text search index from clubs, activities and posts."""
+    start = time.time()
+    search.rebuild(recreate)
+    db.session.commit()
+    click.echo('Reindexed in %.1fs.' % (time.time() - start))
+
+
+@app.cli.command()
+@click.argument('tables', nargs=-1,
+                type=click.Choice(['posts', 'comments']))
+@click.option('--start-id', default=0,
+              help='Resume after this id; needs a single table.')
+@click.option('--chunk-size', default=500, help='Rows per bulk UPDATE.')
+@click.option('--processes', default=None, type=int,
+              help='Render processes, defaults to the number of CPUs.')
+def rerender(tables, start_id, chunk_size, processes):
+    """Re-render body_html of posts and comments with the current tags."""
+    tables = tables or ('posts', 'comments')
+    if start_id and len(tables) != 1:
+        click.echo('--start-id needs exactly one table.')
+        sys.exit(1)
+    targets = {'posts': (Post.__table__, markup.POST_TAGS),
+               'comments': (Comment.__table__, markup.COMMENT_TAGS)}
+    with ProcessPoolExecutor(processes) as executor:
+        for name in tables:
+            table, tags = targets[name]
+            total = markup.remaining(table, start_id)
+            for last_id, rendered in markup.rerender(
+                    table, tags, start_id, chunk_size, executor):
+                click.echo('%s: %d/%d rendered, last id %d'
+                           % (name, rendered, total, last_id))
+            click.echo('%s: done.' % name)
+
+
+@app.cli.command()
+@click.option('--users', default=1000)
+@click.option('--clubs', default=100)
+@click.option('--posts', default=10000)
+@click.option('--comments', default=10000)
+@click.option('--follows-per-user', default=10)
+@click.option('--clubs-per-user', default=3)
+@click.option('--activities-per-club', default=10)
+@click.option('--attends-per-user', default=3)
+@click.option('--skew', default=1.5,
+              help='Popularity skew of users and clubs, 1 is uniform.')
+@click.option('--seed', default=0, help='Random seed.')
+@click.option('--batch-size', default=10000, help='Rows per INSERT batch.')
+@click.option('--locale', default=None,
+              help='Faker locale of the generated text, e.g. zh_CN.')
+def seed(**options):
+    """Bulk generate a deterministic dataset for load testing."""
+    start = time.time()
+    fake.init(**options)
+    click.echo('Seeded in %.1fs.' % (time.time() - start))
@@ -0,0 +1,31 @@
+"""attend rollups
+
+Revision ID: 5f2c1e7d9b3a
+Revises: 035c74b6dd26
+Create Date: 2026-10-18 10:12:31.402113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c1e7d9b3a'
+down_revision = '035c74b6dd26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('attend_rollups',
+    sa.Column('club_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('activity_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('status', sa.Enum('reviewing', 'accepted', 'rejected', 'attended', name='attendstatus'), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('club_id', 'activity_id', 'user_id', 'status')
+    )
+
+
+def downgrade():
+    op.drop_table('attend_rollups')
@@ -0,0 +1,36 @@
+"""composite indexes for the club workflow tables
+
+Revision ID: 8d41b6f0c2e7
+Revises: 5f2c1e7d9b3a
+Create Date: 2026-10-18 14:02:18.550731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41b6f0c2e7'
+down_revision = '5f2c1e7d9b3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_attends_activity_id_user_id_status', 'attends', ['activity_id', 'user_id', 'status'], unique=False)
+    op.create_index('ix_activities_club_id_status', 'activities', ['club_id', 'status'], unique=False)
+    op.create_index('ix_join_applications_club_id_status', 'join_applications', ['club_id', 'status'], unique=False)
+    op.create_index('ix_create_applications_status', 'create_applications', ['status'], unique=False)
+    op.create_index('ix_posts_club_id_timestamp', 'posts', ['club_id', 'timestamp'], unique=False)
+    op.create_index('ix_posts_author_id_timestamp', 'posts', ['author_id', 'timestamp'], unique=False)
+    op.create_index('ix_comments_post_id_timestamp', 'comments', ['post_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_post_id_timestamp', table_name='comments')
+    op.drop_index('ix_posts_author_id_timestamp', table_name='posts')
+    op.drop_index('ix_posts_club_id_timestamp', table_name='posts')
+    op.drop_index('ix_create_applications_status', table_name='create_applications')
+    op.drop_index('ix_join_applications_club_id_status', table_name='join_applications')
+    op.drop_index('ix_activities_club_id_status', table_name='activities')
+    op.drop_index('ix_attends_activity_id_user_id_status', table_name='attends')
@@ -0,0 +1,63 @@
+"""full-text search index over clubs, activities and posts
+
+Revision ID: b7e3a9d15c42
+Revises: 8d41b6f0c2e7
+Create Date: 2026-10-18 15:20:41.118203
+
+"""
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3a9d15c42'
+down_revision = '8d41b6f0c2e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    tokenizer = current_app.config.get('FLASKY_SEARCH_TOKENIZER', 'trigram')
+    bigrams = dialect == 'sqlite' and tokenizer.split()[0] == 'trigram'
+    if dialect == 'sqlite':
+        options = "tokenize = '%s'" % tokenizer.replace("'", "''")
+        if tokenizer.split()[0] != 'trigram':
+            options += ", prefix = '2 3'"
+        op.execute(
+            "CREATE VIRTUAL TABLE search_index USING fts5("
+            "title, body, kind UNINDEXED, ref_id UNINDEXED, " + options + ")")
+    else:
+        op.execute(
+            "CREATE TABLE search_index ("
+            "rowid BIGINT NOT NULL PRIMARY KEY, "
+            "title VARCHAR(255), body TEXT, "
+            "kind VARCHAR(16) NOT NULL, ref_id INTEGER NOT NULL"
+            + (", FULLTEXT KEY ft_search_index (title, body) WITH PARSER ngram"
+               ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+               if dialect == 'mysql' else ")"))
+    # rowids are tag << 40 | id, tags 3, 2 and 1, see app/search.py
+    op.execute(
+        "INSERT INTO search_index (rowid, title, body, kind, ref_id) "
+        "SELECT 3298534883328 + id, name, COALESCE(description, ''), "
+        "'club', id FROM clubs")
+    op.execute(
+        "INSERT INTO search_index (rowid, title, body, kind, ref_id) "
+        "SELECT 2199023255552 + id, name, COALESCE(description, ''), "
+        "'activity', id FROM activities "
+        "WHERE status IN ('accepted', 'rollcall', 'finished')")
+    op.execute(
+        "INSERT INTO search_index (rowid, title, body, kind, ref_id) "
+        "SELECT 1099511627776 + id, '', COALESCE(body, ''), 'post', id "
+        "FROM posts")
+    if bigrams:
+        # words shorter than a trigram, see app/search.py
+        from app.search import BIGRAM_DDL, fill_bigrams
+        op.execute(BIGRAM_DDL)
+        fill_bigrams(op.get_bind())
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS search_index_bigrams')
+    op.execute('DROP TABLE IF EXISTS search_index')
@@ -0,0 +1,31 @@
+"""updated_at version stamps on clubs, activities and posts
+
+Revision ID: c4f81e2a9d60
+Revises: b7e3a9d15c42
+Create Date: 2026-10-18 16:05:12.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f81e2a9d60'
+down_revision = 'b7e3a9d15c42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('activities', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('clubs', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('posts', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE activities SET updated_at = CURRENT_TIMESTAMP')
+    op.execute('UPDATE clubs SET updated_at = CURRENT_TIMESTAMP')
+    op.execute('UPDATE posts SET updated_at = timestamp')
+
+
+def downgrade():
+    op.drop_column('posts', 'updated_at')
+    op.drop_column('clubs', 'updated_at')
+    op.drop_column('activities', 'updated_at')
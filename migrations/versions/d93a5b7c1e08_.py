@@ -0,0 +1,40 @@
+"""post, comment and follow counters on users
+
+Revision ID: d93a5b7c1e08
+Revises: c4f81e2a9d60
+Create Date: 2026-10-18 16:48:37.905512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93a5b7c1e08'
+down_revision = 'c4f81e2a9d60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('followed_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        'UPDATE users SET '
+        'post_count = (SELECT count(*) FROM posts '
+        'WHERE posts.author_id = users.id), '
+        'comment_count = (SELECT count(*) FROM comments '
+        'WHERE comments.author_id = users.id), '
+        'follower_count = (SELECT count(*) FROM follows '
+        'WHERE follows.followed_id = users.id), '
+        'followed_count = (SELECT count(*) FROM follows '
+        'WHERE follows.follower_id = users.id)')
+
+
+def downgrade():
+    op.drop_column('users', 'followed_count')
+    op.drop_column('users', 'follower_count')
+    op.drop_column('users', 'comment_count')
+    op.drop_column('users', 'post_count')
@@ -0,0 +1,68 @@
+"""unique attendance per user and activity
+
+Keeps one application of a user to an activity, the one with the most
+advanced status (attended, accepted, reviewing, rejected) and then the
+oldest, before adding the unique index, and recomputes the attendance
+rollup from what is left.
+
+Revision ID: e5a2c8f4b710
+Revises: d93a5b7c1e08
+Create Date: 2026-10-18 18:02:11.418370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a2c8f4b710'
+down_revision = 'd93a5b7c1e08'
+branch_labels = None
+depends_on = None
+
+PRECEDENCE = {'attended': 4, 'accepted': 3, 'reviewing': 2, 'rejected': 1}
+
+ROLLUP = (
+    "INSERT INTO attend_rollups "
+    "(club_id, activity_id, user_id, status, count) "
+    "SELECT activities.club_id, {activity}, {user}, attends.status, "
+    "count(attends.id) FROM attends "
+    "JOIN activities ON activities.id = attends.activity_id "
+    "WHERE attends.status IS NOT NULL {where} "
+    "GROUP BY activities.club_id, {group}attends.status")
+
+
+def upgrade():
+    connection = op.get_bind()
+    duplicates = connection.execute(
+        "SELECT attends.id, attends.user_id, attends.activity_id, "
+        "attends.status FROM attends JOIN "
+        "(SELECT user_id, activity_id FROM attends "
+        "GROUP BY user_id, activity_id HAVING count(*) > 1) duplicates "
+        "ON duplicates.user_id = attends.user_id "
+        "AND duplicates.activity_id = attends.activity_id").fetchall()
+    best = {}
+    for id, user_id, activity_id, status in duplicates:
+        rank = (PRECEDENCE.get(status, 0), -id)
+        key = (user_id, activity_id)
+        if key not in best or rank > best[key][0]:
+            best[key] = (rank, id)
+    keep = set(id for rank, id in best.values())
+    remove = [row[0] for row in duplicates if row[0] not in keep]
+    attends = sa.table('attends', sa.column('id'))
+    for i in range(0, len(remove), 500):
+        connection.execute(attends.delete().where(
+            attends.c.id.in_(remove[i:i + 500])))
+    op.create_index('uq_attends_user_id_activity_id', 'attends', ['user_id', 'activity_id'], unique=True)
+
+    op.execute('DELETE FROM attend_rollups')
+    op.execute(ROLLUP.format(activity='0', user='0', where='', group=''))
+    op.execute(ROLLUP.format(activity='attends.activity_id', user='0',
+                             where='', group='attends.activity_id, '))
+    op.execute(ROLLUP.format(activity='0', user='attends.user_id',
+                             where='AND attends.user_id IS NOT NULL',
+                             group='attends.user_id, '))
+
+
+def downgrade():
+    op.drop_index('uq_attends_user_id_activity_id', table_name='attends')
@@ -0,0 +1,141 @@
+import unittest
+from unittest import mock
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db
+from app.models import AnonymousUser, Activity, ActivityStatus, Attend, \
+    AttendStatus, Club, Role, User
+
+
+class AttendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.club = Club(name='chess', members=[self.user])
+        self.activities = [Activity(name='open %d' % i, club=self.club,
+                                    status=ActivityStatus.accepted)
+                           for i in range(4)]
+        db.session.add_all([self.user, self.club] + self.activities)
+        db.session.add_all([
+            Attend(user=self.user, activity=self.activities[0],
+                   status=AttendStatus.attended),
+            Attend(user=self.user, activity=self.activities[1],
+                   status=AttendStatus.reviewing),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_attend_statuses(self):
+        a = self.activities
+        self.assertEqual(
+            self.user.attend_statuses(activity.id for activity in a),
+            {a[0].id: AttendStatus.attended,
+             a[1].id: AttendStatus.reviewing})
+        self.assertEqual(self.user.attend_statuses([]), {})
+        self.assertEqual(AnonymousUser().attend_statuses([a[0].id]), {})
+
+    def test_has_attended(self):
+        self.assertTrue(self.user.has_attended(self.activities[0]))
+        self.assertFalse(self.user.has_attended(self.activities[1]))
+        self.assertFalse(self.user.has_attended(self.activities[2]))
+
+    def test_unique(self):
+        db.session.add(Attend(user=self.user, activity=self.activities[1]))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+    def test_duplicate_application(self):
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(self.user.id)
+            session['_fresh'] = True
+        response = client.post('/club/apply_to_attend/%d'
+                               % self.activities[1].id, data={})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Attend.query.filter_by(
+            activity_id=self.activities[1].id).count(), 1)
+
+    def test_concurrent_application(self):
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(self.user.id)
+            session['_fresh'] = True
+        activity_id = self.activities[1].id
+        url = '/club/apply_to_attend/%d' % activity_id
+        # the other application is committed after the first check
+        with mock.patch.object(User, 'attend_statuses', side_effect=[
+                {}, {activity_id: AttendStatus.reviewing}]):
+            response = client.post(url, data={})
+        self.assertEqual(response.status_code, 302)
+        # an IntegrityError that is not a duplicate application propagates
+        with mock.patch.object(User, 'attend_statuses', return_value={}):
+            with self.assertRaises(IntegrityError):
+                client.post(url, data={})
+
+    def test_badges(self):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(self.user.id)
+            session['_fresh'] = True
+
+        def render():
+            client.get('/club/activities/all')
+            statements = []
+
+            def count(*args):
+                statements.append(args[2])
+
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                html = client.get('/club/activities/all') \
+                    .get_data(as_text=True)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+            return html, statements
+
+        html, statements = render()
+        self.assertIn('已经答到', html)
+        self.assertIn('审核中', html)
+        self.assertEqual(
+            len([s for s in statements if 'FROM attends' in s]), 1)
+        for activity in self.activities[2:]:
+            db.session.add(Attend(user=self.user, activity=activity))
+        db.session.add_all([Activity(name='more', club=self.club,
+                                     status=ActivityStatus.accepted)
+                            for i in range(3)])
+        db.session.commit()
+        self.assertEqual(len(render()[1]), len(statements))
+
+    def test_club_badges_revalidate(self):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(self.user.id)
+            session['_fresh'] = True
+        url = '/club/club/%d/ongoing' % self.club.id
+        response = client.get(url)
+        self.assertIn('审核中', response.get_data(as_text=True))
+        etag = response.headers['ETag']
+        Attend.query.filter_by(activity_id=self.activities[1].id) \
+            .update({'status': AttendStatus.accepted})
+        Activity.touch([self.activities[1].id])
+        db.session.commit()
+        response = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('已接受', response.get_data(as_text=True))
+
+    def test_anonymous_activity_detail(self):
+        response = self.app.test_client().get(
+            '/club/activity/%d' % self.activities[0].id)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,146 @@
+import json
+import time
+import unittest
+from sqlalchemy import event
+from app import create_app, db, rollup
+from app.models import User, Role, Club, Activity, ActivityStatus, Attend, \
+    AttendStatus
+from app.writebehind import checkins
+
+
+class CheckinTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.u1 = User(email='john@example.com', username='john',
+                       password='cat', confirmed=True)
+        self.u2 = User(email='susan@example.org', username='susan',
+                       password='dog', confirmed=True)
+        self.club = Club(name='chess', members=[self.u1, self.u2])
+        self.activity = Activity(name='open', club=self.club,
+                                 status=ActivityStatus.rollcall)
+        db.session.add_all([self.u1, self.u2, self.club, self.activity])
+        db.session.add_all([
+            Attend(user=self.u1, activity=self.activity,
+                   status=AttendStatus.accepted),
+            Attend(user=self.u2, activity=self.activity,
+                   status=AttendStatus.reviewing),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def check_in(self, user):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(user.id)
+            session['_fresh'] = True
+        response = client.post('/club/api/checkin/%d' % self.activity.id)
+        return response.status_code, json.loads(response.data.decode('utf-8'))
+
+    def status_of(self, user):
+        return db.session.query(Attend.status).filter_by(
+            activity_id=self.activity.id, user_id=user.id).scalar()
+
+    def test_checkin_is_idempotent(self):
+        self.assertEqual(self.check_in(self.u1), (200, {'status': 'attended'}))
+        self.assertEqual(self.check_in(self.u1), (200, {'status': 'attended'}))
+        self.assertEqual(self.status_of(self.u1), AttendStatus.attended)
+        self.assertEqual(rollup.check(), [])
+
+    def test_checkin_rejected(self):
+        self.assertEqual(self.check_in(self.u2)[0], 403)
+        self.assertEqual(self.status_of(self.u2), AttendStatus.reviewing)
+        self.activity.status = ActivityStatus.accepted
+        db.session.commit()
+        self.assertEqual(self.check_in(self.u1)[0], 409)
+        self.assertEqual(self.status_of(self.u1), AttendStatus.accepted)
+
+    def test_buffered_checkin(self):
+        self.app.config['FLASKY_CHECKIN_BUFFER'] = True
+        checkins.buffer.interval = 3600
+        self.assertEqual(self.check_in(self.u1), (202, {'status': 'queued'}))
+        # refused before queuing
+        self.assertEqual(self.check_in(self.u2)[0], 403)
+        self.assertEqual(len(checkins.buffer), 1)
+        self.assertEqual(self.status_of(self.u1), AttendStatus.accepted)
+        self.assertEqual(checkins.flush(), 1)
+        self.assertEqual(self.status_of(self.u1), AttendStatus.attended)
+        self.assertEqual(self.status_of(self.u2), AttendStatus.reviewing)
+        self.assertEqual(rollup.check(), [])
+
+    def test_buffer_flushed_by_timer(self):
+        self.app.config['FLASKY_CHECKIN_BUFFER'] = True
+        checkins.buffer.interval = 0.05
+        self.assertEqual(self.check_in(self.u1)[0], 202)
+        for i in range(100):
+            if not len(checkins.buffer):
+                break
+            time.sleep(0.05)
+        db.session.expire_all()
+        self.assertEqual(self.status_of(self.u1), AttendStatus.attended)
+        self.assertEqual(rollup.check(), [])
+
+    def test_chief_rollcall_drains_buffer(self):
+        self.app.config['FLASKY_CHECKIN_BUFFER'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        checkins.buffer.interval = 3600
+        self.club.chief = self.u2
+        db.session.commit()
+        self.check_in(self.u1)
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(self.u2.id)
+            session['_fresh'] = True
+        # showing the form writes nothing
+        response = client.get('/club/%d/roll_call' % self.activity.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(checkins.buffer), 1)
+        # the chief marks nobody present
+        client.post('/club/%d/roll_call' % self.activity.id, data={})
+        self.assertEqual(len(checkins.buffer), 0)
+        self.assertEqual(checkins.flush(), 0)
+        self.assertEqual(self.status_of(self.u1), AttendStatus.accepted)
+        self.assertEqual(rollup.check(), [])
+
+    def test_checkin_statements(self):
+        self.check_in(self.u2)
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self.assertEqual(self.check_in(self.u1)[0], 200)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        writes = [s for s in statements
+                  if s.startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(writes), 3, writes)
+        self.assertFalse([s for s in writes if 'clubs' in s], writes)
+        self.assertEqual(rollup.check(), [])
+
+    def test_finishing_roll_call_drains_buffer(self):
+        self.app.config['FLASKY_CHECKIN_BUFFER'] = True
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        checkins.buffer.interval = 3600
+        self.club.chief = self.u2
+        db.session.commit()
+        self.check_in(self.u1)
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(self.u2.id)
+            session['_fresh'] = True
+        response = client.post('/club/finish_activity/%d' % self.activity.id,
+                               data={'description': 'done'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(checkins.buffer), 0)
+        self.assertEqual(self.status_of(self.u1), AttendStatus.attended)
+        self.assertEqual(self.activity.status, ActivityStatus.finished)
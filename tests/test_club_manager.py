@@ -0,0 +1,75 @@
+import unittest
+from sqlalchemy import event
+from app import create_app, db
+from app.models import ApplicationStatus, Club, JoinApplication, Role, User
+
+
+class ClubManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.chief = User(email='john@example.com', username='john',
+                          password='cat', confirmed=True)
+        self.vice = User(email='susan@example.org', username='susan',
+                         password='dog', confirmed=True)
+        self.other = User(email='david@example.net', username='david',
+                          password='dog', confirmed=True)
+        self.club = Club(name='chess', chief=self.chief, vice=self.vice,
+                         members=[self.chief, self.vice])
+        self.application = JoinApplication(user=self.other, club=self.club)
+        db.session.add_all([self.chief, self.vice, self.other, self.club,
+                            self.application])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def client(self, user=None):
+        client = self.app.test_client()
+        if user is not None:
+            with client.session_transaction() as session:
+                session['user_id'] = str(user.id)
+                session['_fresh'] = True
+        return client
+
+    def test_access(self):
+        url = '/club/club_edit/%d' % self.club.id
+        self.assertEqual(self.client(self.chief).get(url).status_code, 200)
+        self.assertEqual(self.client(self.vice).get(url).status_code, 200)
+        self.assertEqual(self.client(self.other).get(url).status_code, 403)
+        self.assertEqual(self.client().get(url).status_code, 403)
+        self.assertEqual(self.client(self.chief).get(
+            '/club/club_edit/%d' % (self.club.id + 1)).status_code, 404)
+
+    def test_club_loaded_once(self):
+        client = self.client(self.chief)
+        client.get('/club/join_management/%d/reviewing' % self.club.id)
+        db.session.expire_all()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = client.get('/club/join_management/%d/reviewing'
+                                  % self.club.id)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len([s for s in statements if 'FROM clubs' in s]), 1)
+
+    def test_handle_application(self):
+        response = self.client(self.vice).get(
+            '/club/handle_application/accept/%d/%d'
+            % (self.club.id, self.application.id))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.application.status, ApplicationStatus.accepted)
+        self.assertIn(self.other, self.club.members.all())
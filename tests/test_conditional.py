@@ -0,0 +1,107 @@
+import time
+import unittest
+from app import create_app, db
+from app.models import Activity, ActivityStatus, Attend, AttendStatus, \
+    Club, Comment, Post, Role, User
+
+
+class ConditionalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.club = Club(name='Chess', description='Weekly matches')
+        self.activity = Activity(name='Blitz night', club=self.club,
+                                 status=ActivityStatus.accepted)
+        self.club.members.append(self.user)
+        db.session.add_all([self.user, self.club, self.activity])
+        db.session.commit()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = str(self.user.id)
+            session['_fresh'] = True
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def revalidate(self, url, change=None):
+        """Status of a conditional GET of ``url`` after ``change()``."""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        if change is not None:
+            time.sleep(0.01)
+            change()
+            db.session.commit()
+        return self.client.get(url, headers={'If-None-Match': etag}) \
+            .status_code
+
+    def test_club_detail(self):
+        url = '/club/club/%d/ongoing' % self.club.id
+        self.assertEqual(self.revalidate(url), 304)
+        self.assertEqual(self.revalidate(url + '?page=2'), 304)
+
+        def add_post():
+            db.session.add(Post(body='hi', author=self.user, club=self.club))
+        self.assertEqual(self.revalidate(url, add_post), 200)
+
+        def add_comment():
+            db.session.add(Comment(body='hi', author=self.user,
+                                   post=Post.query.first()))
+        self.assertEqual(self.revalidate(url, add_comment), 200)
+
+        def rename_activity():
+            self.activity.name = 'Rapid night'
+        self.assertEqual(self.revalidate(url, rename_activity), 200)
+
+        def leave():
+            self.user.clubs.remove(self.club)
+        self.assertEqual(self.revalidate(url, leave), 200)
+
+    def test_activity_detail(self):
+        url = '/club/activity/%d' % self.activity.id
+        self.assertEqual(self.revalidate(url), 304)
+
+        def apply():
+            db.session.add(Attend(user=self.user, activity=self.activity))
+        self.assertEqual(self.revalidate(url, apply), 200)
+
+        def rollcall():
+            self.activity.status = ActivityStatus.rollcall
+        self.assertEqual(self.revalidate(url, rollcall), 200)
+
+        attend = Attend.query.first()
+        attend.status = AttendStatus.accepted
+        db.session.commit()
+
+        def check_in():
+            Attend.check_in(self.activity.id, [self.user.id])
+        self.assertEqual(self.revalidate(url, check_in), 200)
+
+    def test_activities(self):
+        url = '/club/activities/ongoing'
+        self.assertEqual(self.revalidate(url), 304)
+
+        def delete():
+            db.session.delete(self.activity)
+        self.assertEqual(self.revalidate(url, delete), 200)
+
+    def test_other_user_and_last_modified(self):
+        url = '/club/club/%d/ongoing' % self.club.id
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, headers={
+            'If-Modified-Since': response.headers['Last-Modified']})
+            .status_code, 304)
+        etag = response.headers['ETag']
+        with self.client.session_transaction() as session:
+            session.clear()
+        self.assertEqual(self.client.get(url, headers={
+            'If-None-Match': etag}).status_code, 200)
@@ -0,0 +1,79 @@
+import gc
+import os
+import shutil
+import smtplib
+import tempfile
+import unittest
+import weakref
+from unittest import mock
+from flask_mail import Message
+from app import create_app, db, mail
+from app.email import outbox, send_email
+from app.models import Role, User
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sink = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.config['FLASKY_MAIL_SINK'] = self.sink
+        self.app.config['FLASKY_MAIL_RETRY_DELAY'] = 0
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.sink)
+
+    def test_messages_are_written_to_sink(self):
+        user = User(username='john')
+        for _ in range(3):
+            send_email('john@example.com', 'Confirm Your Account',
+                       'auth/email/confirm', user=user, token='abc')
+        outbox.join()
+        names = os.listdir(self.sink)
+        self.assertEqual(len(names), 3)
+        with open(os.path.join(self.sink, names[0]), 'rb') as f:
+            self.assertTrue(b'Confirm Your Account' in f.read())
+
+    def test_full_queue_sends_in_request(self):
+        self.app.config['FLASKY_MAIL_QUEUE_SIZE'] = 1
+        self.app.config['FLASKY_MAIL_WORKERS'] = 0
+        outbox.init_app(self.app)
+        msg = Message('hello', sender='a@example.com',
+                      recipients=['b@example.com'], body='hi')
+        outbox.put(msg)
+        outbox.put(msg)
+        self.assertEqual(outbox.queue.qsize(), 1)
+        self.assertEqual(len(os.listdir(self.sink)), 1)
+        outbox.deliver(self.app, [outbox.queue.get_nowait()])
+        self.assertEqual(len(os.listdir(self.sink)), 2)
+
+    def test_batch_shares_connection_and_retries(self):
+        self.app.config['FLASKY_MAIL_SINK'] = None
+        messages = [Message('hello %d' % i, sender='a@example.com',
+                            recipients=['b@example.com'], body='hi')
+                    for i in range(3)]
+        connect = mail.connect
+        calls = []
+
+        def flaky_connect():
+            calls.append(1)
+            if len(calls) == 1:
+                raise smtplib.SMTPServerDisconnected('try again')
+            return connect()
+
+        with mail.record_messages() as sent, \
+                mock.patch.object(mail, 'connect', flaky_connect):
+            outbox.deliver(self.app, messages)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(sent), 3)
+
+    def test_apps_not_kept_alive_until_exit(self):
+        app = weakref.ref(create_app('testing'))
+        gc.collect()
+        self.assertIsNone(app())
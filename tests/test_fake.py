@@ -0,0 +1,56 @@
+import unittest
+from app import create_app, db, fake, rollup
+from app.models import User, Follow, Club, Activity, Attend, Post, Comment, \
+    joins
+
+
+class FakeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def snapshot(self):
+        return (db.session.query(Follow.follower_id, Follow.followed_id)
+                .order_by(Follow.follower_id, Follow.followed_id).all(),
+                db.session.query(joins.c.user_id, joins.c.club_id)
+                .order_by(joins.c.user_id, joins.c.club_id).all(),
+                db.session.query(Post.author_id, Post.body)
+                .order_by(Post.id).all())
+
+    def test_seed(self):
+        fake.init(users=30, clubs=5, posts=50, comments=20,
+                  follows_per_user=3, skew=2, pool_size=20, batch_size=7)
+        self.assertEqual(User.query.count(), 33)
+        self.assertEqual(Club.query.count(), 6)
+        self.assertEqual(Post.query.count(), 50)
+        self.assertEqual(Comment.query.count(), 20)
+        chief = User.query.filter_by(username='chief').first()
+        self.assertTrue(chief.verify_password('chief'))
+        self.assertTrue(User.query.get(10).verify_password('password'))
+        self.assertTrue(chief.has_joined(Club.query.filter_by(
+            name='篮球社').first()))
+        for user in User.query:
+            self.assertTrue(user.is_following(user))
+        for attend in Attend.query:
+            self.assertTrue(attend.user.has_joined(attend.activity.club))
+        self.assertTrue(Activity.query.count() > 0)
+        self.assertEqual(rollup.check(), [])
+        self.assertEqual(User.repair_counters(), 0)
+        self.assertTrue(Post.query.first().body_html)
+
+    def test_seed_is_deterministic(self):
+        fake.init(users=20, clubs=5, posts=20, follows_per_user=2,
+                  pool_size=10)
+        first = self.snapshot()
+        db.drop_all()
+        db.create_all()
+        fake.init(users=20, clubs=5, posts=20, follows_per_user=2,
+                  pool_size=10)
+        self.assertEqual(self.snapshot(), first)
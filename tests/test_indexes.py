@@ -0,0 +1,79 @@
+import unittest
+from sqlalchemy import event
+from app import create_app, db
+from app.models import Activity, ActivityStatus, ApplicationStatus, Attend, \
+    AttendStatus, Comment, CreateApplication, JoinApplication, Post
+
+
+class IndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def plan(self, query):
+        """SQLite's EXPLAIN QUERY PLAN output for an ORM query."""
+        def explain(conn, cursor, statement, parameters, context,
+                    executemany):
+            return 'EXPLAIN QUERY PLAN ' + statement, parameters
+        event.listen(db.engine, 'before_cursor_execute', explain,
+                     retval=True)
+        try:
+            rows = db.session.execute(query.statement).fetchall()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', explain)
+        return '\n'.join(row[-1] for row in rows)
+
+    def assertUsesIndex(self, query, index):
+        plan = self.plan(query)
+        self.assertTrue('INDEX %s ' % index in plan + ' ', plan)
+        self.assertFalse('TEMP B-TREE' in plan, plan)
+
+    def test_attends(self):
+        self.assertUsesIndex(
+            Attend.query.filter_by(activity_id=1, user_id=2),
+            'uq_attends_user_id_activity_id')
+        self.assertUsesIndex(
+            Attend.query.filter(Attend.user_id == 2,
+                                Attend.activity_id.in_([1, 2, 3])),
+            'uq_attends_user_id_activity_id')
+        self.assertUsesIndex(
+            Attend.query.filter_by(activity_id=1,
+                                   status=AttendStatus.accepted),
+            'ix_attends_activity_id_user_id_status')
+
+    def test_activities(self):
+        self.assertUsesIndex(
+            Activity.query.filter(Activity.club_id.in_([1, 2, 3]))
+            .filter_by(status=ActivityStatus.accepted),
+            'ix_activities_club_id_status')
+
+    def test_applications(self):
+        self.assertUsesIndex(
+            JoinApplication.query.filter_by(
+                club_id=1, status=ApplicationStatus.reviewing),
+            'ix_join_applications_club_id_status')
+        self.assertUsesIndex(
+            CreateApplication.query.filter_by(
+                status=ApplicationStatus.reviewing),
+            'ix_create_applications_status')
+
+    def test_posts(self):
+        self.assertUsesIndex(
+            Post.query.filter_by(club_id=1).order_by(Post.timestamp.desc()),
+            'ix_posts_club_id_timestamp')
+        self.assertUsesIndex(
+            Post.query.filter_by(author_id=1).order_by(Post.timestamp.desc()),
+            'ix_posts_author_id_timestamp')
+
+    def test_comments(self):
+        self.assertUsesIndex(
+            Comment.query.filter_by(post_id=1)
+            .order_by(Comment.timestamp.asc()),
+            'ix_comments_post_id_timestamp')
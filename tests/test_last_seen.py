@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role
+from app.writebehind import last_seen
+
+
+class LastSeenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_LAST_SEEN_THRESHOLD'] = 60
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        last_seen.buffer.interval = 3600
+        self.u = User(email='john@example.com', password='cat',
+                      last_seen=datetime(2019, 4, 1))
+        db.session.add(self.u)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def stored_last_seen(self):
+        db.session.expire_all()
+        return User.query.get(self.u.id).last_seen
+
+    def test_touch_is_written_behind(self):
+        last_seen.touch(self.u)
+        self.assertEqual(len(last_seen.buffer), 1)
+        self.assertEqual(self.stored_last_seen(), datetime(2019, 4, 1))
+        last_seen.flush()
+        self.assertEqual(len(last_seen.buffer), 0)
+        self.assertTrue(
+            (datetime.utcnow() - self.stored_last_seen()).total_seconds() < 3)
+
+    def test_recent_touch_is_ignored(self):
+        self.u.last_seen = datetime.utcnow() - timedelta(seconds=10)
+        db.session.commit()
+        last_seen.touch(self.u)
+        self.assertEqual(len(last_seen.buffer), 0)
+
+    def test_flush_when_due(self):
+        last_seen.buffer.interval = 0
+        last_seen.touch(self.u)
+        self.assertEqual(len(last_seen.buffer), 0)
+        self.assertTrue(self.stored_last_seen() > datetime(2019, 4, 1))
+
+    def test_flushed_at_exit(self):
+        with mock.patch('app.writebehind.atexit') as atexit:
+            create_app('testing')
+        # registered once per process, not per application
+        atexit.register.assert_not_called()
+        last_seen.touch(self.u)
+        last_seen._flush_apps()
+        self.assertEqual(len(last_seen.buffer), 0)
+        self.assertTrue(
+            (datetime.utcnow() - self.stored_last_seen()).total_seconds() < 3)
@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime
+from app import create_app, db, markup
+from app.markup import renderer
+from app.models import Club, Comment, Post, Role
+
+
+class MarkupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_render_is_cached_by_content(self):
+        post = Post(body='*hello* <script>x</script>')
+        self.assertEqual(post.body_html, '<p><em>hello</em> x</p>')
+        self.assertEqual(renderer.cache.misses, 1)
+        Post(body='*hello* <script>x</script>')
+        self.assertEqual(renderer.cache.hits, 1)
+        # comments allow fewer tags, so they are cached separately
+        comment = Comment(body='*hello* <script>x</script>')
+        self.assertEqual(comment.body_html, '<em>hello</em> x')
+        self.assertEqual(len(renderer.cache), 2)
+
+    def test_unchanged_body_is_not_rendered(self):
+        post = Post(body='hello')
+        db.session.add(post)
+        db.session.commit()
+        post = Post.query.get(post.id)
+        lookups = renderer.cache.hits + renderer.cache.misses
+        post.body = post.body
+        self.assertEqual(renderer.cache.hits + renderer.cache.misses,
+                         lookups)
+
+    def test_async_render(self):
+        self.app.config['FLASKY_MARKDOWN_ASYNC'] = True
+        post = Post(body='**later**')
+        self.assertIsNone(post.body_html)
+        db.session.add(post)
+        db.session.commit()
+        renderer.wait()
+        db.session.expire_all()
+        self.assertEqual(Post.query.get(post.id).body_html,
+                         '<p><strong>later</strong></p>')
+        # a known body is taken from the cache straight away
+        self.assertEqual(Post(body='**later**').body_html,
+                         '<p><strong>later</strong></p>')
+
+    def test_rerender_in_chunks(self):
+        db.session.add_all([Post(body='*%d*' % i) for i in range(5)])
+        db.session.commit()
+        Post.query.update({'body_html': 'stale'})
+        db.session.commit()
+        progress = list(markup.rerender(Post.__table__, ['strong'],
+                                        start_id=1, chunk_size=2))
+        self.assertEqual(progress, [(3, 2), (5, 4)])
+        html = dict(db.session.query(Post.id, Post.body_html))
+        self.assertEqual(html[1], 'stale')
+        self.assertEqual(html[5], '4')
+
+    def test_rerender_touches_posts_and_clubs(self):
+        then = datetime(2000, 1, 1)
+        club = Club(name='chess', updated_at=then)
+        post = Post(body='*hi*', club=club, updated_at=then)
+        other = Post(body='*other*', updated_at=then)
+        db.session.add_all([post, other, Comment(body='*yes*', post=post)])
+        db.session.commit()
+        list(markup.rerender(Post.__table__, ['em'], start_id=0,
+                             chunk_size=1))
+        self.assertGreater(Post.query.get(other.id).updated_at, then)
+        self.assertGreater(Club.query.get(club.id).updated_at, then)
+
+        db.session.query(Post).update({'updated_at': then})
+        db.session.query(Club).update({'updated_at': then})
+        db.session.commit()
+        list(markup.rerender(Comment.__table__, ['em'], start_id=0))
+        self.assertGreater(Post.query.get(post.id).updated_at, then)
+        self.assertEqual(Post.query.get(other.id).updated_at, then)
+        self.assertGreater(Club.query.get(club.id).updated_at, then)
@@ -0,0 +1,109 @@
+import unittest
+from flask import g
+from sqlalchemy import event
+from app import create_app, db, memberships
+from app.models import AnonymousUser, Club, Role, User, load_user
+
+
+class MembershipTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        memberships.cache.timeout = 60
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.chess = Club(name='Chess')
+        self.go = Club(name='Go')
+        self.chess.members.append(self.user)
+        db.session.add_all([self.user, self.chess, self.go])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_queries(self, f):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            f()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return len(statements)
+
+    def test_loaded_once(self):
+        # load the expired instances first
+        self.user.id, self.chess.id, self.go.id
+        self.assertEqual(self.count_queries(
+            lambda: self.user.has_joined(self.chess)), 1)
+        self.assertEqual(self.count_queries(lambda: [
+            self.user.has_joined(self.chess),
+            self.user.has_joined(self.go)]), 0)
+        self.assertTrue(self.user.has_joined(self.chess))
+        self.assertFalse(self.user.has_joined(self.go))
+        self.assertFalse(self.user.has_joined(Club(name='new')))
+        # a later request reuses the cross-request cache
+        g.pop('joined_club_ids')
+        user = load_user(str(self.user.id))
+        self.assertEqual(self.count_queries(
+            lambda: user.has_joined(self.go)), 0)
+
+    def test_off_by_default(self):
+        self.assertEqual(self.app.config['FLASKY_MEMBERSHIP_CACHE_TTL'], 0)
+        memberships.cache.timeout = 0
+        self.user.id, self.go.id
+        self.assertFalse(self.user.has_joined(self.go))
+        g.pop('joined_club_ids')
+        self.assertEqual(self.count_queries(
+            lambda: self.user.has_joined(self.go)), 1)
+
+    def test_invalidated_on_commit(self):
+        self.assertFalse(self.user.has_joined(self.go))
+        self.user.clubs.append(self.go)
+        db.session.commit()
+        self.assertTrue(self.user.has_joined(self.go))
+        self.go.members.remove(self.user)
+        db.session.commit()
+        self.assertFalse(self.user.has_joined(self.go))
+        self.assertEqual(memberships.get(self.user.id),
+                         frozenset([self.chess.id]))
+
+    def test_rollback(self):
+        self.assertTrue(self.user.has_joined(self.chess))
+        self.user.clubs.remove(self.chess)
+        db.session.flush()
+        self.assertFalse(self.user.has_joined(self.chess))
+        db.session.rollback()
+        self.assertTrue(self.user.has_joined(self.chess))
+
+    def test_anonymous(self):
+        self.assertFalse(AnonymousUser().has_joined(self.chess))
+        response = self.app.test_client().get(
+            '/club/club/%d/ongoing' % self.chess.id)
+        self.assertEqual(response.status_code, 200)
+
+    def test_accepting_application(self):
+        from app.models import ApplicationStatus, JoinApplication
+        chief = User(email='chief@example.com', username='chief',
+                     password='cat', confirmed=True)
+        self.go.chief = chief
+        application = JoinApplication(user=self.user, club=self.go,
+                                      status=ApplicationStatus.reviewing)
+        db.session.add_all([chief, application])
+        db.session.commit()
+        self.assertFalse(self.user.has_joined(self.go))
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(chief.id)
+            session['_fresh'] = True
+        response = client.get('/club/handle_application/accept/%d/%d'
+                              % (self.go.id, application.id))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.user.has_joined(self.go))
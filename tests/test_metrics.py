@@ -0,0 +1,71 @@
+import gc
+import threading
+import unittest
+from app import create_app, db
+from app.metrics import metrics
+from app.metrics.registry import Registry
+from app.models import Role
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.register_blueprint(metrics, url_prefix='/metrics')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_sharded_counters(self):
+        registry = Registry([1, 5])
+
+        def work():
+            for value in range(10):
+                registry.inc('hits')
+                registry.observe('size', (('kind', 'a'),), value)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        totals = registry.collect()
+        self.assertEqual(totals[('hits', ())], 40)
+        self.assertEqual(totals[('size', (('kind', 'a'),))],
+                         [8, 16, 16, 180])
+
+    def test_finished_threads_folded(self):
+        registry = Registry([1])
+        registry.inc('hits')
+        for _ in range(20):
+            thread = threading.Thread(target=registry.inc, args=('hits',))
+            thread.start()
+            thread.join()
+        del thread
+        gc.collect()
+        # only the shard of the thread running the test is left
+        self.assertEqual(len(registry._shards), 1)
+        self.assertEqual(registry.collect(), {('hits', ()): 21})
+
+    def test_exposition(self):
+        self.client.get('/')
+        self.client.get('/no-such-page')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertTrue('flasky_request_duration_seconds_bucket{'
+                        'endpoint="main.index",le="+Inf"} 1' in text)
+        self.assertTrue('flasky_request_duration_seconds_count{'
+                        'endpoint="main.index"} 1' in text)
+        self.assertTrue('flasky_request_errors_total{'
+                        'endpoint="unmatched",status="404"} 1' in text)
+        self.assertTrue('flasky_template_render_seconds_count{'
+                        'template="index.html"} 1' in text)
+        self.assertTrue('flasky_cache_hits_total{cache="principals"}' in text)
+        self.assertTrue('flasky_cache_misses_total{cache="markdown"}' in text)
+        self.assertTrue('flasky_mail_queue_depth 0' in text)
@@ -0,0 +1,208 @@
+import shutil
+import tempfile
+import time
+import unittest
+from app import create_app, db, markup
+from app.models import Activity, ActivityStatus, Attend, AttendStatus, \
+    Club, Comment, Post, Role, User
+from app.pagecache import FileSystemStore, MemoryStore, page_cache
+from app.writebehind import checkins, last_seen
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_store(self, store):
+        store.set('a', 1)
+        store.set('b', (2, b'x'), timeout=60)
+        store.set('c', 3, timeout=-1)
+        self.assertEqual(store.get('a'), 1)
+        self.assertEqual(store.get('b'), (2, b'x'))
+        self.assertIsNone(store.get('c'))
+        store.delete('a')
+        self.assertIsNone(store.get('a'))
+        store.set('d', 4)
+        store.set('e', 5)
+        self.assertLessEqual(len(store), 3)
+        self.assertEqual(store.get('e'), 5)
+        store.clear()
+        self.assertEqual(len(store), 0)
+
+    def test_memory(self):
+        self.check_store(MemoryStore(3))
+
+    def test_filesystem(self):
+        store = FileSystemStore(self.directory, 3)
+        self.check_store(store)
+        # a second process sees the same entries
+        store.set('shared', 'value')
+        self.assertEqual(FileSystemStore(self.directory, 3).get('shared'),
+                         'value')
+
+    def test_filesystem_evicts_oldest(self):
+        store = FileSystemStore(self.directory, 2)
+        store.set('a', 1)
+        time.sleep(0.01)
+        store.set('b', 2)
+        time.sleep(0.01)
+        store.set('c', 3)
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.get('c'), 3)
+
+
+class PageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_PAGE_CACHE'] = 'memory'
+        page_cache.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.club = Club(name='Chess', description='Weekly matches')
+        db.session.add_all([self.user, self.club])
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.headers.get('X-Page-Cache'), \
+            response.get_data(as_text=True)
+
+    def login(self):
+        with self.client.session_transaction() as session:
+            session['user_id'] = str(self.user.id)
+            session['_fresh'] = True
+
+    def test_anonymous_pages_are_cached(self):
+        url = '/club/club/%d/ongoing' % self.club.id
+        self.assertEqual(self.get(url)[0], 'MISS')
+        status, body = self.get(url)
+        self.assertEqual(status, 'HIT')
+        self.assertIn('Weekly matches', body)
+        # page and category are part of the key
+        self.assertEqual(self.get(url + '?page=2')[0], 'MISS')
+        self.assertEqual(
+            self.get('/club/club/%d/finished' % self.club.id)[0], 'MISS')
+        self.assertEqual(self.get('/club/about')[0], 'MISS')
+        self.assertEqual(self.get('/club/about')[0], 'HIT')
+
+    def test_changes_invalidate(self):
+        url = '/club/club/%d/ongoing' % self.club.id
+        profile = '/user/john'
+        self.get(url)
+        self.get(profile)
+        post = Post(body='Opening theory', author=self.user, club=self.club)
+        db.session.add(post)
+        db.session.commit()
+        status, body = self.get(url)
+        self.assertEqual(status, 'MISS')
+        self.assertIn('Opening theory', body)
+        self.assertEqual(self.get(profile)[0], 'MISS')
+
+        self.assertEqual(self.get(url)[0], 'HIT')
+        db.session.add(Activity(name='Blitz night', club=self.club,
+                                 status=ActivityStatus.accepted))
+        db.session.commit()
+        self.assertIn('Blitz night', self.get(url)[1])
+
+        self.get(url)
+        db.session.add(Comment(body='nice', post=post, author=self.user))
+        db.session.commit()
+        self.assertIn('1 Comments', self.get(url)[1])
+
+        self.get(url)
+        self.club.description = 'Monthly matches'
+        db.session.commit()
+        self.assertIn('Monthly matches', self.get(url)[1])
+
+    def test_chief_only_categories(self):
+        db.session.add_all([
+            Activity(name='Secret plan', club=self.club,
+                     status=ActivityStatus.reviewing),
+            Activity(name='Roll call', club=self.club,
+                     status=ActivityStatus.rollcall)])
+        db.session.commit()
+        for category in ('reviewing', 'rejected'):
+            response = self.client.get('/club/club/%d/%s'
+                                       % (self.club.id, category))
+            self.assertEqual(response.status_code, 404)
+        body = self.get('/club/club/%d/ongoing' % self.club.id)[1]
+        self.assertIn('Roll call', body)
+        self.assertNotIn('Secret plan', body)
+
+    def test_core_writes_invalidate(self):
+        url = '/club/club/%d/ongoing' % self.club.id
+        profile = '/user/john'
+        activity = Activity(name='Blitz night', club=self.club,
+                            status=ActivityStatus.rollcall)
+        db.session.add(activity)
+        db.session.commit()
+        self.get(url)
+        db.session.add(Attend(user=self.user, activity=activity,
+                              status=AttendStatus.accepted))
+        db.session.commit()
+        self.assertEqual(self.get(url)[0], 'MISS')
+        # the check-in UPDATE bypasses the session
+        self.app.config['FLASKY_CHECKIN_BUFFER'] = True
+        checkins.add(activity.id, self.user.id)
+        self.assertEqual(checkins.flush(), 1)
+        self.assertEqual(self.get(url)[0], 'MISS')
+
+        self.get(profile)
+        last_seen.buffer.add(self.user.id, self.user.last_seen)
+        last_seen.flush()
+        self.assertEqual(self.get(profile)[0], 'MISS')
+
+        # so does flask rerender
+        db.session.add(Post(body='*move*', author=self.user))
+        db.session.commit()
+        self.get(profile)
+        list(markup.rerender(Post.__table__, ['em'], start_id=0))
+        self.assertEqual(self.get(profile)[0], 'MISS')
+
+    def test_rollback_keeps_entries(self):
+        url = '/club/club/%d/ongoing' % self.club.id
+        self.get(url)
+        self.club.description = 'Monthly matches'
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.get(url)[0], 'HIT')
+
+    def test_authenticated_users_bypass_page_cache(self):
+        self.login()
+        status, body = self.get('/club/clubs')
+        self.assertIsNone(status)
+        self.assertIsNone(self.get('/club/about')[0])
+
+    def test_all_clubs_fragment(self):
+        self.login()
+        self.client.set_cookie('localhost', 'show_all_clubs', '1')
+        self.assertIn('Chess', self.get('/club/clubs')[1])
+        store = self.app.extensions['page_cache']
+        hits = store.hits
+        self.get('/club/clubs')
+        self.assertGreater(store.hits, hits)
+        db.session.add(Club(name='Go'))
+        db.session.commit()
+        self.assertIn('Go', self.get('/club/clubs')[1])
+
+    def test_flashes_bypass_page_cache(self):
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('message', 'hello')]
+        status, body = self.get('/club/about')
+        self.assertIsNone(status)
+        self.assertIn('hello', body)
+        self.assertEqual(self.get('/club/about')[0], 'MISS')
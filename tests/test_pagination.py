@@ -0,0 +1,67 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Post
+from app.pagination import KeysetPagination
+
+
+class KeysetPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat')
+        db.session.add(self.user)
+        # pairs of posts share a timestamp to exercise the id tie-breaker
+        base = datetime(2019, 4, 1)
+        for i in range(25):
+            db.session.add(Post(body='post %d' % i, author=self.user,
+                                timestamp=base + timedelta(minutes=i // 2)))
+        db.session.commit()
+        self.expected = [p.id for p in Post.query.order_by(
+            Post.timestamp.desc(), Post.id.desc())]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def paginate(self, cursor=None):
+        return KeysetPagination(Post.query, Post.timestamp, Post.id,
+                                cursor=cursor, per_page=10)
+
+    def test_walk_forward_and_back(self):
+        first = self.paginate()
+        self.assertFalse(first.has_prev)
+        self.assertTrue(first.has_next)
+        second = self.paginate(first.next_cursor)
+        third = self.paginate(second.next_cursor)
+        self.assertFalse(third.has_next)
+        self.assertIsNone(third.next_cursor)
+        seen = [p.id for p in first.items + second.items + third.items]
+        self.assertEqual(seen, self.expected)
+
+        back = self.paginate(third.prev_cursor)
+        self.assertEqual([p.id for p in back.items],
+                         [p.id for p in second.items])
+        self.assertTrue(back.has_next)
+        back = self.paginate(back.prev_cursor)
+        self.assertEqual([p.id for p in back.items],
+                         [p.id for p in first.items])
+        self.assertFalse(back.has_prev)
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        first = self.paginate()
+        page = self.paginate(first.next_cursor + 'x')
+        self.assertEqual([p.id for p in page.items], self.expected[:10])
+
+    def test_index_renders_cursor_links(self):
+        self.app.config['FLASKY_KEYSET_PAGINATION'] = True
+        client = self.app.test_client()
+        response = client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('cursor=', response.get_data(as_text=True))
+        self.assertNotIn('page=2', response.get_data(as_text=True))
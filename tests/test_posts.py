@@ -0,0 +1,42 @@
+import unittest
+from flask import render_template
+from flask_sqlalchemy import get_debug_queries
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+
+
+class PostListingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        for i in range(5):
+            u = User(email='user%d@example.com' % i, username='user%d' % i,
+                     password='cat')
+            p = Post(body='post %d' % i, author=u)
+            db.session.add_all([u, p])
+            for j in range(i):
+                db.session.add(Comment(body='comment', post=p, author=u))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_comment_counts(self):
+        posts = Post.load_listing(Post.query.order_by(Post.id))
+        self.assertEqual([p.comment_count for p in posts], [0, 1, 2, 3, 4])
+        self.assertEqual(Post.query.get(5).comment_count, 4)
+
+    def test_listing_renders_without_per_post_queries(self):
+        db.session.remove()
+        with self.app.test_request_context('/'):
+            posts = Post.load_listing(Post.query.order_by(Post.id))
+            before = len(get_debug_queries())
+            html = render_template('_posts.html', posts=posts)
+            self.assertEqual(len(get_debug_queries()), before)
+        self.assertIn('user4', html)
+        self.assertIn('4 Comments', html)
@@ -0,0 +1,153 @@
+import unittest
+from sqlalchemy import event
+from app import create_app, db, rollup, statistics
+from app.models import User, Role, Club, Activity, Attend, AttendStatus, \
+    AttendRollup
+
+
+class RollupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_ATTEND_ROLLUP'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.u1 = User(email='john@example.com', name='john', password='cat')
+        self.u2 = User(email='susan@example.org', name='susan',
+                       password='dog')
+        self.club = Club(name='chess', members=[self.u1, self.u2])
+        self.a1 = Activity(name='open', club=self.club)
+        self.a2 = Activity(name='blitz', club=self.club)
+        db.session.add_all([self.u1, self.u2, self.club, self.a1, self.a2])
+        db.session.add_all([
+            Attend(user=self.u1, activity=self.a1),
+            Attend(user=self.u1, activity=self.a2),
+            Attend(user=self.u2, activity=self.a1),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def counter(self, status, activity_id=0, user_id=0):
+        row = AttendRollup.query.get((self.club.id, activity_id, user_id,
+                                      status))
+        return row.count if row else 0
+
+    def test_maintained_on_status_change(self):
+        self.assertEqual(self.counter(AttendStatus.reviewing), 3)
+        attend = Attend.query.filter_by(user=self.u1, activity=self.a1).first()
+        attend.status = AttendStatus.accepted
+        db.session.commit()
+        # changing an expired attribute still knows the previous status
+        attend.status = AttendStatus.attended
+        db.session.commit()
+        self.assertEqual(self.counter(AttendStatus.reviewing), 2)
+        self.assertEqual(self.counter(AttendStatus.accepted), 0)
+        self.assertEqual(self.counter(AttendStatus.attended), 1)
+        self.assertEqual(self.counter(AttendStatus.attended,
+                                      activity_id=self.a1.id), 1)
+        self.assertEqual(self.counter(AttendStatus.attended,
+                                      user_id=self.u1.id), 1)
+        db.session.delete(attend)
+        db.session.commit()
+        self.assertEqual(self.counter(AttendStatus.attended), 0)
+        self.assertEqual(rollup.check(), [])
+
+    def test_statistics_read_from_rollup(self):
+        self.assertEqual(dict(statistics.club_attendance()), {'chess': 3})
+        self.assertEqual(
+            dict(statistics.club_member_attendance(self.club.id)),
+            {'john': 2, 'susan': 1})
+        self.assertEqual(
+            dict(statistics.club_activity_attendance(self.club.id)),
+            {'open': 2, 'blitz': 1})
+        self.assertEqual(dict(statistics.student_attendance(self.u1.id)),
+                         {'chess': 2})
+
+    def test_check_and_rebuild(self):
+        AttendRollup.query.delete()
+        db.session.commit()
+        self.assertEqual(len(rollup.check()), 5)
+        rollup.rebuild()
+        db.session.commit()
+        self.assertEqual(rollup.check(), [])
+        self.assertEqual(self.counter(AttendStatus.reviewing,
+                                      user_id=self.u1.id), 2)
+
+    def test_bulk_rollcall(self):
+        attends = Attend.query.order_by(Attend.id).all()
+        for attend in attends:
+            attend.status = AttendStatus.accepted
+        attends[1].status = AttendStatus.attended
+        db.session.commit()
+        a1_john, a2_john, a1_susan = [attend.id for attend in attends]
+        changes = Attend.rollcall(self.a1.id, [a1_john, a2_john])
+        self.assertEqual(changes, [(self.u1.id, AttendStatus.accepted,
+                                    AttendStatus.attended)])
+        rollup.moved(db.session.connection(), self.a1.id, changes)
+        db.session.commit()
+        self.assertEqual(rollup.check(), [])
+        statuses = dict((attend.id, attend.status)
+                        for attend in Attend.query)
+        self.assertEqual(statuses, {
+            a1_john: AttendStatus.attended,
+            # belongs to another activity, left alone
+            a2_john: AttendStatus.attended,
+            a1_susan: AttendStatus.accepted,
+        })
+        rollup.moved(db.session.connection(), self.a1.id,
+                     Attend.rollcall(self.a1.id, []))
+        db.session.commit()
+        self.assertEqual(Attend.query.get(a1_john).status,
+                         AttendStatus.accepted)
+        self.assertEqual(rollup.check(), [])
+
+    def test_upsert_creates_and_adds(self):
+        deltas = {}
+        rollup.add_delta(deltas, self.club.id, self.a2.id, self.u2.id,
+                         AttendStatus.rejected, 1)
+        rollup.add_delta(deltas, self.club.id, self.a2.id, self.u2.id,
+                         AttendStatus.rejected, 1)
+        rollup.apply_deltas(db.session.connection(), deltas)
+        rollup.apply_deltas(db.session.connection(), deltas)
+        self.assertEqual(self.counter(AttendStatus.rejected), 4)
+        self.assertEqual(self.counter(AttendStatus.rejected,
+                                      user_id=self.u2.id), 4)
+
+    def test_rollcall_touches_one_activity(self):
+        attends = Attend.query.order_by(Attend.id).all()
+        for attend in attends:
+            attend.status = AttendStatus.accepted
+        db.session.commit()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            changes = Attend.rollcall(self.a1.id, [attends[0].id])
+            rollup.moved(db.session.connection(), self.a1.id, changes)
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(rollup.check(), [])
+        self.assertFalse([s for s in statements
+                          if s.startswith('DELETE')], statements)
+        self.assertEqual(len([s for s in statements
+                              if 'attend_rollups' in s]), 1)
+
+    def test_rollcall_race_rebuilds(self):
+        attends = Attend.query.order_by(Attend.id).all()
+        attends[0].status = AttendStatus.accepted
+        db.session.commit()
+        # the rollup is not told about this change
+        Attend.query.filter_by(id=attends[0].id).update(
+            {'status': AttendStatus.attended}, synchronize_session=False)
+        rollup.moved(db.session.connection(), self.a1.id, None)
+        db.session.commit()
+        self.assertEqual(rollup.check(), [])
@@ -0,0 +1,183 @@
+import unittest
+from app import create_app, db, search
+from app.models import Activity, ActivityStatus, Club, Post, Role, User
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        self.club = Club(name='Chess', description='Weekly chess matches')
+        db.session.add_all([self.user, self.club])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def kinds(self, query, **kwargs):
+        return [(r.kind, r.id) for r in search.search(query, **kwargs).items]
+
+    def test_index_follows_model_events(self):
+        activity = Activity(name='Blitz night', description='Fast chess',
+                            club=self.club, status=ActivityStatus.accepted)
+        post = Post(body='Bring your own chess clock', author=self.user)
+        db.session.add_all([activity, post])
+        db.session.commit()
+        self.assertEqual(set(self.kinds('chess')),
+                         {('club', self.club.id), ('activity', activity.id),
+                          ('post', post.id)})
+        self.assertEqual(self.kinds('chess', kind='post'),
+                         [('post', post.id)])
+
+        post.body = 'Bring your own timer'
+        db.session.commit()
+        self.assertEqual(self.kinds('clock'), [])
+        self.assertEqual(self.kinds('timer'), [('post', post.id)])
+
+        db.session.delete(activity)
+        db.session.commit()
+        self.assertEqual(self.kinds('blitz'), [])
+
+    def test_ranking_prefix_and_syntax(self):
+        other = Club(name='Go', description='chess players welcome too')
+        db.session.add(other)
+        db.session.commit()
+        self.assertEqual(self.kinds('chess')[0], ('club', self.club.id))
+        self.assertEqual(self.kinds('ches'), self.kinds('chess'))
+        self.assertEqual(self.kinds('match chess'), [('club', self.club.id)])
+        self.assertEqual(self.kinds('"chess OR'), [])
+        self.assertEqual(self.kinds('   '), [])
+
+    def test_highlight_escapes(self):
+        post = Post(body='<script>chess</script>', author=self.user)
+        db.session.add(post)
+        db.session.commit()
+        result = search.search('chess', kind='post').items[0]
+        self.assertIn('<mark>chess</mark>', result.excerpt)
+        self.assertNotIn('<script>', result.excerpt)
+
+    def test_pagination_without_count(self):
+        db.session.add_all([Post(body='chess %d' % i, author=self.user)
+                            for i in range(5)])
+        db.session.commit()
+        first = search.search('chess', kind='post', per_page=2)
+        self.assertEqual(len(first.items), 2)
+        self.assertTrue(first.has_next)
+        last = search.search('chess', kind='post', page=3, per_page=2)
+        self.assertEqual(len(last.items), 1)
+        self.assertFalse(last.has_next)
+
+    def test_old_documents_ranked(self):
+        db.session.add_all([Post(body='a game of chess %d' % i,
+                                 author=self.user) for i in range(30)])
+        db.session.commit()
+        results = self.kinds('chess', per_page=50)
+        self.assertEqual(len(results), 31)
+        self.assertEqual(results[0], ('club', self.club.id))
+
+    def test_frequent_words_newest_first(self):
+        self.app.config['FLASKY_SEARCH_CANDIDATES'] = 10
+        posts = [Post(body='chess %d' % i, author=self.user)
+                 for i in range(20)]
+        posts[0].body = 'chess chess chess'
+        db.session.add_all(posts)
+        db.session.commit()
+        results = self.kinds('chess', kind='post', per_page=50)
+        self.assertEqual(results,
+                         [('post', post.id) for post in reversed(posts)])
+        self.assertEqual(self.kinds('chess', kind='club'),
+                         [('club', self.club.id)])
+        # a word in few documents is still ranked
+        self.assertEqual(self.kinds('weekly'), [('club', self.club.id)])
+
+    def test_short_words(self):
+        post = Post(body='周末下围棋, go 123', author=self.user)
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(self.kinds('围棋'), [('post', post.id)])
+        self.assertEqual(self.kinds('棋'), [('post', post.id)])
+        self.assertEqual(self.kinds('go'), [('post', post.id)])
+        self.assertEqual(self.kinds('3'), [('post', post.id)])
+        self.assertEqual(self.kinds('末下'), [('post', post.id)])
+        # the comma separates the characters
+        self.assertEqual(self.kinds('棋g'), [])
+        self.assertEqual(self.kinds('%'), [])
+        post.body = '周末下象棋'
+        db.session.commit()
+        self.assertEqual(self.kinds('围棋'), [])
+        self.assertEqual(self.kinds('象棋'), [('post', post.id)])
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(self.kinds('象棋'), [])
+
+    def test_chinese(self):
+        club = Club(name='篮球社', description='每周打篮球')
+        post = Post(body='我们的篮球社周末活动', author=self.user)
+        db.session.add_all([club, post])
+        db.session.commit()
+        both = {('club', club.id), ('post', post.id)}
+        self.assertEqual(set(self.kinds('篮球社')), both)
+        self.assertEqual(set(self.kinds('球社')), both)
+        self.assertEqual(set(self.kinds('篮球')), both)
+        self.assertEqual(self.kinds('打篮球'), [('club', club.id)])
+        self.assertEqual(self.kinds('活动'), [('post', post.id)])
+        self.assertEqual(self.kinds('周末'), [('post', post.id)])
+        self.assertEqual(self.kinds('篮球社 周末'), [('post', post.id)])
+        self.assertEqual(self.kinds('100%'), [])
+        result = search.search('周末', kind='post').items[0]
+        self.assertIn('<mark>周末</mark>', result.excerpt)
+
+    def test_only_published_activities(self):
+        activity = Activity(name='Blitz night', club=self.club)
+        db.session.add(activity)
+        db.session.commit()
+        self.assertEqual(self.kinds('blitz'), [])
+        activity.status = ActivityStatus.accepted
+        db.session.commit()
+        self.assertEqual(self.kinds('blitz'), [('activity', activity.id)])
+        activity.status = ActivityStatus.finished
+        db.session.commit()
+        self.assertEqual(self.kinds('blitz'), [('activity', activity.id)])
+        db.session.add(Activity(name='Blitz rematch', club=self.club,
+                                status=ActivityStatus.rejected))
+        db.session.commit()
+        search.rebuild()
+        self.assertEqual(self.kinds('blitz'), [('activity', activity.id)])
+        activity.status = ActivityStatus.rejected
+        db.session.commit()
+        self.assertEqual(self.kinds('blitz'), [])
+
+    def test_rebuild(self):
+        db.session.execute('DELETE FROM search_index')
+        db.session.execute('DELETE FROM search_index_bigrams')
+        self.assertEqual(self.kinds('chess'), [])
+        search.rebuild()
+        self.assertEqual(self.kinds('chess'), [('club', self.club.id)])
+        self.assertEqual(self.kinds('ch'), [('club', self.club.id)])
+        self.app.config['FLASKY_SEARCH_TOKENIZER'] = 'unicode61'
+        search.rebuild(recreate=True)
+        self.assertEqual(self.kinds('ches'), [('club', self.club.id)])
+        self.assertEqual(self.kinds('hess'), [])
+
+    def test_view(self):
+        client = self.app.test_client()
+        response = client.get('/search?q=chess')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<mark>chess</mark>', response.get_data(as_text=True))
+        response = client.get('/search?q=chess&kind=bogus&page=0')
+        self.assertEqual(response.status_code, 200)
+
+    def test_autogenerate_ignores_index(self):
+        from alembic.autogenerate import compare_metadata
+        from alembic.migration import MigrationContext
+        context = MigrationContext.configure(
+            db.session.connection(),
+            opts={'include_object': search.include_object})
+        self.assertEqual(compare_metadata(context, db.metadata), [])
@@ -0,0 +1,76 @@
+import io
+import logging
+import unittest
+from app import create_app, db
+from app.models import Post, Role, User
+
+
+class QueryStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_QUERY_HEADERS'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        user = User(email='john@example.com', username='john',
+                    password='cat')
+        db.session.add_all([Post(body='post %d' % i, author=user)
+                            for i in range(3)])
+        db.session.commit()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_headers(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(int(response.headers['X-Query-Count']) > 0)
+        self.assertTrue(float(response.headers['X-Query-Time']) >= 0)
+
+    def test_budget_warning(self):
+        self.app.config['FLASKY_QUERY_BUDGET'] = 1
+        with self.assertLogs('app.sqlstats', 'WARNING') as logs:
+            self.client.get('/')
+        self.assertTrue('Query budget exceeded by main.index' in logs.output[0])
+        self.assertTrue('SELECT' in logs.output[0])
+
+
+class ProductionLoggingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('app.sqlstats')
+        self.handlers = list(self.logger.handlers)
+        self.level = self.logger.level
+        self.app = create_app('production')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.app.config['FLASKY_QUERY_BUDGET'] = 1
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        user = User(email='john@example.com', username='john',
+                    password='cat')
+        db.session.add(Post(body='post', author=user))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.logger.handlers = self.handlers
+        self.logger.setLevel(self.level)
+
+    def test_logged_in_production(self):
+        stream = io.StringIO()
+        for handler in self.logger.handlers:
+            handler.stream = stream
+        self.assertTrue(self.logger.handlers)
+        response = self.app.test_client().get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Query-Count', response.headers)
+        output = stream.getvalue()
+        self.assertIn('INFO in app.sqlstats: GET / ', output)
+        self.assertIn('WARNING in app.sqlstats: Query budget exceeded', output)
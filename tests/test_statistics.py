@@ -0,0 +1,110 @@
+import unittest
+from app import create_app, db, statistics, statistics_cache
+from app.models import User, Role, Club, Activity, Attend, AttendStatus
+
+
+class StatisticsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        statistics_cache.cache.timeout = 60
+        db.create_all()
+        Role.insert_roles()
+        self.u1 = User(email='john@example.com', name='john', password='cat')
+        self.u2 = User(email='susan@example.org', name='susan',
+                       password='dog')
+        self.c1 = Club(name='chess')
+        self.c2 = Club(name='go')
+        self.c3 = Club(name='idle')
+        self.u1.clubs.append(self.c1)
+        self.u1.clubs.append(self.c2)
+        self.u2.clubs.append(self.c1)
+        self.a1 = Activity(name='open', club=self.c1)
+        self.a2 = Activity(name='blitz', club=self.c1)
+        self.a3 = Activity(name='league', club=self.c2)
+        db.session.add_all([self.u1, self.u2, self.c1, self.c2, self.c3,
+                            self.a1, self.a2, self.a3])
+        db.session.add_all([
+            Attend(user=self.u1, activity=self.a1),
+            Attend(user=self.u1, activity=self.a2),
+            Attend(user=self.u2, activity=self.a1),
+            Attend(user=self.u2, activity=self.a3),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_student_attendance(self):
+        self.assertEqual(dict(statistics.student_attendance(self.u1.id)),
+                         {'chess': 2, 'go': 0})
+        self.assertEqual(dict(statistics.student_attendance(self.u2.id)),
+                         {'chess': 1})
+
+    def test_club_attendance(self):
+        self.assertEqual(dict(statistics.club_member_attendance(self.c1.id)),
+                         {'john': 2, 'susan': 1})
+        self.assertEqual(
+            dict(statistics.club_activity_attendance(self.c1.id)),
+            {'open': 2, 'blitz': 1})
+        self.assertEqual(dict(statistics.club_attendance()),
+                         {'chess': 3, 'go': 1, 'idle': 0})
+
+    def test_cache_invalidated_on_attend_write(self):
+        self.assertEqual(statistics.club_attendance()['go'], 1)
+        db.session.add(Attend(user=self.u1, activity=self.a3))
+        db.session.commit()
+        self.assertEqual(statistics.club_attendance()['go'], 2)
+        attend = Attend.query.filter_by(user=self.u1,
+                                        activity=self.a3).first()
+        attend.status = AttendStatus.attended
+        db.session.commit()
+        self.assertEqual(statistics.club_attendance()['go'], 2)
+        db.session.delete(attend)
+        db.session.commit()
+        self.assertEqual(statistics.club_attendance()['go'], 1)
+
+    def test_cache_invalidated_per_club(self):
+        statistics.club_member_attendance(self.c1.id)
+        statistics.club_member_attendance(self.c2.id)
+        statistics.student_attendance(self.u2.id)
+        db.session.add(Attend(user=self.u1, activity=self.a3))
+        db.session.commit()
+        self.assertIsNotNone(statistics_cache.get(('members', self.c1.id)))
+        self.assertIsNotNone(statistics_cache.get(('student', self.u2.id)))
+        self.assertIsNone(statistics_cache.get(('members', self.c2.id)))
+        # every status is counted, a roll call changes nothing
+        statistics.club_member_attendance(self.c2.id)
+        Attend.query.filter_by(activity=self.a1).update(
+            {'status': AttendStatus.attended}, synchronize_session=False)
+        attend = Attend.query.filter_by(user=self.u1,
+                                        activity=self.a3).first()
+        attend.status = AttendStatus.accepted
+        db.session.commit()
+        self.assertIsNotNone(statistics_cache.get(('members', self.c1.id)))
+        self.assertIsNotNone(statistics_cache.get(('members', self.c2.id)))
+
+    def test_cache_invalidated_on_membership_change(self):
+        self.assertEqual(dict(statistics.club_member_attendance(self.c2.id)),
+                         {'john': 0})
+        self.assertEqual(dict(statistics.student_attendance(self.u2.id)),
+                         {'chess': 1})
+        self.u2.clubs.append(self.c2)
+        db.session.commit()
+        self.assertEqual(dict(statistics.club_member_attendance(self.c2.id)),
+                         {'john': 0, 'susan': 1})
+        self.assertEqual(dict(statistics.student_attendance(self.u2.id)),
+                         {'chess': 1, 'go': 1})
+        self.c2.members.remove(self.u1)
+        db.session.commit()
+        self.assertEqual(dict(statistics.club_member_attendance(self.c2.id)),
+                         {'susan': 1})
+
+    def test_off_by_default(self):
+        self.assertEqual(self.app.config['FLASKY_STATISTICS_CACHE_TTL'], 0)
+        statistics_cache.cache.timeout = 0
+        statistics.club_attendance()
+        self.assertIsNone(statistics_cache.get(('clubs',)))
@@ -0,0 +1,67 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db, timeline
+from app.models import User, Role, Post
+
+
+class TimelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_TIMELINE_FANOUT'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        timeline.store.max_length = 5
+        db.create_all()
+        Role.insert_roles()
+        self.u1 = User(email='john@example.com', username='john',
+                       password='cat')
+        self.u2 = User(email='susan@example.org', username='susan',
+                       password='dog')
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def page_ids(self, user, page=1, per_page=10):
+        pagination = timeline.paginate(user, Post, page, per_page)
+        return [post.id for post in pagination.items]
+
+    def test_fanout_and_rebuild(self):
+        base = datetime(2019, 4, 1)
+        p1 = Post(body='one', author=self.u2, timestamp=base)
+        db.session.add(p1)
+        db.session.commit()
+        # built on first read from followed_posts, which excludes susan
+        self.assertEqual(self.page_ids(self.u1), [])
+
+        self.u1.follow(self.u2)
+        db.session.commit()
+        self.assertFalse(timeline.store.has(self.u1.id))
+        self.assertEqual(self.page_ids(self.u1), [p1.id])
+
+        p2 = Post(body='two', author=self.u2,
+                  timestamp=base + timedelta(hours=1))
+        p3 = Post(body='three', author=self.u1,
+                  timestamp=base + timedelta(hours=2))
+        db.session.add_all([p2, p3])
+        db.session.commit()
+        self.assertEqual(self.page_ids(self.u1), [p3.id, p2.id, p1.id])
+
+        self.u1.unfollow(self.u2)
+        db.session.commit()
+        self.assertEqual(self.page_ids(self.u1), [p3.id])
+
+    def test_inbox_is_bounded(self):
+        self.page_ids(self.u1)
+        base = datetime(2019, 4, 1)
+        for i in range(8):
+            db.session.add(Post(body='post %d' % i, author=self.u1,
+                                timestamp=base + timedelta(minutes=i)))
+        db.session.commit()
+        pagination = timeline.paginate(self.u1, Post, 1, 3)
+        self.assertEqual(pagination.total, 5)
+        self.assertEqual(pagination.pages, 2)
+        self.assertEqual(len(self.page_ids(self.u1, page=2, per_page=3)), 2)
@@ -1,8 +1,11 @@
 import unittest
 import time
 from datetime import datetime
-from app import create_app, db
-from app.models import User, AnonymousUser, Role, Permission, Follow
+from flask_sqlalchemy import get_debug_queries
+from app import create_app, db, principals
+from sqlalchemy import event
+from app.models import User, AnonymousUser, Role, Permission, Follow, \
+    Post, Comment, load_user
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -206,3 +209,183 @@ class UserModelTestCase(unittest.TestCase):
         db.session.delete(u2)
         db.session.commit()
         self.assertTrue(Follow.query.count() == 1)
+
+    def test_counters(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual((u1.follower_count, u1.followed_count), (1, 1))
+        u1.follow(u2)
+        post = Post(body='hi', author=u1)
+        db.session.add_all([post, Comment(body='hi', author=u2, post=post),
+                            Comment(body='hi', author=u1, post=post)])
+        db.session.commit()
+        self.assertEqual((u1.post_count, u1.comment_count), (1, 1))
+        self.assertEqual((u1.followed_count, u2.follower_count), (2, 2))
+        self.assertEqual(u2.comment_count, 1)
+        u1.unfollow(u2)
+        db.session.delete(post.comments.filter_by(author=u2).first())
+        post.author = u2
+        db.session.commit()
+        self.assertEqual((u1.followed_count, u2.follower_count), (1, 1))
+        self.assertEqual((u1.post_count, u2.post_count), (0, 1))
+        self.assertEqual(u2.comment_count, 0)
+
+    def test_repair_counters(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add_all([u, Post(body='hi', author=u)])
+        db.session.commit()
+        self.assertEqual(User.repair_counters(), 0)
+        db.session.execute(User.__table__.update().values(
+            post_count=5, follower_count=0))
+        self.assertEqual(User.repair_counters(), 1)
+        db.session.commit()
+        self.assertEqual((u.post_count, u.follower_count), (1, 1))
+
+    def test_follow_state(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual(u1.follow_state(u2), (False, False))
+        u2.follow(u1)
+        db.session.commit()
+        self.assertEqual(u1.follow_state(u2), (False, True))
+        self.assertEqual(u2.follow_state(u1), (True, False))
+        self.assertEqual(u1.follow_state(User()), (False, False))
+
+    def test_following_ids(self):
+        users = [User(email='u%d@example.com' % i, password='cat')
+                 for i in range(4)]
+        db.session.add_all(users)
+        db.session.commit()
+        users[0].follow(users[1])
+        users[0].follow(users[3])
+        users[2].follow(users[0])
+        db.session.commit()
+        ids = [user.id for user in users]
+        self.assertEqual(users[0].following_ids(ids),
+                         {ids[0], ids[1], ids[3]})
+        self.assertEqual(users[0].following_ids(ids[2:]), {ids[3]})
+        self.assertEqual(users[0].following_ids([]), set())
+        self.assertEqual(User().following_ids(ids), set())
+
+    def test_follower_page_queries(self):
+        viewer = User(email='viewer@example.com', username='viewer',
+                      password='cat', confirmed=True)
+        star = User(email='star@example.com', username='star',
+                    password='cat', confirmed=True)
+        db.session.add_all([viewer, star])
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(viewer.id)
+            session['_fresh'] = True
+
+        def queries():
+            statements = []
+
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                response = client.get('/followers/star')
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+            self.assertEqual(response.status_code, 200)
+            return len(statements), response.get_data(as_text=True)
+
+        def add_followers(start, count):
+            fans = [User(email='fan%d@example.com' % i, username='fan%d' % i)
+                    for i in range(start, start + count)]
+            db.session.add_all(fans)
+            db.session.flush()
+            for fan in fans:
+                fan.follow(star)
+            viewer.follow(fans[0])
+            db.session.commit()
+        add_followers(0, 2)
+        few, body = queries()
+        self.assertIn('/unfollow/fan0', body)
+        self.assertIn('/follow/fan1', body)
+        add_followers(2, 40)
+        many, body = queries()
+        self.assertIn('/unfollow/fan2', body)
+        self.assertEqual(few, many)
+
+    def test_profile_counts_nothing(self):
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        other = User(email='susan@example.org', username='susan',
+                     password='dog', confirmed=True)
+        db.session.add_all([u, other, Post(body='hi', author=u)])
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(other.id)
+            session['_fresh'] = True
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement.lower())
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = client.get('/user/john')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('1 blog posts', response.get_data(as_text=True))
+        self.assertEqual([s for s in statements
+                          if 'count(' in s and 'group by' not in s], [])
+
+    def test_cached_principal(self):
+        principals.cache.timeout = 60
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        with self.app.test_request_context('/'):
+            self.assertTrue(load_user(str(u.id)) is u)
+        self.assertIsNotNone(principals.get(u.id))
+        db.session.remove()
+        with self.app.test_request_context('/'):
+            before = len(get_debug_queries())
+            user = load_user(str(u.id))
+            self.assertEqual(user.username, 'john')
+            self.assertTrue(user.can(Permission.WRITE))
+            self.assertFalse(user.is_administrator())
+            self.assertEqual(len(get_debug_queries()), before)
+            self.assertEqual(user.email, 'john@example.com')
+            self.assertTrue(user.verify_password('cat'))
+
+    def test_principal_invalidated_on_edit(self):
+        principals.cache.timeout = 60
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        load_user(str(u.id))
+        u.role = Role.query.filter_by(name='Administrator').first()
+        db.session.commit()
+        self.assertIsNone(principals.get(u.id))
+        db.session.remove()
+        self.assertTrue(load_user(str(u.id)).is_administrator())
+
+    def test_principal_cached_before_commit_forgotten(self):
+        principals.cache.timeout = 60
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        u.username = 'johnny'
+        db.session.flush()
+        # cached from the flushed row between flush and rollback
+        load_user(str(u.id))
+        self.assertIsNotNone(principals.get(u.id))
+        db.session.rollback()
+        self.assertIsNone(principals.get(u.id))
+        u.username = 'jack'
+        db.session.flush()
+        load_user(str(u.id))
+        db.session.commit()
+        self.assertIsNone(principals.get(u.id))
+        db.session.remove()
+        self.assertEqual(load_user(str(u.id)).username, 'jack')